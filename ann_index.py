@@ -0,0 +1,198 @@
+"""
+Approximate nearest-neighbour indexes for million-scale galleries
+A GalleryIndex with an ANN index only computes exact distances for the
+candidate rows the ANN index returns, instead of for every face. Recall
+is tuned with n_probe (IVF) or ef (HNSW); distances are always exact, so
+the 0.35 / 0.5 categorisation of whatever is returned is unchanged.
+
+Backends:
+    'ivf'  - inverted file index (k-means coarse quantizer), pure NumPy
+    'hnsw' - hierarchical navigable small world graph, needs the optional
+             hnswlib package
+
+Both are updated in place when the gallery matrix is repacked: build() is
+told which old row every new row was copied from, so only added faces are
+assigned (IVF) or inserted (HNSW) instead of rebuilding from scratch.
+"""
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # Optional: only needed for the 'hnsw' backend
+    hnswlib = None
+
+ANN_MIN_ROWS = 20000  # Below this an exact scan is already fast enough
+HNSW_MAX_DELETED_FRACTION = 0.5  # Rebuild the graph once this share of its nodes are deleted
+
+
+class IVFIndex:
+    """Inverted file index: faces are bucketed by their nearest k-means centroid"""
+
+    def __init__(self, n_lists=None, n_probe=16, train_iterations=10, train_sample=100000, seed=0,
+                 min_rows=ANN_MIN_ROWS):
+        self.n_lists = n_lists  # Defaults to ~4 * sqrt(rows)
+        self.n_probe = n_probe  # Lists scanned per query: higher = better recall, slower
+        self.train_iterations = train_iterations
+        self.train_sample = train_sample
+        self.seed = seed
+        self.min_rows = min_rows  # Fewer rows than this are left to an exact scan
+        self.centroids = None
+        self.trained_rows = 0
+        self.ready = False
+        self._assignments = None  # List of every row
+        self._order = None
+        self._list_offsets = None
+
+    def build(self, matrix, row_sources=None):
+        """Index matrix; row_sources[i] is the previous row that row i was copied from (-1 if new)"""
+        if len(matrix) < self.min_rows:
+            self.ready = False
+            self._assignments = None
+            return
+        # Centroids are reused until the gallery doubles; new faces are just assigned
+        if self.centroids is None or len(matrix) > 2 * self.trained_rows:
+            self._train(matrix)
+            row_sources = None
+        assignments = np.empty(len(matrix), dtype=np.int64)
+        if row_sources is None or self._assignments is None:
+            new_rows = np.arange(len(matrix))
+        else:
+            kept = row_sources >= 0
+            assignments[kept] = self._assignments[row_sources[kept]]
+            new_rows = np.flatnonzero(~kept)
+        if len(new_rows):
+            assignments[new_rows] = self._nearest_centroids(matrix[new_rows], 1)[:, 0]
+        self._assignments = assignments
+        self._order = np.argsort(assignments, kind='stable').astype(np.int64)
+        counts = np.bincount(assignments, minlength=len(self.centroids))
+        self._list_offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.ready = True
+
+    def _train(self, matrix):
+        rng = np.random.default_rng(self.seed)
+        n_lists = self.n_lists or int(4 * np.sqrt(len(matrix)))
+        n_lists = max(1, min(n_lists, len(matrix)))
+        sample_size = min(len(matrix), max(self.train_sample, 40 * n_lists))
+        sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(self.train_iterations):
+            self.centroids = centroids
+            assignments = self._nearest_centroids(sample, 1)[:, 0]
+            order = np.argsort(assignments, kind='stable')
+            counts = np.bincount(assignments, minlength=n_lists)
+            filled = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)))[filled]
+            # Empty lists keep their previous centroid
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[filled] = sums / counts[filled, None]
+
+        self.centroids = centroids.astype(np.float32)
+        self.trained_rows = len(matrix)
+
+    def _nearest_centroids(self, vectors, k, chunk_size=65536):
+        centroid_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        nearest = np.empty((len(vectors), k), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            # |c|^2 - 2xc ranks centroids the same as |x - c|^2
+            scores = centroid_norms - 2.0 * (chunk @ self.centroids.T)
+            if k == 1:
+                nearest[start:start + chunk_size, 0] = scores.argmin(axis=1)
+            elif k < scores.shape[1]:
+                nearest[start:start + chunk_size] = np.argpartition(scores, k, axis=1)[:, :k]
+            else:
+                nearest[start:start + chunk_size] = np.argsort(scores, axis=1)[:, :k]
+        return nearest
+
+    def candidates(self, query):
+        """Row ids in the n_probe lists closest to the query"""
+        n_probe = min(self.n_probe, len(self.centroids))
+        lists = self._nearest_centroids(np.asarray(query, dtype=np.float32)[None, :], n_probe)[0]
+        return np.concatenate([self._order[self._list_offsets[i]:self._list_offsets[i + 1]] for i in lists])
+
+
+class HNSWIndex:
+    """HNSW graph from the optional hnswlib package"""
+
+    def __init__(self, max_candidates=2000, ef=None, m=16, ef_construction=200, min_rows=ANN_MIN_ROWS):
+        if hnswlib is None:
+            raise ImportError("The 'hnsw' search backend needs hnswlib: pip install hnswlib")
+        self.max_candidates = max_candidates  # Neighbours fetched per query before re-ranking
+        self.ef = ef or max_candidates  # Search breadth: higher = better recall, slower
+        self.m = m
+        self.ef_construction = ef_construction
+        self.min_rows = min_rows  # Fewer rows than this are left to an exact scan
+        self.ready = False
+        self._index = None
+        self._rows = 0
+        # Graph labels are stable across repacks: row -> label and label -> row (-1 once deleted)
+        self._row_label = None
+        self._label_row = None
+        self._next_label = 0
+        self._deleted = 0
+
+    def build(self, matrix, row_sources=None):
+        """Index matrix; row_sources[i] is the previous row that row i was copied from (-1 if new)"""
+        if len(matrix) < self.min_rows:
+            self.ready = False
+            self._index = None
+            return
+        if (self._index is None or row_sources is None
+                or self._deleted > HNSW_MAX_DELETED_FRACTION * self._index.get_current_count()):
+            self._build_graph(matrix)
+        else:
+            self._update_graph(matrix, row_sources)
+        self._label_row = np.full(self._next_label, -1, dtype=np.int64)
+        self._label_row[self._row_label] = np.arange(len(matrix))
+        self._rows = len(matrix)
+        self.ready = True
+
+    def _build_graph(self, matrix):
+        index = hnswlib.Index(space='l2', dim=matrix.shape[1])
+        index.init_index(max_elements=len(matrix), ef_construction=self.ef_construction, M=self.m)
+        index.add_items(matrix, np.arange(len(matrix)))
+        index.set_ef(max(self.ef, self.max_candidates))
+        self._index = index
+        self._row_label = np.arange(len(matrix), dtype=np.int64)
+        self._next_label = len(matrix)
+        self._deleted = 0
+
+    def _update_graph(self, matrix, row_sources):
+        """Insert the new rows and mark the rows that were dropped as deleted"""
+        kept = row_sources >= 0
+        carried = np.zeros(len(self._row_label), dtype=bool)
+        carried[row_sources[kept]] = True
+        for label in self._row_label[~carried]:
+            self._index.mark_deleted(int(label))
+        self._deleted += int((~carried).sum())
+
+        new_rows = np.flatnonzero(~kept)
+        row_label = np.empty(len(matrix), dtype=np.int64)
+        row_label[kept] = self._row_label[row_sources[kept]]
+        row_label[new_rows] = np.arange(self._next_label, self._next_label + len(new_rows))
+        self._next_label += len(new_rows)
+        if len(new_rows):
+            needed = self._index.get_current_count() + len(new_rows)
+            if needed > self._index.get_max_elements():
+                self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+            self._index.add_items(matrix[new_rows], row_label[new_rows])
+        self._row_label = row_label
+
+    def candidates(self, query):
+        k = min(self.max_candidates, self._rows)
+        labels, _ = self._index.knn_query(np.asarray(query, dtype=np.float32), k=k)
+        rows = self._label_row[labels[0].astype(np.int64)]
+        return rows[rows >= 0]
+
+
+def make_ann_index(backend, **options):
+    """Create the ANN index for a search backend name; 'exact' returns None"""
+    if backend == 'exact':
+        return None
+    if backend == 'ivf':
+        return IVFIndex(**options)
+    if backend == 'hnsw':
+        return HNSWIndex(**options)
+    raise ValueError(f"Unknown search backend: {backend}")
@@ -1,291 +1,641 @@
 import os
 import face_recognition
-from flask import Flask, render_template, request, redirect
-from werkzeug.utils import secure_filename
-from PIL import Image
-import uuid
-import shutil
+from flask import (Flask, render_template, request, redirect, send_from_directory, send_file, abort,
+                   jsonify, url_for, Response, stream_with_context)
+from werkzeug.security import safe_join
 from io import BytesIO
 import sqlite3
-import pickle
 import multiprocessing
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import time
 import hashlib
+import threading
+import atexit
+import logging
+from collections import OrderedDict
+import numpy as np
+from gallery_index import TopMatches
+from gallery_shards import ShardedGalleryIndex, SearchScope, parse_date_bound
+from encoding_store import load_encoding_store
+from shard_server import ShardCluster
+from ann_index import make_ann_index
+from face_cache import (setup_face_cache, cache_face_encodings, cache_failed_images, iter_cached_face_encodings,
+                        get_cached_query_encodings, cache_query_encodings)
+from index_gallery import encode_image_timed, detect_faces
+from gallery_manifest import GalleryManifest
+from thumbnails import get_thumbnail
+from search_jobs import submit_search_job, get_search_job
+from metrics import (Gauge, render_metrics, SEARCH_STAGE_SECONDS, SEARCH_SECONDS, SEARCHES,
+                     CACHE_LOOKUPS, IMAGES_SCANNED, BACKGROUND_ENCODED, BACKGROUND_BUSY_SECONDS)
 
 app = Flask(__name__)
+# Per-image detail is logged at DEBUG; set LOG_LEVEL=DEBUG to see it
+logger = logging.getLogger(__name__)
 
 # Paths
 PHOTOS_ROOT = r"C:\Users\User1\Desktop\face recognition - v3\static\photos"  # Set your photos folder
-RESULTS_FOLDER = os.path.join('static', 'results')
-os.makedirs(RESULTS_FOLDER, exist_ok=True)
-
-# Performance optimization: Database for face encodings cache
-FACE_CACHE_DB = "face_cache.db"
-
-def setup_face_cache():
-    """Setup database for caching face encodings"""
-    conn = sqlite3.connect(FACE_CACHE_DB)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS face_cache (
-            image_path TEXT PRIMARY KEY,
-            face_encodings BLOB,
-            file_hash TEXT,
-            last_modified REAL,
-            original_name TEXT
-        )
-    ''')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_hash ON face_cache(file_hash)')
-    conn.commit()
-    conn.close()
-
-def get_file_hash(file_path):
-    """Get file hash for change detection"""
-    try:
-        stat = os.stat(file_path)
-        return f"{stat.st_mtime}_{stat.st_size}"
-    except:
-        return "unknown"
+GALLERY_CACHE_SECONDS = 24 * 60 * 60  # Browser cache lifetime for served gallery photos
+SSE_KEEPALIVE_SECONDS = 15  # Comment line sent on idle event streams so proxies keep them open
 
-def get_cached_face_encodings(image_path):
-    """Get cached face encodings if available and up-to-date"""
-    try:
-        conn = sqlite3.connect(FACE_CACHE_DB)
-        cursor = conn.cursor()
-        
-        current_hash = get_file_hash(image_path)
-        cursor.execute('''
-            SELECT face_encodings, original_name FROM face_cache 
-            WHERE image_path = ? AND file_hash = ?
-        ''', (image_path, current_hash))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            return pickle.loads(result[0]), result[1]
-        return None, None
-    except:
-        return None, None
-
-def cache_face_encodings(image_path, face_encodings, original_name):
-    """Cache face encodings for future use"""
+# Long-lived worker pool, created once and reused across searches
+WORKER_COUNT = min(multiprocessing.cpu_count(), 8)  # Don't overload system
+# Encode photos missing from the index in the web process's pool without blocking searches;
+# off by default so gallery encoding stays with index_gallery.py
+BACKGROUND_INDEXING = False
+BACKGROUND_MAX_PENDING = 4 * WORKER_COUNT  # Images queued at a time; later searches queue the rest
+worker_pool = None
+worker_pool_lock = threading.Lock()
+pending_index_paths = set()
+
+def init_worker():
+    """Load the dlib models once when a worker process starts"""
+    face_recognition.face_encodings(np.zeros((32, 32, 3), dtype=np.uint8))
+
+def get_worker_pool():
+    global worker_pool
+    with worker_pool_lock:
+        if worker_pool is None:
+            logger.info(f"⚡ Starting {WORKER_COUNT} persistent workers...")
+            worker_pool = ProcessPoolExecutor(max_workers=WORKER_COUNT, initializer=init_worker)
+            atexit.register(worker_pool.shutdown, wait=False)
+        return worker_pool
+
+def reset_worker_pool(broken_pool):
+    """Drop a pool whose worker died (out of memory, a crash in dlib); the next call starts a fresh one"""
+    global worker_pool
+    with worker_pool_lock:
+        if worker_pool is broken_pool:
+            worker_pool = None
+    broken_pool.shutdown(wait=False)
+
+# Resident in-memory index of every cached encoding, shared across searches,
+# split into one shard per YYYY/MM folder so scoped searches scan only their period
+gallery_index = None
+gallery_index_lock = threading.Lock()
+# Reconciling the index with the gallery on disk: after a first full pass, each search
+# only checks the paths of re-listed folders and of rows loaded since the last search
+reconciled_index = None
+loaded_paths = set()  # Paths loaded into the search index since it was last reconciled
+unindexed_gallery_paths = set()  # Gallery images missing from the search index (or indexed with an old hash)
+
+# Memory-mapped export of the index (python encoding_store.py) shared by every web
+# process instead of each one loading its own copy; None loads from face_cache.db
+ENCODING_STORE_DIR = None
+
+# Scatter-gather search over shard_server.py nodes, e.g. ['http://127.0.0.1:5100', 'http://127.0.0.1:5101'];
+# empty searches the in-process index instead
+SHARD_NODES = []
+shard_cluster = None
+
+# 'exact' scans every face; 'ivf' or 'hnsw' re-rank ANN candidates for 1M+ galleries
+SEARCH_BACKEND = 'exact'
+ANN_OPTIONS = {}  # e.g. {'n_probe': 32} for ivf or {'max_candidates': 5000} for hnsw
+
+# Matches returned per query face and page; None returns every match in one page
+SEARCH_TOP_K = 100
+MAX_TOP_K = 1000  # Largest top_k a client may ask for
+
+# (groups, indexed images) of recent searches, keyed by (upload SHA-256, gallery index version, ...)
+QUERY_RESULT_CACHE_SIZE = 128
+query_result_cache = OrderedDict()
+query_result_cache_lock = threading.Lock()
+
+# Persisted folder listing so searches only re-list changed folders
+WATCH_GALLERY = True  # Use a watchdog observer when the package is installed
+gallery_manifest = None
+
+def refresh_gallery_index(index):
+    """Pull rows written by the indexer since the last refresh into the index"""
+    loaded = 0
     try:
-        conn = sqlite3.connect(FACE_CACHE_DB)
-        cursor = conn.cursor()
-        
-        file_hash = get_file_hash(image_path)
-        encodings_blob = pickle.dumps(face_encodings)
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO face_cache 
-            (image_path, face_encodings, file_hash, last_modified, original_name)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (image_path, encodings_blob, file_hash, time.time(), original_name))
-        
-        conn.commit()
-        conn.close()
-    except:
-        pass  # Don't fail if caching fails
-
-def process_single_image(args):
-    """Process a single image (for parallel processing)"""
-    img_path, query_encoding = args
-    
+        for image_path, encodings, file_hash, original_name, last_modified, content_hash in \
+                iter_cached_face_encodings(modified_after=index.last_modified):
+            index.add(image_path, encodings, original_name, file_hash, content_hash)
+            index.last_modified = max(index.last_modified, last_modified)
+            loaded_paths.add(image_path)
+            loaded += 1
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️  Could not load face cache: {e}")
+    if loaded:
+        logger.info(f"🧠 Loaded {loaded} cached images into memory ({len(index)} indexed)")
+
+def get_gallery_index():
+    global gallery_index
+    if gallery_index is None:
+        setup_face_cache()
+        ann_factory = lambda: make_ann_index(SEARCH_BACKEND, **ANN_OPTIONS)
+        if ENCODING_STORE_DIR:
+            gallery_index = load_encoding_store(ENCODING_STORE_DIR, PHOTOS_ROOT, ann_factory)
+            if gallery_index is not None:
+                logger.info(f"🗺️  Mapped {len(gallery_index)} indexed images from {ENCODING_STORE_DIR}")
+        if gallery_index is None:
+            gallery_index = ShardedGalleryIndex(PHOTOS_ROOT, ann_factory)
+    refresh_gallery_index(gallery_index)
+    return gallery_index
+
+def get_search_index():
+    """The index searches run against: the shard node cluster if SHARD_NODES is set, else the local index"""
+    global shard_cluster
+    if not SHARD_NODES:
+        return get_gallery_index()
+    if shard_cluster is None:
+        setup_face_cache()
+        shard_cluster = ShardCluster(SHARD_NODES, PHOTOS_ROOT)
+        logger.info(f"🛰️  Searching {len(SHARD_NODES)} shard nodes")
+    loaded_paths.update(shard_cluster.refresh())
+    return shard_cluster
+
+def get_gallery_manifest():
+    global gallery_manifest
+    if gallery_manifest is None:
+        setup_face_cache()
+        gallery_manifest = GalleryManifest(PHOTOS_ROOT)
+        if WATCH_GALLERY and gallery_manifest.start_watcher():
+            logger.info("👀 Watching the gallery for new photos")
+    return gallery_manifest
+
+def reconcile_gallery_index(index, gallery_files, changed_paths):
+    """Keep only images whose indexed file hash still matches the file on disk
+
+    The first call checks the whole gallery; later calls only check
+    changed_paths (from GalleryManifest.scan_changes) and the rows loaded
+    since, as nothing else can have changed. Returns the gallery images that
+    are missing from the index.
+    """
+    global reconciled_index
+    if index is not reconciled_index:
+        indexed_paths = [p for p, file_hash in gallery_files.items() if index.file_hash(p) == file_hash]
+        index.retain(indexed_paths)
+        indexed = set(indexed_paths)
+        unindexed_gallery_paths.clear()
+        unindexed_gallery_paths.update(p for p in gallery_files if p not in indexed)
+        reconciled_index = index
+    else:
+        for image_path in changed_paths | loaded_paths:
+            file_hash = gallery_files.get(image_path)
+            indexed_hash = index.file_hash(image_path)
+            if indexed_hash is not None and indexed_hash != file_hash:
+                index.remove(image_path)  # Deleted or changed since it was encoded
+            if file_hash is not None and indexed_hash != file_hash:
+                unindexed_gallery_paths.add(image_path)
+            else:
+                unindexed_gallery_paths.discard(image_path)
+    loaded_paths.clear()
+    return list(unindexed_gallery_paths)
+
+def store_background_encoding(img_path, future):
+    """Write a background encoding to the cache so the next search picks it up
+
+    Faceless images and decode failures are cached as well, so they are not
+    queued again on every search.
+    """
+    with worker_pool_lock:
+        pending_index_paths.discard(img_path)
+    if future.cancelled():
+        return
     try:
-        # Check cache first
-        cached_encodings, original_name = get_cached_face_encodings(img_path)
-        
-        if cached_encodings is None:
-            # Process image normally (your exact same logic)
-            gallery_img = face_recognition.load_image_file(img_path)
-            cached_encodings = face_recognition.face_encodings(gallery_img)
-            
-            # Cache the results
-            if cached_encodings:
-                original_name = os.path.splitext(os.path.basename(img_path))[0]
-                cache_face_encodings(img_path, cached_encodings, original_name)
-        
-        if not cached_encodings:
-            return None
-        
-        # Find best match (your exact same logic)
-        best_distance = float('inf')
-        for face_encoding in cached_encodings:
-            dist = face_recognition.face_distance([query_encoding], face_encoding)[0]
-            if dist < best_distance:
-                best_distance = dist
-        
-        return {
-            'path': img_path,
-            'best_distance': best_distance,
-            'original_name': original_name
-        }
-        
-    except Exception as e:
-        print(f"Error processing {img_path}: {e}")
-        return None
+        result, seconds = future.result()
+    except BrokenProcessPool:
+        # The worker died with this image in flight; a later search queues it again
+        BACKGROUND_ENCODED.inc(result='crashed')
+        return
+    BACKGROUND_BUSY_SECONDS.inc(seconds)
+    BACKGROUND_ENCODED.inc(result='error' if result['error'] else 'faces' if result['encodings'] else 'no_faces')
+    if result['error']:
+        cache_failed_images([(result['path'], result['original_name'], result['file_hash'], result['error'])])
+    else:
+        cache_face_encodings(result['path'], result['encodings'], result['original_name'],
+                             result['file_hash'], result['content_hash'])
 
-def get_all_image_paths(folder):
-    exts = ['.jpg', '.jpeg', '.png']
-    img_files = []
-    seen_files = set()  # Track seen files to avoid duplicates
-    
-    for root, _, files in os.walk(folder):
-        for file in files:
-            if any(file.lower().endswith(ext) for ext in exts):
-                full_path = os.path.join(root, file)
-                # Use normalized path to avoid duplicates
-                normalized_path = os.path.normpath(full_path)
-                if normalized_path not in seen_files:
-                    seen_files.add(normalized_path)
-                    img_files.append(normalized_path)
-    
-    print(f"🔍 Found {len(img_files)} unique images (filtered duplicates)")
-    return img_files
+def schedule_background_indexing(image_paths):
+    """Queue unindexed images on the worker pool without waiting for them
 
-def clear_results_folder():
-    for f in os.listdir(RESULTS_FOLDER):
-        file_path = os.path.join(RESULTS_FOLDER, f)
+    At most BACKGROUND_MAX_PENDING images are in flight. A pool broken by a
+    dead worker is replaced, and the images it did not take are left for the
+    next search.
+    """
+    pool = get_worker_pool()
+    with worker_pool_lock:
+        room = BACKGROUND_MAX_PENDING - len(pending_index_paths)
+        new_paths = [p for p in image_paths if p not in pending_index_paths][:max(room, 0)]
+        pending_index_paths.update(new_paths)
+    for i, img_path in enumerate(new_paths):
         try:
-            if os.path.isfile(file_path):
-                os.unlink(file_path)
-        except Exception:
-            pass
+            future = pool.submit(encode_image_timed, img_path)
+        except BrokenProcessPool:
+            logger.error("❌ A background worker died, restarting the worker pool")
+            reset_worker_pool(pool)
+            with worker_pool_lock:
+                pending_index_paths.difference_update(new_paths[i:])
+            new_paths = new_paths[:i]
+            break
+        future.add_done_callback(lambda f, p=img_path: store_background_encoding(p, f))
+    if new_paths:
+        logger.info(f"🔄 Queued {len(new_paths)} images for background indexing")
 
-def process_search(search_file):
-    # Read uploaded image from memory
-    image_bytes = search_file.read()
-    query_img = face_recognition.load_image_file(BytesIO(image_bytes))
-    query_encodings = face_recognition.face_encodings(query_img)
-    if not query_encodings:
-        return [], []
-    query_encoding = query_encodings[0]
+def get_query_encodings(image_bytes, content_hash):
+    """Encodings of the uploaded image, reusing them when the same bytes were searched before"""
+    with SEARCH_STAGE_SECONDS.time(stage='cache_lookup'):
+        query_encodings = get_cached_query_encodings(content_hash)
+    if query_encodings is not None:
+        CACHE_LOOKUPS.inc(cache='query_encodings', result='hit')
+        logger.info("♻️  Query image seen before, skipping face detection")
+        return query_encodings
+    CACHE_LOOKUPS.inc(cache='query_encodings', result='miss')
+    with SEARCH_STAGE_SECONDS.time(stage='decode'):
+        query_img = face_recognition.load_image_file(BytesIO(image_bytes))
+    with SEARCH_STAGE_SECONDS.time(stage='detect'):
+        locations = detect_faces(query_img)
+    with SEARCH_STAGE_SECONDS.time(stage='encode'):
+        query_encodings = face_recognition.face_encodings(query_img, known_face_locations=locations) if locations else []
+    cache_query_encodings(content_hash, query_encodings)
+    return query_encodings
+
+def get_cached_result(key):
+    with query_result_cache_lock:
+        result = query_result_cache.get(key)
+        if result is not None:
+            query_result_cache.move_to_end(key)
+        return result
+
+def store_cached_result(key, result):
+    with query_result_cache_lock:
+        query_result_cache[key] = result
+        query_result_cache.move_to_end(key)
+        while len(query_result_cache) > QUERY_RESULT_CACHE_SIZE:
+            query_result_cache.popitem(last=False)
+
+def get_gallery_path(img_path):
+    """Path of a gallery photo relative to PHOTOS_ROOT, as used in /gallery/ URLs"""
+    return os.path.relpath(img_path, PHOTOS_ROOT).replace(os.sep, '/')
+
+def categorize_match(distance):
+    """'strong' (<= 0.35), 'doubtful' (<= 0.5) or None"""
+    if distance <= 0.35:
+        return 'strong'
+    if distance <= 0.5:
+        return 'doubtful'
+    return None
 
+def parse_face_selection(value):
+    """Parse a "0,2" style list of query face numbers; empty means every face"""
+    if not value:
+        return None
+    return sorted({int(part) for part in value.split(',') if part.strip()})
+
+def categorize_matches(best_by_name):
+    """Split {original_name: (img_path, distance)} into strong and doubtful match lists"""
     strong_matches = []
     doubtful_matches = []
     
-    print(f"🚀 Starting HIGH-PERFORMANCE face search...")
-    
-    # Get all image paths
-    all_image_paths = get_all_image_paths(PHOTOS_ROOT)
-    total_images = len(all_image_paths)
-    print(f"📸 Processing {total_images} images with parallel optimization...")
-    
-    # Prepare arguments for parallel processing
-    args_list = [(img_path, query_encoding) for img_path in all_image_paths]
-    
-    # Use parallel processing for massive speed improvement
-    max_workers = min(multiprocessing.cpu_count(), 8)  # Don't overload system
-    print(f"⚡ Using {max_workers} parallel workers...")
-    
-    start_time = time.time()
-    
-    # Process images in parallel
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        results = list(executor.map(process_single_image, args_list))
-    
-    processing_time = time.time() - start_time
-    print(f"⚡ Parallel processing completed in {processing_time:.2f} seconds!")
-    
-    # Process results (your exact same logic)
-    processed_original_names = set()  # Track processed original names to prevent duplicates
-    
-    for result in results:
-        if result is None:
-            continue
-            
-        img_path = result['path']
-        best_distance = result['best_distance']
-        original_name = result['original_name']
-        
-        # Skip if we've already processed this original image name
-        if original_name in processed_original_names:
-            print(f"⚠️  Skipping duplicate original name: {original_name} (from {img_path})")
-            continue
-            
-        processed_original_names.add(original_name)
-        print(f"Processed: {img_path} (distance: {best_distance:.3f})")
+    # Process results, closest first
+    for original_name, (img_path, best_distance) in sorted(best_by_name.items(), key=lambda item: item[1][1]):
+        logger.debug(f"Processed: {img_path} (distance: {best_distance:.3f})")
         
-        # Create a unique result filename that preserves original name
-        unique_id = str(uuid.uuid4())[:8]  # Use shorter UUID
-        result_filename = f"{unique_id}_{os.path.basename(img_path)}"
-        result_path = os.path.join(RESULTS_FOLDER, result_filename)
-        
-        # Copy the image to results folder
-        shutil.copy2(img_path, result_path)
+        # Results reference the gallery photo in place (served by gallery_image)
+        gallery_path = get_gallery_path(img_path)
         
         # Categorize based on best distance found - each image goes to ONLY ONE category
-        print(f"  📊 Categorizing {original_name}: distance={best_distance:.3f}")
+        logger.debug(f"  📊 Categorizing {original_name}: distance={best_distance:.3f}")
+        category = categorize_match(best_distance)
+        match = {
+            "path": gallery_path,
+            "original_name": original_name,
+            "distance": best_distance
+        }
         
-        if best_distance <= 0.35:
-            strong_matches.append({
-                "path": "results/" + result_filename,
-                "original_name": original_name,
-                "distance": best_distance
-            })
-            print(f"  ✅ Added to STRONG matches: {original_name} (distance: {best_distance:.3f})")
-        elif 0.35 < best_distance <= 0.5:
-            doubtful_matches.append({
-                "path": "results/" + result_filename,
-                "original_name": original_name,
-                "distance": best_distance
-            })
-            print(f"  🟡 Added to DOUBTFUL matches: {original_name} (distance: {best_distance:.3f})")
+        if category == 'strong':
+            strong_matches.append(match)
+            logger.debug(f"  ✅ Added to STRONG matches: {original_name} (distance: {best_distance:.3f})")
+        elif category == 'doubtful':
+            doubtful_matches.append(match)
+            logger.debug(f"  🟡 Added to DOUBTFUL matches: {original_name} (distance: {best_distance:.3f})")
         else:
-            print(f"  ❌ Distance too high ({best_distance:.3f}), not including: {original_name}")
-
-    print(f"Search complete. Strong matches: {len(strong_matches)}, Doubtful matches: {len(doubtful_matches)}")
-    print(f"⚡ Performance: {total_images} images processed in {processing_time:.2f}s = {total_images/processing_time:.1f} images/second")
+            logger.debug(f"  ❌ Distance too high ({best_distance:.3f}), not including: {original_name}")
     
     # Final verification: ensure no duplicates exist
     strong_original_names = set()
     doubtful_original_names = set()
     
-    print("\n=== DETAILED VERIFICATION ===")
-    print("Strong matches:")
+    logger.debug("=== DETAILED VERIFICATION ===")
+    logger.debug("Strong matches:")
     for match in strong_matches:
-        print(f"  - {match['path']} (original: {match['original_name']}, distance: {match['distance']:.3f})")
+        logger.debug(f"  - {match['path']} (original: {match['original_name']}, distance: {match['distance']:.3f})")
         if match["original_name"] in strong_original_names:
-            print(f"    🚨 WARNING: Duplicate original name found in strong matches: {match['original_name']}")
+            logger.warning(f"    🚨 WARNING: Duplicate original name found in strong matches: {match['original_name']}")
         strong_original_names.add(match["original_name"])
     
-    print("\nDoubtful matches:")
+    logger.debug("Doubtful matches:")
     for match in doubtful_matches:
-        print(f"  - {match['path']} (original: {match['original_name']}, distance: {match['distance']:.3f})")
+        logger.debug(f"  - {match['path']} (original: {match['original_name']}, distance: {match['distance']:.3f})")
         if match["original_name"] in doubtful_original_names:
-            print(f"    🚨 WARNING: Duplicate original name found in doubtful matches: {match['original_name']}")
+            logger.warning(f"    🚨 WARNING: Duplicate original name found in doubtful matches: {match['original_name']}")
         doubtful_original_names.add(match["original_name"])
     
     # Check for cross-duplicates between strong and doubtful
     cross_duplicates = strong_original_names.intersection(doubtful_original_names)
     if cross_duplicates:
-        print(f"\n🚨 CRITICAL ERROR: Cross-duplicates found between strong and doubtful: {cross_duplicates}")
-        print("This should NEVER happen with the new logic!")
+        logger.error(f"🚨 CRITICAL ERROR: Cross-duplicates found between strong and doubtful: {cross_duplicates}")
+        logger.error("This should NEVER happen with the new logic!")
     else:
-        print(f"\n✅ SUCCESS: No cross-duplicates found")
-    
-    print(f"\nVerification complete. Total unique images: {len(strong_original_names) + len(doubtful_original_names)}")
+        logger.debug(f"✅ SUCCESS: No cross-duplicates found")
     
+    logger.debug(f"Verification complete. Total unique images: {len(strong_original_names) + len(doubtful_original_names)}")
     return strong_matches, doubtful_matches
 
+def parse_search_scope(form):
+    """SearchScope from optional date_from/date_to ("2024", "2024-03", "2024-03-15") and folder fields"""
+    date_from = parse_date_bound(form['date_from']) if form.get('date_from') else None
+    date_to = parse_date_bound(form['date_to'], end=True) if form.get('date_to') else None
+    if date_from and date_to and date_from > date_to:
+        raise ValueError("date_from is after date_to")
+    scope = SearchScope(date_from, date_to, form.get('folder'))
+    return None if scope == SearchScope() else scope
+
+def parse_search_options(form):
+    """faces, top_k, page, stop_early and scope from a search form (raises ValueError)"""
+    faces = parse_face_selection(form.get('faces'))
+    top_k = int(form['top_k']) if form.get('top_k') else SEARCH_TOP_K
+    if top_k is not None and not 1 <= top_k <= MAX_TOP_K:
+        raise ValueError(f"top_k must be between 1 and {MAX_TOP_K}")
+    page = int(form.get('page') or 0)
+    if page < 0 or (page and top_k is None):
+        raise ValueError("page must be a non-negative number and needs top_k")
+    stop_early = form.get('stop_early', '').lower() in ('1', 'true', 'yes', 'on')
+    return {'faces': faces, 'top_k': top_k, 'page': page, 'stop_early': stop_early,
+            'scope': parse_search_scope(form)}
+
+def process_search(search_file, faces=None, progress=None, top_k=SEARCH_TOP_K, page=0, stop_early=False,
+                   scope=None):
+    """Search the gallery for every face in search_file (or the `faces` subset)
+
+    All query faces are compared in a single pass over the gallery index.
+    Returns one {'face', 'strong', 'doubtful', 'page', 'has_more'} group per
+    query face, where 'face' numbers the faces in detection order.
+
+    Only the closest (page + 1) * top_k matches per face are kept while
+    scanning, and the page-th slice of top_k is returned, so later pages are
+    computed lazily by asking again. With stop_early the scan ends as soon
+    as every face has that many strong matches (the rest of the gallery is
+    not searched, so has_more is set).
+
+    scope (a SearchScope) limits the search to a date range and/or folder;
+    only the index shards of those periods are scanned.
+
+    progress, if given, is called as progress(event, data) with 'progress'
+    events (stage and images scanned) and 'match' events as chunks of the
+    index are scanned, so a background job can stream partial results.
+    """
+    publish = progress or (lambda event, data: None)
+    search_start = time.perf_counter()
+
+    # Read uploaded image from memory
+    publish('progress', {'stage': 'encoding_query'})
+    image_bytes = search_file.read()
+    content_hash = hashlib.sha256(image_bytes).hexdigest()
+    query_encodings = get_query_encodings(image_bytes, content_hash)
+    selected_faces = [i for i in (faces if faces is not None else range(len(query_encodings)))
+                      if 0 <= i < len(query_encodings)]
+    if not selected_faces:
+        publish('progress', {'stage': 'no_face', 'faces_found': len(query_encodings)})
+        SEARCHES.inc(outcome='no_face')
+        SEARCH_SECONDS.observe(time.perf_counter() - search_start, outcome='no_face')
+        return []
+    
+    logger.info(f"🚀 Starting HIGH-PERFORMANCE face search for {len(selected_faces)} of {len(query_encodings)} faces...")
+    
+    start_time = time.time()
+    
+    keep = (page + 1) * top_k if top_k else None  # Matches per face needed for the pages asked for
+    publish('progress', {'stage': 'scanning_gallery', 'faces_found': len(query_encodings),
+                         'faces': selected_faces})
+    with gallery_index_lock:
+        # Only folders that changed since the last search are re-listed
+        with SEARCH_STAGE_SECONDS.time(stage='walk'):
+            gallery_files, changed_paths = get_gallery_manifest().scan_changes()
+        total_images = len(gallery_files)
+        logger.info(f"📸 Searching {total_images} images against the in-memory index"
+                    + (f" (scope: {scope})..." if scope else "..."))
+        with SEARCH_STAGE_SECONDS.time(stage='cache_lookup'):
+            index = get_search_index()
+            unindexed_paths = reconcile_gallery_index(index, gallery_files, changed_paths)
+            # A cluster's nodes count the images in scope as they search, so they aren't
+            # asked separately first; until they answer, every cached image is the estimate
+            indexed_count = len(index) if SHARD_NODES else index.count(scope)
+            # The same upload against an unchanged index gives the same ranking
+            result_key = (content_hash, tuple(selected_faces), index.version, top_k, page, stop_early, scope)
+            cached_result = get_cached_result(result_key)
+        if cached_result is None:
+            # Chunks are computed from a snapshot, so the lock is not held while scanning
+            queries = np.asarray(query_encodings)[selected_faces]
+            if SHARD_NODES:
+                # Each node only sends back the matches that can make the pages asked for
+                chunks = index.iter_search(queries, max_distance=0.5, scope=scope, limit=keep)
+            else:
+                chunks = index.iter_search(queries, max_distance=0.5, scope=scope)
+    
+    CACHE_LOOKUPS.inc(total_images - len(unindexed_paths), cache='gallery', result='hit')
+    CACHE_LOOKUPS.inc(len(unindexed_paths), cache='gallery', result='miss')
+    if unindexed_paths:
+        logger.warning(f"⚠️  {len(unindexed_paths)} images have no indexed faces yet")
+        if BACKGROUND_INDEXING:
+            try:
+                schedule_background_indexing(unindexed_paths)
+            except Exception:
+                # Indexing is best effort; the search itself only needs the index
+                logger.exception("❌ Could not queue background indexing")
+    if cached_result is not None:
+        cached_groups, indexed_count = cached_result
+        CACHE_LOOKUPS.inc(cache='query_results', result='hit')
+        logger.info(f"♻️  Returning cached result for a repeated search ({indexed_count} indexed images)")
+        publish('progress', {'stage': 'cached', 'total_images': total_images,
+                             'indexed': indexed_count, 'unindexed': len(unindexed_paths),
+                             'scanned': indexed_count})
+        SEARCHES.inc(outcome='cached')
+        SEARCH_SECONDS.observe(time.perf_counter() - search_start, outcome='cached')
+        return cached_groups
+    CACHE_LOOKUPS.inc(cache='query_results', result='miss')
+    
+    publish('progress', {'stage': 'searching', 'total_images': total_images,
+                         'indexed': indexed_count, 'unindexed': len(unindexed_paths),
+                         'scanned': 0})
+    
+    # Best match per query face and original name, bounded to the pages asked for;
+    # chunks are only sorted internally
+    best_by_name = [TopMatches(keep) for _ in selected_faces]
+    stopped_early = False
+    scanned_count = 0
+    distance_seconds = 0.0
+    chunk_start = time.perf_counter()
+    for chunk_matches, scanned in chunks:
+        distance_seconds += time.perf_counter() - chunk_start
+        found = []
+        for query_face, img_path, original_name, best_distance in chunk_matches:
+            if best_by_name[query_face].get(original_name) is not None:
+                # Only kept if closer than the match already found for this original image name
+                logger.debug(f"⚠️  Duplicate original name: {original_name} (from {img_path})")
+            if not best_by_name[query_face].offer(original_name, img_path, best_distance):
+                continue
+            found.append({
+                "face": selected_faces[query_face],
+                "path": get_gallery_path(img_path),
+                "original_name": original_name,
+                "distance": best_distance,
+                "category": categorize_match(best_distance)
+            })
+        if found:
+            publish('match', {'matches': found})
+        step = {'scanned': scanned}
+        if SHARD_NODES and chunks.images is not None and chunks.images != indexed_count:
+            # Every node has answered, so the images in scope are known exactly
+            indexed_count = chunks.images
+            step.update(total_images=total_images, indexed=indexed_count, unindexed=len(unindexed_paths))
+        publish('progress', step)
+        scanned_count = scanned
+        chunk_start = time.perf_counter()
+        # 0.35 is the strong match threshold (see categorize_match)
+        if stop_early and keep and all(m.count_within(0.35) >= keep for m in best_by_name):
+            stopped_early = True
+            break
+    distance_seconds += time.perf_counter() - chunk_start
+    if SHARD_NODES:
+        # A node that cut its matches at `keep` means there are more, even if the merge fits
+        for face_matches, overflowed in zip(best_by_name, chunks.overflowed):
+            face_matches.overflowed = face_matches.overflowed or overflowed
+    SEARCH_STAGE_SECONDS.observe(distance_seconds, stage='distance')
+    IMAGES_SCANNED.inc(scanned_count)
+    
+    processing_time = time.time() - start_time
+    logger.info(f"⚡ Searched {scanned_count} of {indexed_count} indexed images for {len(selected_faces)} faces in {processing_time:.3f} seconds!")
+    if stopped_early:
+        logger.info(f"⏹️  Stopped early: every face has {keep} strong matches")
+    
+    groups = []
+    first = page * top_k if top_k else 0
+    with SEARCH_STAGE_SECONDS.time(stage='results'):
+        for face, face_matches in zip(selected_faces, best_by_name):
+            logger.debug(f"👤 Query face {face + 1}:")
+            page_matches = {name: (img_path, distance) for name, img_path, distance in face_matches.ranked(first)}
+            strong_matches, doubtful_matches = categorize_matches(page_matches)
+            logger.info(f"Search complete for face {face + 1}. Strong matches: {len(strong_matches)}, Doubtful matches: {len(doubtful_matches)}")
+            groups.append({'face': face, 'strong': strong_matches, 'doubtful': doubtful_matches,
+                           'page': page, 'has_more': face_matches.overflowed or stopped_early})
+    logger.info(f"⚡ Performance: {total_images} images processed in {processing_time:.2f}s = {total_images/max(processing_time, 1e-6):.1f} images/second")
+    
+    store_cached_result(result_key, (groups, indexed_count))
+    SEARCHES.inc(outcome='searched')
+    SEARCH_SECONDS.observe(time.perf_counter() - search_start, outcome='searched')
+    return groups
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    strong = []
-    doubtful = []
+    face_groups = []
     if request.method == 'POST':
-        clear_results_folder()
         if 'file' not in request.files:
             return redirect(request.url)
         file = request.files['file']
         if file and file.filename:
-            strong, doubtful = process_search(file)
-    return render_template('index.html', strong_images=strong, doubtful_images=doubtful)
+            try:
+                options = parse_search_options(request.form)
+            except ValueError:
+                abort(400)
+            face_groups = process_search(file, **options)
+    return render_template('index.html', face_groups=face_groups)
+
+def run_search_job(image_bytes, options, progress):
+    """Job wrapper around process_search with a JSON-friendly result"""
+    return {'faces': process_search(BytesIO(image_bytes), progress=progress, **options)}
+
+@app.route('/search', methods=['POST'])
+def start_search():
+    """Start a background search and return its job id (202 Accepted)
+
+    An optional "faces" form field ("0,2") limits the search to some of the
+    faces in a group photo; by default every detected face is searched.
+    "top_k" and "page" select a page of the closest matches per face, and
+    "stop_early" ends the scan once top_k strong matches are found.
+    "date_from", "date_to" and "folder" limit the search to part of the gallery.
+    """
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'error': 'No file uploaded'}), 400
+    try:
+        options = parse_search_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid search options: {e}'}), 400
+    job = submit_search_job(run_search_job, file.read(), options)
+    return jsonify({
+        'job_id': job.id,
+        'status_url': url_for('search_status', job_id=job.id),
+        'events_url': url_for('search_events', job_id=job.id),
+    }), 202
+
+@app.route('/search/<job_id>')
+def search_status(job_id):
+    """Current state of a search job, including the result once it is done"""
+    job = get_search_job(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.to_dict())
+
+@app.route('/search/<job_id>/events')
+def search_events(job_id):
+    """Stream a job's progress and matches as Server-Sent Events"""
+    job = get_search_job(job_id)
+    if job is None:
+        abort(404)
+    # A reconnecting EventSource resumes after the last event it received
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    start = int(last_event_id) + 1 if last_event_id.isdigit() else 0
+
+    stream = job.stream_events(start, SSE_KEEPALIVE_SECONDS)
+    response = Response(stream_with_context(stream), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
+@app.route('/gallery/<path:filename>')
+def gallery_image(filename):
+    """Serve a gallery photo in place instead of copying it for each search"""
+    return send_from_directory(PHOTOS_ROOT, filename, max_age=GALLERY_CACHE_SECONDS)
+
+@app.route('/thumbnails/<path:filename>')
+def thumbnail(filename):
+    """Serve a downscaled preview of a gallery photo from the thumbnail cache"""
+    image_path = safe_join(PHOTOS_ROOT, filename)
+    if image_path is None or not os.path.isfile(image_path):
+        abort(404)
+    fmt = 'WEBP' if 'image/webp' in request.headers.get('Accept', '') else 'JPEG'
+    try:
+        thumb_path = get_thumbnail(image_path, fmt=fmt)
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️  Could not build thumbnail for {filename}: {e}")
+        return gallery_image(filename)
+    response = send_file(thumb_path, max_age=GALLERY_CACHE_SECONDS)
+    response.vary.add('Accept')
+    return response
+
+# Scrape-time gauges for the background workers and the resident index
+Gauge('face_background_pending_images', "Images queued or being encoded by the background workers",
+      callback=lambda: len(pending_index_paths))
+Gauge('face_index_images', "Images held in the in-memory gallery index",
+      callback=lambda: len(gallery_index) if gallery_index is not None else 0)
+Gauge('face_index_faces', "Unique face encodings in the packed search matrices",
+      callback=lambda: gallery_index.face_count() if gallery_index is not None else 0)
+
+@app.route('/metrics')
+def metrics():
+    """Search stage timings, cache hit rates and worker load in the Prometheus text format"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(message)s')
     # Initialize face cache database
     setup_face_cache()
+    # The debug reloader runs this block twice; only the serving process needs warm workers
+    if BACKGROUND_INDEXING and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_worker_pool()
     print("🚀 High-Performance Face Recognition System Ready!")
     print("⚡ Features: Parallel Processing + Smart Caching + Zero Quality Loss")
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped encoding store
+Exports the packed search arrays of every index shard to .npy files that
+web processes open read-only with np.load(mmap_mode='r'). Every process
+then shares one copy of the encodings in the OS page cache and starts
+without reading face_cache.db row by row.
+
+Usage:
+    python encoding_store.py                       # export to STORE_DIR
+    python encoding_store.py --out D:\\encoding_store
+
+Layout: <store>/manifest.json names the current export, <store>/v<n>/, which
+holds one folder per shard with
+    encodings.npy   faces x 128 float32, one block of rows per unique image
+    sq_norms.npy    squared norm of every row
+    offsets.npy     first row of every unique image
+    row_image.npy   unique image of every row
+    entries.json    [image_path, original_name, file_hash, content_hash, image id (-1: no faces)]
+
+A store is a snapshot: rows written to the face cache after the export are
+loaded on top of it, and a shard that changes is copied into private
+memory. Re-export (e.g. after each indexing run) to share them again.
+An export never touches the folder running processes have mapped: it
+writes a new version folder and then atomically replaces manifest.json.
+The previous version is kept for processes still opening it; older ones
+are deleted (on Windows, once no process maps them any more).
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import argparse
+import numpy as np
+from face_cache import setup_face_cache, iter_cached_face_encodings
+from gallery_index import GalleryIndex
+from gallery_shards import ShardedGalleryIndex
+
+PHOTOS_ROOT = r"C:\Users\User1\Desktop\face recognition - v3\static\photos"  # Set your photos folder
+STORE_DIR = "encoding_store"
+STORE_FORMAT = 2
+VERSION_DIR = re.compile(r'^v\d+$')  # Export folders inside a store
+UNDATED_SHARD_DIR = '_undated'  # Folder name of the "" shard
+ARRAY_NAMES = ('encodings', 'sq_norms', 'offsets', 'row_image')
+
+logger = logging.getLogger(__name__)
+
+
+def load_array(path):
+    """Map an .npy file read-only; older numpy cannot map zero-length arrays, which are tiny anyway"""
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        return np.load(path)
+
+
+class StoreShard:
+    """The mapped arrays and entry table of one exported shard"""
+
+    def __init__(self, shard_dir):
+        self.matrix = load_array(os.path.join(shard_dir, 'encodings.npy'))
+        self.sq_norms = load_array(os.path.join(shard_dir, 'sq_norms.npy'))
+        self.offsets = load_array(os.path.join(shard_dir, 'offsets.npy'))
+        self.row_image = load_array(os.path.join(shard_dir, 'row_image.npy'))
+        with open(os.path.join(shard_dir, 'entries.json'), encoding='utf-8') as f:
+            self.entries = json.load(f)
+
+
+def export_encoding_store(store_dir, photos_root):
+    """Write every cached encoding under photos_root to a new store, replacing store_dir"""
+    setup_face_cache()
+    index = ShardedGalleryIndex(photos_root)
+    for image_path, encodings, file_hash, original_name, last_modified, content_hash in \
+            iter_cached_face_encodings():
+        index.add(image_path, encodings, original_name, file_hash, content_hash)
+        index.last_modified = max(index.last_modified, last_modified)
+
+    # A new version folder, so running processes keep their mapping of the current one
+    version = f'v{time.time_ns()}'
+    faces = 0
+    for key, shard in index.shards.items():
+        arrays, entries = shard.export_arrays()
+        shard_dir = os.path.join(store_dir, version, key or UNDATED_SHARD_DIR)
+        os.makedirs(shard_dir)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(shard_dir, f'{name}.npy'), np.ascontiguousarray(arrays[name]))
+        with open(os.path.join(shard_dir, 'entries.json'), 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        faces += len(arrays['encodings'])
+    manifest = {
+        'format': STORE_FORMAT,
+        'version': version,
+        'photos_root': os.path.normpath(photos_root),
+        'last_modified': index.last_modified,  # Newest face cache row in the store
+        'exported': time.time(),
+        'shards': sorted(index.shards),
+        'images': len(index),
+        'faces': faces,
+    }
+    previous = read_manifest(store_dir)
+    manifest_path = os.path.join(store_dir, 'manifest.json')
+    os.makedirs(os.path.join(store_dir, version), exist_ok=True)  # Even with no shards
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    # Readers see the old manifest or the new one, never a missing or partial one
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    keep = {version, (previous or {}).get('version')}
+    for name in os.listdir(store_dir):
+        if VERSION_DIR.match(name) and name not in keep:
+            # On Windows a mapped file cannot be deleted; it is retried by the next export
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+    logger.info(f"💾 Exported {manifest['images']} images ({faces} faces) in {len(index.shards)} shards to {store_dir}")
+    return manifest
+
+def read_manifest(store_dir):
+    """The store's current manifest, or None"""
+    try:
+        with open(os.path.join(store_dir, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def load_encoding_store(store_dir, photos_root, ann_factory=None):
+    """Open a store as a ShardedGalleryIndex over read-only mapped arrays
+
+    Returns None if there is no usable store for photos_root.
+    """
+    manifest = read_manifest(store_dir)
+    if manifest is None:
+        return None
+    if manifest.get('format') != STORE_FORMAT or \
+            manifest.get('photos_root') != os.path.normpath(photos_root):
+        logger.warning(f"⚠️  Ignoring encoding store {store_dir}: it was exported for another gallery or version")
+        return None
+
+    index = ShardedGalleryIndex(photos_root, ann_factory)
+    for key in manifest['shards']:
+        try:
+            shard = StoreShard(os.path.join(store_dir, manifest['version'], key or UNDATED_SHARD_DIR))
+        except (OSError, ValueError) as e:
+            # e.g. an export two versions later deleted it while this process was starting
+            logger.warning(f"⚠️  Ignoring encoding store {store_dir}: {e}")
+            return None
+        index.add_shard(key, GalleryIndex.from_store(shard, index.make_shard_ann_index()))
+    # Rows written to the face cache after the export are loaded on top of the store
+    index.last_modified = manifest['last_modified']
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the face index to a memory-mapped store")
+    parser.add_argument('--photos-root', default=PHOTOS_ROOT, help="Gallery folder the cache was built for")
+    parser.add_argument('--out', default=STORE_DIR, help="Store folder to (re)write")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(message)s')
+    export_encoding_store(args.out, args.photos_root)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+SQLite cache of gallery face encodings
+Shared by the web app and the offline indexer (index_gallery.py)
+
+Every scanned image gets a row, including negative results: face_count 0
+means the image was scanned and has no faces, and a non-NULL error means
+it could not be decoded. Both are skipped until the file hash changes.
+"""
+
+import os
+import hashlib
+import sqlite3
+import pickle
+import time
+import logging
+import threading
+import numpy as np
+
+# Performance optimization: Database for face encodings cache
+FACE_CACHE_DB = "face_cache.db"
+
+logger = logging.getLogger(__name__)
+
+# Encodings are stored as raw little-endian float32 rows, face_count x 128
+ENCODING_SIZE = 128
+ENCODING_DTYPE = np.dtype('<f4')
+SCHEMA_VERSION = 3
+
+SQLITE_TIMEOUT = 30  # Seconds to wait on a locked database before failing
+SQLITE_MAX_VARIABLES = 500  # Paths per "IN (...)" query, below SQLite's limit
+QUERY_CACHE_MAX_ENTRIES = 1000  # Uploaded query images whose encodings are kept
+CONTENT_HASH_CHUNK = 1024 * 1024  # Bytes read at a time when hashing a photo
+_local = threading.local()
+
+def get_connection():
+    """Return this process's (and thread's) shared connection, in WAL mode"""
+    conn = getattr(_local, 'conn', None)
+    key = (os.getpid(), FACE_CACHE_DB)
+    # A forked worker must never reuse its parent's connection
+    if conn is None or _local.key != key:
+        conn = sqlite3.connect(FACE_CACHE_DB, timeout=SQLITE_TIMEOUT)
+        # WAL lets readers run while a writer commits; NORMAL skips the per-commit fsync
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+        _local.key = key
+    return conn
+
+def encode_face_encodings(face_encodings):
+    """Pack a list of encodings into a (blob, face_count) pair"""
+    matrix = np.asarray(face_encodings, dtype=ENCODING_DTYPE).reshape(-1, ENCODING_SIZE)
+    return matrix.tobytes(), len(matrix)
+
+def decode_face_encodings(encodings_blob, face_count):
+    """View a stored blob as a face_count x 128 float32 matrix without copying"""
+    matrix = np.frombuffer(encodings_blob, dtype=ENCODING_DTYPE)
+    if matrix.size != face_count * ENCODING_SIZE:
+        raise ValueError(f"Corrupt encodings blob: {matrix.size} values for {face_count} faces")
+    return matrix.reshape(face_count, ENCODING_SIZE)
+
+def migrate_face_cache(conn):
+    """Bring databases written by older versions up to SCHEMA_VERSION
+
+    1: pickled encoding blobs are converted to the float32 layout
+    2: rows gain a content_hash column (NULL for rows indexed before it existed)
+    3: rows gain an error column for images that failed to decode
+    """
+    cursor = conn.cursor()
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(face_cache)')]
+    if 'face_count' not in columns:
+        cursor.execute('ALTER TABLE face_cache ADD COLUMN face_count INTEGER')
+    if 'content_hash' not in columns:
+        cursor.execute('ALTER TABLE face_cache ADD COLUMN content_hash TEXT')
+    if 'error' not in columns:
+        cursor.execute('ALTER TABLE face_cache ADD COLUMN error TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_content_hash ON face_cache(content_hash)')
+
+    legacy_rows = cursor.execute(
+        'SELECT image_path, face_encodings FROM face_cache WHERE face_count IS NULL'
+    ).fetchall()
+    for image_path, legacy_blob in legacy_rows:
+        # Legacy rows were written by this app, so unpickling them once here is trusted
+        encodings_blob, face_count = encode_face_encodings(pickle.loads(legacy_blob))
+        cursor.execute(
+            'UPDATE face_cache SET face_encodings = ?, face_count = ? WHERE image_path = ?',
+            (encodings_blob, face_count, image_path)
+        )
+
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.commit()
+    if legacy_rows:
+        logger.info(f"🔧 Migrated {len(legacy_rows)} cached images to the float32 encoding format")
+
+def setup_face_cache():
+    """Setup database for caching face encodings"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS face_cache (
+            image_path TEXT PRIMARY KEY,
+            face_encodings BLOB,
+            file_hash TEXT,
+            last_modified REAL,
+            original_name TEXT,
+            face_count INTEGER,
+            content_hash TEXT,
+            error TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_hash ON face_cache(file_hash)')
+    # Encodings of uploaded query images, keyed by the SHA-256 of the upload
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS query_cache (
+            content_hash TEXT PRIMARY KEY,
+            face_encodings BLOB,
+            face_count INTEGER,
+            last_used REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_query_last_used ON query_cache(last_used)')
+    conn.commit()
+    migrate_face_cache(conn)
+
+def get_file_hash(file_path):
+    """Get file hash for change detection"""
+    try:
+        stat = os.stat(file_path)
+        return f"{stat.st_mtime}_{stat.st_size}"
+    except OSError:
+        return "unknown"
+
+def get_content_hash(file_path):
+    """SHA-256 of a photo's bytes, identical for every copy of the same file (None if unreadable)"""
+    digest = hashlib.sha256()
+    try:
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(CONTENT_HASH_CHUNK), b''):
+                digest.update(block)
+    except OSError as e:
+        logger.warning(f"⚠️  Could not hash {file_path}: {e}")
+        return None
+    return digest.hexdigest()
+
+def get_cached_face_encodings_batch(image_paths):
+    """Fetch up-to-date cached encodings for many images at once
+
+    Returns {image_path: (encodings, original_name)} for every path whose
+    cached file hash still matches the file on disk. Faceless and failed
+    images are included with an empty encodings matrix.
+    """
+    cached = {}
+    image_paths = list(image_paths)
+    try:
+        cursor = get_connection().cursor()
+        for start in range(0, len(image_paths), SQLITE_MAX_VARIABLES):
+            chunk = image_paths[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT image_path, face_encodings, face_count, file_hash, original_name
+                FROM face_cache WHERE image_path IN ({placeholders})
+            ''', chunk)
+            for image_path, encodings_blob, face_count, file_hash, original_name in cursor.fetchall():
+                if file_hash == get_file_hash(image_path):
+                    cached[image_path] = (decode_face_encodings(encodings_blob, face_count), original_name)
+    except (sqlite3.Error, ValueError) as e:
+        logger.warning(f"⚠️  Face cache read failed: {e}")
+    return cached
+
+def get_cached_face_encodings(image_path):
+    """Get cached face encodings if available and up-to-date"""
+    return get_cached_face_encodings_batch([image_path]).get(image_path, (None, None))
+
+def cache_face_encodings_batch(rows):
+    """Cache many results in one transaction
+
+    rows is an iterable of (image_path, face_encodings, original_name, file_hash,
+    content_hash); a file_hash of None is read from disk, a content_hash may be None.
+    Empty face_encodings are stored too, so faceless images are not scanned again.
+    """
+    now = time.time()
+    records = []
+    for image_path, face_encodings, original_name, file_hash, content_hash in rows:
+        if file_hash is None:
+            file_hash = get_file_hash(image_path)
+        encodings_blob, face_count = encode_face_encodings(face_encodings)
+        records.append((image_path, encodings_blob, file_hash, now, original_name, face_count, content_hash))
+    if not records:
+        return
+    try:
+        with get_connection() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO face_cache 
+                (image_path, face_encodings, file_hash, last_modified, original_name, face_count, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', records)
+    except sqlite3.Error as e:
+        # Don't fail the search if caching fails, but say so
+        logger.warning(f"⚠️  Face cache write of {len(records)} images failed: {e}")
+
+def cache_face_encodings(image_path, face_encodings, original_name, file_hash=None, content_hash=None):
+    """Cache face encodings for future use"""
+    cache_face_encodings_batch([(image_path, face_encodings, original_name, file_hash, content_hash)])
+
+def cache_failed_images(rows):
+    """Record images that could not be decoded so they are skipped until they change
+
+    rows is an iterable of (image_path, original_name, file_hash, error).
+    """
+    now = time.time()
+    records = [(image_path, b'', file_hash, now, original_name, 0, None, str(error))
+               for image_path, original_name, file_hash, error in rows]
+    if not records:
+        return
+    try:
+        with get_connection() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO face_cache
+                (image_path, face_encodings, file_hash, last_modified, original_name, face_count, content_hash, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', records)
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️  Face cache write of {len(records)} failed images failed: {e}")
+
+def delete_cached_images(rows):
+    """Delete the rows of files that were deleted or changed since they were cached
+
+    rows is an iterable of (image_path, file_hash); a row re-encoded since
+    (with another file hash) is kept.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    try:
+        with get_connection() as conn:
+            conn.executemany('DELETE FROM face_cache WHERE image_path = ? AND file_hash = ?', rows)
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️  Face cache delete of {len(rows)} stale images failed: {e}")
+
+def get_cached_encodings_by_content(content_hashes):
+    """Map content hashes that are already cached (under any path) to their encodings"""
+    cached = {}
+    content_hashes = [h for h in content_hashes if h]
+    try:
+        cursor = get_connection().cursor()
+        for start in range(0, len(content_hashes), SQLITE_MAX_VARIABLES):
+            chunk = content_hashes[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT content_hash, face_encodings, face_count
+                FROM face_cache WHERE content_hash IN ({placeholders}) AND error IS NULL
+            ''', chunk)
+            for content_hash, encodings_blob, face_count in cursor.fetchall():
+                cached[content_hash] = decode_face_encodings(encodings_blob, face_count)
+    except (sqlite3.Error, ValueError) as e:
+        logger.warning(f"⚠️  Face cache read failed: {e}")
+    return cached
+
+def get_cached_file_hashes(include_failed=True):
+    """Map every cached image path to the file hash it was encoded with"""
+    try:
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT image_path, file_hash FROM face_cache'
+                       + ('' if include_failed else ' WHERE error IS NULL'))
+        return dict(cursor.fetchall())
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️  Face cache read failed: {e}")
+        return {}
+
+def iter_cached_face_encodings(modified_after=0.0):
+    """Yield (image_path, encodings, file_hash, original_name, last_modified, content_hash) rows"""
+    cursor = get_connection().cursor()
+    cursor.execute('''
+        SELECT image_path, face_encodings, face_count, file_hash, original_name, last_modified, content_hash
+        FROM face_cache WHERE last_modified > ?
+    ''', (modified_after,))
+    for image_path, encodings_blob, face_count, file_hash, original_name, last_modified, content_hash in cursor:
+        try:
+            encodings = decode_face_encodings(encodings_blob, face_count)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"⚠️  Skipping cached {image_path}: {e}")
+            continue
+        yield image_path, encodings, file_hash, original_name, last_modified, content_hash
+
+def iter_cached_file_hashes(modified_after=0.0):
+    """Yield (image_path, file_hash, last_modified) rows without decoding their encodings"""
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT image_path, file_hash, last_modified FROM face_cache WHERE last_modified > ?',
+                   (modified_after,))
+    yield from cursor
+
+def get_cached_query_encodings(content_hash):
+    """Encodings of a previously searched upload, or None if it is not cached"""
+    try:
+        with get_connection() as conn:
+            row = conn.execute(
+                'SELECT face_encodings, face_count FROM query_cache WHERE content_hash = ?',
+                (content_hash,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE query_cache SET last_used = ? WHERE content_hash = ?',
+                         (time.time(), content_hash))
+        return decode_face_encodings(*row)
+    except (sqlite3.Error, ValueError) as e:
+        logger.warning(f"⚠️  Query cache read failed: {e}")
+        return None
+
+def cache_query_encodings(content_hash, face_encodings):
+    """Remember an upload's encodings, evicting the least recently used beyond the limit"""
+    encodings_blob, face_count = encode_face_encodings(face_encodings)
+    try:
+        with get_connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO query_cache (content_hash, face_encodings, face_count, last_used)
+                VALUES (?, ?, ?, ?)
+            ''', (content_hash, encodings_blob, face_count, time.time()))
+            conn.execute('''
+                DELETE FROM query_cache WHERE content_hash IN (
+                    SELECT content_hash FROM query_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (QUERY_CACHE_MAX_ENTRIES,))
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️  Query cache write failed: {e}")
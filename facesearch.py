@@ -1,27 +1,32 @@
-import face_recognition
 import os
-from flask import Flask, request, jsonify, send_from_directory, render_template_string
-from werkzeug.utils import secure_filename
-from PIL import Image
-
-PHOTOS_ROOT = r"C:\Users\User1\Desktop\face recognition - v3\photos"
-OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'images')
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+import logging
+from flask import Flask, request, jsonify, render_template_string, url_for
+import app as search_service
+from face_cache import setup_face_cache
 
+# The gallery, face cache and worker pool are the ones configured in app.py
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
+
+# Matched photos are served in place from the gallery, like in app.py
+app.add_url_rule('/gallery/<path:filename>', 'gallery_image', search_service.gallery_image)
+app.add_url_rule('/thumbnails/<path:filename>', 'thumbnail', search_service.thumbnail)
 
 def allowed_file(filename):
     return any(filename.lower().endswith(ext) for ext in ALLOWED_EXTENSIONS)
 
-def get_all_image_paths(folder):
-    img_files = []
-    for root, _, files in os.walk(folder):
-        for file in files:
-            if allowed_file(file):
-                img_files.append(os.path.join(root, file))
-    return img_files
+def match_json(match, face, category):
+    return {
+        'face': face,
+        'path': match['path'],
+        'original_name': match['original_name'],
+        'distance': round(float(match['distance']), 4),
+        'category': category,
+        'image_url': url_for('gallery_image', filename=match['path']),
+        'thumbnail_url': url_for('thumbnail', filename=match['path']),
+    }
 
 @app.route('/')
 def index():
@@ -31,6 +36,13 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload():
+    """Search the gallery for the face in an uploaded image and return ranked matches
+
+    Accepts the same optional "faces", "top_k", "page", "stop_early", "date_from",
+    "date_to" and "folder" fields as app.py's /search; by default only the first
+    face is searched. The upload is processed in memory against the shared
+    face index, and "image_url" is the closest match.
+    """
     if 'image' not in request.files:
         return jsonify({'success': False, 'error': 'No file part'})
     file = request.files['image']
@@ -38,43 +50,40 @@ def upload():
         return jsonify({'success': False, 'error': 'No selected file'})
     if not allowed_file(file.filename):
         return jsonify({'success': False, 'error': 'Invalid file type'})
-
-    filename = secure_filename(file.filename)
-    upload_path = os.path.join(OUTPUT_DIR, filename)
-    file.save(upload_path)
+    try:
+        options = search_service.parse_search_options(request.form)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Invalid search options: {e}'})
+    if options['faces'] is None:
+        options['faces'] = [0]
 
     # Face search logic
     try:
-        image = face_recognition.load_image_file(upload_path)
-        encodings = face_recognition.face_encodings(image)
-        if not encodings:
-            return jsonify({'success': False, 'error': 'No face found in uploaded image!'})
-        query_encoding = encodings[0]
-        matches = []
-        for img_path in get_all_image_paths(PHOTOS_ROOT):
-            gallery_image = face_recognition.load_image_file(img_path)
-            gallery_encodings = face_recognition.face_encodings(gallery_image)
-            for face_encoding in gallery_encodings:
-                if face_recognition.compare_faces([query_encoding], face_encoding, tolerance=0.35)[0]:
-                    matches.append(img_path)
-                    break
-        # Save the first match as output (or all matches if you want)
-        if matches:
-            match_img_path = matches[0]
-            out_img = Image.open(match_img_path)
-            out_name = f"result_{filename}"
-            out_path = os.path.join(OUTPUT_DIR, out_name)
-            out_img.save(out_path)
-            image_url = f"/images/{out_name}"
-            return jsonify({'success': True, 'image_url': image_url})
-        else:
-            return jsonify({'success': False, 'error': 'No matching faces found.'})
+        groups = search_service.process_search(file, **options)
     except Exception as e:
+        logger.exception(f"❌ Search for {file.filename} failed")
         return jsonify({'success': False, 'error': str(e)})
+    if not groups:
+        return jsonify({'success': False, 'error': 'No face found in uploaded image!'})
 
-@app.route('/images/<filename>')
-def serve_image(filename):
-    return send_from_directory(OUTPUT_DIR, filename)
+    matches = [match_json(m, group['face'], category)
+               for group in groups
+               for category in ('strong', 'doubtful')
+               for m in group[category]]
+    matches.sort(key=lambda m: (m['face'], m['distance']))
+    if not matches:
+        return jsonify({'success': False, 'error': 'No matching faces found.', 'matches': []})
+    return jsonify({
+        'success': True,
+        'image_url': min(matches, key=lambda m: m['distance'])['image_url'],
+        'matches': matches,
+        'has_more': any(group['has_more'] for group in groups),
+    })
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(message)s')
+    setup_face_cache()
+    # The debug reloader runs this block twice; only the serving process needs warm workers
+    if search_service.BACKGROUND_INDEXING and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        search_service.get_worker_pool()
+    app.run(debug=True)
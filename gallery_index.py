@@ -0,0 +1,329 @@
+"""
+In-memory gallery index for vectorized face search
+Holds every cached face encoding in one contiguous float32 matrix so a
+query is a single distance computation instead of one call per photo.
+Copies of the same file (same content hash) share a single matrix entry.
+An index can also be opened over a memory-mapped store (encoding_store.py),
+using the mapped arrays in place until it is first changed.
+TopMatches keeps a bounded, ranked set of results while chunks are scanned.
+"""
+
+import heapq
+import itertools
+import numpy as np
+
+ENCODING_SIZE = 128
+
+
+class GalleryIndex:
+    """Resident matrix of gallery face encodings with a row -> image map"""
+
+    def __init__(self, ann_index=None):
+        # Optional approximate index (see ann_index.py) used to pick candidate rows
+        self.ann_index = ann_index
+        # image_path -> (original_name, file_hash, encodings, content_hash)
+        self._entries = {}
+        # image_path -> file_hash of images scanned with no faces (or that failed to decode)
+        self._faceless = {}
+        self._stale = False
+        self.version = 0  # Bumped on every change, so cached search results can be invalidated
+        self.last_modified = 0.0  # Newest face cache row loaded so far
+        self.matrix = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self.row_image = np.empty(0, dtype=np.int32)
+        self.images = []
+        self._offsets = np.empty(0, dtype=np.intp)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._image_ids = {}  # content hash (or path) -> position in self.images
+        # Representative path -> [(image_path, original_name)] of every copy, for content
+        # shared by several paths; replaced (not mutated) on _rebuild like the arrays
+        self.copies = {}
+        self._blocks = []  # Encodings block of each image as last packed, to spot unchanged rows
+        # Mapped store shard whose arrays back the index; entries loaded from it hold
+        # an image id instead of their encodings until the next _rebuild
+        self._store = None
+
+    @classmethod
+    def from_store(cls, shard, ann_index=None):
+        """Index over a mapped EncodingStore shard, sharing its arrays instead of copying them"""
+        index = cls(ann_index)
+        index._store = shard
+        index.matrix, index._sq_norms = shard.matrix, shard.sq_norms
+        index._offsets, index.row_image = shard.offsets, shard.row_image
+        for image_path, original_name, file_hash, content_hash, image_id in shard.entries:
+            if image_id < 0:
+                index._faceless[image_path] = file_hash
+                continue
+            index._entries[image_path] = (original_name, file_hash, image_id, content_hash)
+            index._image_ids.setdefault(content_hash or image_path, image_id)
+        index._blocks = list(range(len(shard.offsets)))  # Replaced by arrays in _materialize
+        # Every image is listed under the path that represents its content
+        index.images = [None] * len(shard.offsets)
+        groups = {}
+        for image_path, (original_name, _, image_id, _) in index._entries.items():
+            if index.images[image_id] is None:
+                index.images[image_id] = (image_path, original_name)
+            groups.setdefault(image_id, []).append((image_path, original_name))
+        index.copies = {group[0][0]: group for group in groups.values() if len(group) > 1}
+        if ann_index is not None:
+            ann_index.build(index.matrix)
+        return index
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, image_path):
+        return image_path in self._entries
+
+    def file_hash(self, image_path):
+        """Return the change-detection hash the image was indexed with"""
+        entry = self._entries.get(image_path)
+        return entry[1] if entry else self._faceless.get(image_path)
+
+    def add(self, image_path, face_encodings, original_name, file_hash=None, content_hash=None):
+        """Add or replace the encodings of one gallery image"""
+        encodings = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        if not len(encodings):
+            # Remembered as scanned so it is not queued for encoding again, but never searched
+            self.remove(image_path)
+            self._faceless[image_path] = file_hash
+            return
+        self._faceless.pop(image_path, None)
+        self._entries[image_path] = (original_name, file_hash, encodings, content_hash)
+        self._stale = True
+        self.version += 1
+
+    def remove(self, image_path):
+        self._faceless.pop(image_path, None)
+        if self._entries.pop(image_path, None) is not None:
+            self._stale = True
+            self.version += 1
+
+    def retain(self, image_paths):
+        """Drop every image that is not in image_paths (deleted from disk)"""
+        keep = set(image_paths)
+        for image_path in [p for p in list(self._entries) + list(self._faceless) if p not in keep]:
+            self.remove(image_path)
+
+    def _rebuild(self):
+        """Pack all encodings into one contiguous matrix, one entry per unique content"""
+        self._materialize()
+        unique = {}
+        groups = {}
+        for path, entry in self._entries.items():
+            # The first path seen for a content hash represents every copy of it
+            unique.setdefault(entry[3] or path, (path, entry))
+            groups.setdefault(entry[3] or path, []).append((path, entry[0]))
+        self.images = [(path, entry[0]) for path, entry in unique.values()]
+        self.copies = {group[0][0]: group for group in groups.values() if len(group) > 1}
+        blocks = [entry[2] for _, entry in unique.values()]
+        counts = np.array([len(block) for block in blocks], dtype=np.intp)
+        if self.ann_index is not None:
+            old_starts = self._previous_starts(unique, blocks)
+
+        if blocks:
+            self.matrix = np.ascontiguousarray(np.concatenate(blocks), dtype=np.float32)
+        else:
+            self.matrix = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self.row_image = np.repeat(np.arange(len(blocks), dtype=np.int32), counts)
+        self._image_ids = {key: i for i, key in enumerate(unique)}
+        self._offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.intp)
+        self._sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        self._blocks = blocks
+        if self.ann_index is not None:
+            # Rows carried over keep their ANN placement; only new rows are assigned
+            shift = np.repeat(old_starts - self._offsets, counts)
+            row_sources = np.where(np.repeat(old_starts, counts) >= 0,
+                                   np.arange(len(self.matrix)) + shift, -1)
+            self.ann_index.build(self.matrix, row_sources)
+        self._stale = False
+
+    def _previous_starts(self, keys, blocks):
+        """First row of each block in the current matrix, -1 where the encodings are new"""
+        image_ids, previous_blocks, offsets = self._image_ids, self._blocks, self._offsets
+        starts = np.full(len(blocks), -1, dtype=np.intp)
+        for i, (key, block) in enumerate(zip(keys, blocks)):
+            image_id = image_ids.get(key)
+            if image_id is not None and previous_blocks[image_id] is block:
+                starts[i] = offsets[image_id]
+        return starts
+
+    def _materialize(self):
+        """Copy the encodings still read from the mapped store into private memory"""
+        store = self._store
+        if store is None:
+            return
+        bounds = np.append(store.offsets, len(store.matrix))
+        blocks = {}  # image id -> private copy, shared by every path of that image
+        for path, (original_name, file_hash, encodings, content_hash) in self._entries.items():
+            # Entries added since the store was opened already hold their encodings
+            if isinstance(encodings, (int, np.integer)):
+                image_id = int(encodings)
+                if image_id not in blocks:
+                    blocks[image_id] = np.array(store.matrix[bounds[image_id]:bounds[image_id + 1]])
+                self._entries[path] = (original_name, file_hash, blocks[image_id], content_hash)
+        self._blocks = [blocks.get(image_id) for image_id in range(len(self._blocks))]
+        self._store = None
+
+    def export_arrays(self):
+        """Packed arrays and (image_path, original_name, file_hash, content_hash, image id)
+        entries for encoding_store.py; faceless images have image id -1"""
+        if self._stale:
+            self._rebuild()
+        entries = [(path, entry[0], entry[1], entry[3], self._image_ids[entry[3] or path])
+                   for path, entry in self._entries.items()]
+        entries.extend((path, None, file_hash, None, -1) for path, file_hash in self._faceless.items())
+        return {'encodings': self.matrix, 'sq_norms': self._sq_norms,
+                'offsets': self._offsets, 'row_image': self.row_image}, entries
+
+    def face_distances(self, query_encoding, rows=None):
+        """Euclidean distance from the query to every face row (or just `rows`)"""
+        if self._stale:
+            self._rebuild()
+        query = np.asarray(query_encoding, dtype=np.float32)
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        sq_norms = self._sq_norms if rows is None else self._sq_norms[rows]
+        # |a - b|^2 = |a|^2 - 2ab + |b|^2 avoids materialising matrix - query
+        squared = sq_norms - 2.0 * (matrix @ query) + float(query @ query)
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    def best_distances(self, query_encoding):
+        """Closest face distance per image, aligned with self.images"""
+        if self._stale:
+            self._rebuild()
+        if not len(self.matrix):
+            return np.empty(0, dtype=np.float32)
+        return np.minimum.reduceat(self.face_distances(query_encoding), self._offsets)
+
+    def search(self, query_encoding, max_distance):
+        """Return (image_path, original_name, distance) within max_distance, closest first"""
+        if self._stale:
+            self._rebuild()
+        if self.ann_index is not None and self.ann_index.ready:
+            return self._search_candidates(query_encoding, max_distance)
+        best = self.best_distances(query_encoding)
+        hits = np.flatnonzero(best <= max_distance)
+        hits = hits[np.argsort(best[hits], kind='stable')]
+        return [(self.images[i][0], self.images[i][1], float(best[i])) for i in hits]
+
+    def iter_search(self, query_encodings, max_distance, chunk_images=20000, exact=False):
+        """Search for several query faces at once, one chunk of images at a time
+
+        Returns an iterator of (matches, images_scanned) where matches are
+        (query_face, image_path, original_name, distance) tuples. Every query
+        face is compared in the same pass over the matrix. With exact=True
+        every face is scanned even if the ANN index is ready.
+
+        The index is rebuilt and its packed arrays captured before this returns;
+        _rebuild() replaces them rather than mutating them, so the caller may
+        release its lock while iterating. Matches are sorted within each chunk only.
+        """
+        if self._stale:
+            self._rebuild()
+        queries = np.asarray(query_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        if not exact and self.ann_index is not None and self.ann_index.ready:
+            # ANN candidates are per query, so each face gets its own lookup
+            matches = [(face, path, name, distance)
+                       for face, query in enumerate(queries)
+                       for path, name, distance in self._search_candidates(query, max_distance)]
+            return iter([(matches, len(self.images))])
+        return self._iter_chunks(self.images, self.matrix, self._sq_norms, self._offsets,
+                                 queries, max_distance, chunk_images)
+
+    @staticmethod
+    def _iter_chunks(images, matrix, sq_norms, offsets, queries, max_distance, chunk_images):
+        query_sq = np.einsum('ij,ij->i', queries, queries)
+        for start in range(0, len(images), chunk_images):
+            stop = min(start + chunk_images, len(images))
+            row_start = offsets[start]
+            row_stop = offsets[stop] if stop < len(images) else len(matrix)
+            # queries x faces distance matrix for this chunk
+            squared = (sq_norms[None, row_start:row_stop]
+                       - 2.0 * (queries @ matrix[row_start:row_stop].T) + query_sq[:, None])
+            distances = np.sqrt(np.maximum(squared, 0.0))
+            best = np.minimum.reduceat(distances, offsets[start:stop] - row_start, axis=1)
+            faces, hits = np.nonzero(best <= max_distance)
+            order = np.lexsort((best[faces, hits], faces))
+            yield [(int(faces[i]), images[start + hits[i]][0], images[start + hits[i]][1],
+                    float(best[faces[i], hits[i]])) for i in order], stop
+
+    def _search_candidates(self, query_encoding, max_distance):
+        """Exactly re-rank the rows proposed by the ANN index"""
+        rows = self.ann_index.candidates(query_encoding)
+        distances = self.face_distances(query_encoding, rows)
+        close = distances <= max_distance
+        rows, distances = rows[close], distances[close]
+        order = np.argsort(distances, kind='stable')
+        # Closest face first, so the first row seen per image is its best distance
+        image_ids, first = np.unique(self.row_image[rows[order]], return_index=True)
+        ranked = np.argsort(first, kind='stable')
+        return [(self.images[image_ids[i]][0], self.images[image_ids[i]][1], float(distances[order][first[i]]))
+                for i in ranked]
+
+
+class TopMatches:
+    """Closest match per key (e.g. original name), bounded to the `limit` closest keys
+
+    A max-heap keyed on distance keeps the worst kept match on top, so once the
+    set is full a worse match is rejected in O(1) and a better one replaces the
+    worst in O(log limit). limit=None keeps every key.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.overflowed = False  # True once a match was dropped to stay within limit
+        self._best = {}  # key -> (value, distance, seq)
+        self._heap = []  # (-distance, seq, key); entries replaced in _best are skipped lazily
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._best)
+
+    def get(self, key):
+        """(value, distance) kept for key, or None"""
+        best = self._best.get(key)
+        return best[:2] if best else None
+
+    def worst_distance(self):
+        """Distance a new key must beat once the set is full (None while there is room)"""
+        if self.limit is None or len(self._best) < self.limit:
+            return None
+        self._discard_stale()
+        return -self._heap[0][0]
+
+    def offer(self, key, value, distance):
+        """Keep value for key if it is closer than what is kept; returns True if kept"""
+        previous = self._best.get(key)
+        if previous is not None and previous[1] <= distance:
+            return False
+        if previous is None:
+            worst = self.worst_distance()
+            if worst is not None:
+                self.overflowed = True
+                if distance >= worst:
+                    return False
+                _, _, worst_key = heapq.heappop(self._heap)
+                del self._best[worst_key]
+        seq = next(self._seq)
+        self._best[key] = (value, distance, seq)
+        heapq.heappush(self._heap, (-distance, seq, key))
+        if len(self._heap) > 2 * len(self._best) + 16:
+            # Too many replaced entries: rebuild the heap from what is kept
+            self._heap = [(-d, s, k) for k, (_, d, s) in self._best.items()]
+            heapq.heapify(self._heap)
+        return True
+
+    def count_within(self, max_distance):
+        return sum(1 for _, distance, _ in self._best.values() if distance <= max_distance)
+
+    def ranked(self, start=0, stop=None):
+        """[(key, value, distance)] closest first, sliced to [start:stop]"""
+        ranked = sorted(((k, v, d) for k, (v, d, _) in self._best.items()), key=lambda item: item[2])
+        return ranked[start:stop]
+
+    def _discard_stale(self):
+        while self._heap:
+            neg_distance, seq, key = self._heap[0]
+            best = self._best.get(key)
+            if best is not None and best[2] == seq:
+                return
+            heapq.heappop(self._heap)
@@ -0,0 +1,189 @@
+"""
+Persisted directory manifest for the photo gallery
+Remembers every folder's mtime and image listing in face_cache.db so a
+scan only re-lists folders that changed instead of walking and stat-ing
+the whole tree. With the optional watchdog package installed, a watcher
+flags changed folders as photos land and unchanged folders are not
+touched at all.
+
+Adding, removing or renaming a file updates its folder's mtime. Editing
+a photo in place does not on most filesystems, so without the watcher
+such edits are only picked up by a full rescan
+(`python index_gallery.py --full-rescan`).
+"""
+
+import os
+import json
+import logging
+import threading
+from face_cache import get_connection
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # Optional: fall back to per-folder mtime checks
+    Observer = None
+    FileSystemEventHandler = object
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+logger = logging.getLogger(__name__)
+
+def setup_manifest_table():
+    conn = get_connection()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS dir_manifest (
+            dir_path TEXT PRIMARY KEY,
+            mtime REAL,
+            subdirs TEXT,
+            files TEXT
+        )
+    ''')
+    conn.commit()
+
+def get_dir_mtime(dir_path):
+    try:
+        return os.stat(dir_path).st_mtime
+    except OSError:
+        return None
+
+def list_directory(dir_path):
+    """List one folder: returns (mtime, subdirs, [(file_name, file_hash)]) or None"""
+    # Read the mtime first so a change during listing is caught by the next scan
+    mtime = get_dir_mtime(dir_path)
+    if mtime is None:
+        return None
+    subdirs = []
+    files = []
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir() and not entry.is_symlink():
+                    subdirs.append(entry.name)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                    stat = entry.stat()
+                    # Same format as face_cache.get_file_hash
+                    files.append((entry.name, f"{stat.st_mtime}_{stat.st_size}"))
+    except OSError as e:
+        logger.warning(f"⚠️  Could not list {dir_path}: {e}")
+        return None
+    return mtime, subdirs, files
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    """Flags the folders touched by filesystem events as changed"""
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+
+    def on_any_event(self, event):
+        for path in (event.src_path, getattr(event, 'dest_path', None)):
+            if not path:
+                continue
+            self.manifest.mark_changed(os.path.dirname(path))
+            if event.is_directory:
+                self.manifest.mark_changed(path)
+
+
+class GalleryManifest:
+    """Incrementally maintained listing of every image under a gallery root"""
+
+    def __init__(self, root):
+        self.root = os.path.normpath(root)
+        self._dirs = {}  # dir_path -> (mtime, subdirs, files)
+        self._changed = set()
+        self._lock = threading.Lock()
+        self._observer = None
+        self._verified = False  # A stat-based scan has run since the watcher started
+        self._load()
+
+    def _load(self):
+        setup_manifest_table()
+        prefix = self.root + os.sep
+        rows = get_connection().execute('SELECT dir_path, mtime, subdirs, files FROM dir_manifest')
+        for dir_path, mtime, subdirs, files in rows:
+            if dir_path == self.root or dir_path.startswith(prefix):
+                self._dirs[dir_path] = (mtime, json.loads(subdirs), [tuple(f) for f in json.loads(files)])
+
+    def mark_changed(self, dir_path):
+        with self._lock:
+            self._changed.add(os.path.normpath(dir_path))
+
+    def start_watcher(self):
+        """Watch the gallery for changes; returns False if watchdog is not installed"""
+        if Observer is None:
+            return False
+        if self._observer is None:
+            self._observer = Observer()
+            self._observer.schedule(_ChangeHandler(self), self.root, recursive=True)
+            self._observer.daemon = True
+            self._observer.start()
+            self._verified = False
+        return True
+
+    def stop_watcher(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+    def scan(self, full_rescan=False):
+        """Return {image_path: file_hash} for the whole gallery, re-listing only changed folders"""
+        return self.scan_changes(full_rescan)[0]
+
+    def scan_changes(self, full_rescan=False):
+        """scan(), plus the set of image paths listed in a re-listed or removed folder
+        before or after this scan, so callers can update only what may have changed"""
+        with self._lock:
+            changed = self._changed
+            self._changed = set()
+        # Once the watcher is running and a checked scan has completed, trust its events
+        trust_watcher = self._observer is not None and self._verified and not full_rescan
+
+        image_files = {}
+        changed_paths = set()
+        updated = {}
+        seen_dirs = set()
+        stack = [self.root]
+        while stack:
+            dir_path = stack.pop()
+            seen_dirs.add(dir_path)
+            entry = self._dirs.get(dir_path)
+            stale = (entry is None or full_rescan or dir_path in changed or
+                     (not trust_watcher and get_dir_mtime(dir_path) != entry[0]))
+            if stale:
+                entry = list_directory(dir_path)
+                previous = self._dirs.get(dir_path)
+                if previous is not None:
+                    changed_paths.update(os.path.join(dir_path, f) for f, _ in previous[2])
+                if entry is None:
+                    seen_dirs.discard(dir_path)
+                    continue
+                changed_paths.update(os.path.join(dir_path, f) for f, _ in entry[2])
+                updated[dir_path] = entry
+                self._dirs[dir_path] = entry
+
+            _, subdirs, files = entry
+            for file_name, file_hash in files:
+                image_files[os.path.join(dir_path, file_name)] = file_hash
+            stack.extend(os.path.join(dir_path, d) for d in reversed(subdirs))
+
+        removed = [d for d in self._dirs if d not in seen_dirs]
+        for dir_path in removed:
+            changed_paths.update(os.path.join(dir_path, f) for f, _ in self._dirs.pop(dir_path)[2])
+        self._save(updated, removed)
+        if self._observer is not None:
+            self._verified = True
+
+        logger.info(f"🔍 Found {len(image_files)} unique images ({len(updated)} of {len(seen_dirs)} folders rescanned)")
+        return image_files, changed_paths
+
+    def _save(self, updated, removed):
+        if not updated and not removed:
+            return
+        with get_connection() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO dir_manifest (dir_path, mtime, subdirs, files) VALUES (?, ?, ?, ?)',
+                [(d, mtime, json.dumps(subdirs), json.dumps(files))
+                 for d, (mtime, subdirs, files) in updated.items()]
+            )
+            conn.executemany('DELETE FROM dir_manifest WHERE dir_path = ?', [(d,) for d in removed])
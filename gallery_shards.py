@@ -0,0 +1,215 @@
+"""
+Date-partitioned gallery index
+The gallery is organised as YYYY/MM mon/<dd-mm-yyyy - event>/..., so every
+image belongs to a period shard ("2015-01", or "2017" for photos directly in
+a year folder, "" for anything undated). Each shard is its own GalleryIndex:
+a scoped search ("events in 2024", or one folder) only packs and scans the
+shards it needs, and a new photo only rebuilds the matrix of its own month.
+
+ANN indexes are kept per shard from ANN_MIN_SHARD_ROWS faces up, but only
+used when the shards a search scans hold ANN_MIN_ROWS faces between them:
+a gallery of many small months is as slow to scan exactly as one big one.
+"""
+
+import os
+import re
+from collections import namedtuple
+from gallery_index import GalleryIndex
+from ann_index import ANN_MIN_ROWS
+
+YEAR_FOLDER = re.compile(r'^(\d{4})$')  # "2015"
+MONTH_FOLDER = re.compile(r'^(\d{1,2})(?:\D.*)?$')  # "01 jan"
+EVENT_FOLDER = re.compile(r'^(\d{2})-(\d{2})-(\d{4})\b')  # "06-01-2025  - Event name", as in generatePhotosData.js
+DATE_BOUND = re.compile(r'^(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?$')  # "2024", "2024-03" or "2024-03-15"
+ANN_MIN_SHARD_ROWS = 2000  # Smallest shard given its own ANN index
+
+
+def parse_date_bound(value, end=False):
+    """(year, month, day) for a "YYYY", "YYYY-MM" or "YYYY-MM-DD" bound; a partial
+    date is the start of its period, or the end of it with end=True"""
+    match = DATE_BOUND.match(value.strip())
+    if not match:
+        raise ValueError(f"Dates must look like 2024, 2024-03 or 2024-03-15, got {value!r}")
+    year, month, day = match.groups()
+    month = int(month) if month else (12 if end else 1)
+    day = int(day) if day else (31 if end else 1)
+    if not 1 <= month <= 12 or not 1 <= day <= 31:
+        raise ValueError(f"Invalid date {value!r}")
+    return int(year), month, day
+
+def folder_period(rel_dir):
+    """(shard key, (start, end) dates or None) for a folder relative to the gallery root"""
+    parts = [p for p in rel_dir.replace(os.sep, '/').split('/') if p and p != '.']
+    year = YEAR_FOLDER.match(parts[0]) if parts else None
+    if not year:
+        return '', None
+    y = int(year.group(1))
+    month = MONTH_FOLDER.match(parts[1]) if len(parts) > 1 else None
+    if not month or not 1 <= int(month.group(1)) <= 12:
+        return f'{y}', ((y, 1, 1), (y, 12, 31))
+    m = int(month.group(1))
+    event = EVENT_FOLDER.match(parts[2]) if len(parts) > 2 else None
+    if event:
+        dd, mm, yyyy = (int(g) for g in event.groups())
+        return f'{y}-{m:02d}', ((yyyy, mm, dd), (yyyy, mm, dd))
+    return f'{y}-{m:02d}', ((y, m, 1), (y, m, 31))
+
+
+class SearchScope(namedtuple('SearchScope', 'date_from date_to folder')):
+    """Optional date range ((y, m, d) bounds) and folder (relative to the gallery root)"""
+
+    def __new__(cls, date_from=None, date_to=None, folder=None):
+        folder = folder.replace(os.sep, '/').strip('/') if folder else None
+        return super().__new__(cls, date_from, date_to, folder or None)
+
+    def overlaps(self, period):
+        if self.date_from is None and self.date_to is None:
+            return True
+        if period is None:
+            return False  # Undated photos are left out of date-scoped searches
+        start, end = period
+        return ((self.date_from is None or end >= self.date_from) and
+                (self.date_to is None or start <= self.date_to))
+
+    def includes_shard(self, key, period):
+        if self.folder is not None:
+            folder_key = folder_period(self.folder)[0]
+            # A year folder covers its month shards too
+            if key != folder_key and not (folder_key and key.startswith(folder_key + '-')):
+                return False
+        return self.overlaps(period)
+
+
+class ShardedGalleryIndex:
+    """One GalleryIndex per period shard, with the same interface plus search scopes"""
+
+    def __init__(self, root, ann_factory=None):
+        self.root = os.path.normpath(root)
+        self.ann_factory = ann_factory  # Called once per shard for its ANN index
+        self.shards = {}  # shard key -> GalleryIndex
+        self._periods = {}  # shard key -> (start, end) or None
+        self._dir_periods = {}  # folder -> (shard key, period), cached per folder
+        self.last_modified = 0.0
+
+    def _dir_period(self, image_path):
+        dir_path = os.path.dirname(image_path)
+        period = self._dir_periods.get(dir_path)
+        if period is None:
+            period = self._dir_periods[dir_path] = folder_period(os.path.relpath(dir_path, self.root))
+        return period
+
+    def _shard(self, image_path, create=False):
+        key, _ = self._dir_period(image_path)
+        shard = self.shards.get(key)
+        if shard is None and create:
+            shard = self.add_shard(key, GalleryIndex(self.make_shard_ann_index()))
+        return shard
+
+    def make_shard_ann_index(self):
+        """ANN index for one shard (None without an ann_factory)"""
+        ann_index = self.ann_factory() if self.ann_factory else None
+        if ann_index is not None:
+            ann_index.min_rows = ANN_MIN_SHARD_ROWS
+        return ann_index
+
+    def add_shard(self, key, index):
+        """Install a prebuilt shard (e.g. one opened from a mapped encoding store)"""
+        self.shards[key] = index
+        self._periods[key] = folder_period(key.replace('-', '/'))[1] if key else None
+        return index
+
+    @property
+    def version(self):
+        # Shards are never dropped and their versions only grow, so the sum does too
+        return sum(shard.version for shard in self.shards.values())
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards.values())
+
+    def __contains__(self, image_path):
+        shard = self._shard(image_path)
+        return shard is not None and image_path in shard
+
+    def face_count(self):
+        return sum(len(shard.matrix) for shard in self.shards.values())
+
+    def file_hash(self, image_path):
+        shard = self._shard(image_path)
+        return shard.file_hash(image_path) if shard is not None else None
+
+    def add(self, image_path, face_encodings, original_name, file_hash=None, content_hash=None):
+        self._shard(image_path, create=True).add(image_path, face_encodings, original_name,
+                                                 file_hash, content_hash)
+
+    def remove(self, image_path):
+        shard = self._shard(image_path)
+        if shard is not None:
+            shard.remove(image_path)
+
+    def retain(self, image_paths):
+        by_shard = {key: [] for key in self.shards}
+        for image_path in image_paths:
+            key, _ = self._dir_period(image_path)
+            if key in by_shard:
+                by_shard[key].append(image_path)
+        for key, paths in by_shard.items():
+            self.shards[key].retain(paths)
+
+    def selected_shards(self, scope=None):
+        """Shard keys a search with this scope has to scan"""
+        return [key for key in sorted(self.shards)
+                if scope is None or scope.includes_shard(key, self._periods[key])]
+
+    def count(self, scope=None):
+        """Indexed images in the shards selected by scope"""
+        return sum(len(self.shards[key]) for key in self.selected_shards(scope))
+
+    def _in_scope(self, image_path, scope):
+        if scope.folder is not None:
+            rel_path = os.path.relpath(image_path, self.root).replace(os.sep, '/')
+            if not rel_path.startswith(scope.folder + '/'):
+                return False
+        return scope.overlaps(self._dir_period(image_path)[1])
+
+    def iter_search(self, query_encodings, max_distance, chunk_images=20000, scope=None):
+        """GalleryIndex.iter_search over the shards selected by scope
+
+        images_scanned counts across the selected shards. Shards that lie only
+        partly inside the scope (a month cut by the date range, or a folder
+        below the month) have their matches filtered by path; a match whose
+        representative path is out of scope is kept under an in-scope copy of
+        the same content, if there is one.
+        """
+        # Each shard is rebuilt and snapshotted now, so the caller may release its lock
+        selected = self.selected_shards(scope)
+        exact = sum(len(self.shards[key].matrix) for key in selected) < ANN_MIN_ROWS
+        searches = []
+        for key in selected:
+            shard = self.shards[key]
+            period = self._periods[key]
+            partial = scope is not None and (scope.folder is not None or not (
+                period is not None and (scope.date_from is None or period[0] >= scope.date_from)
+                and (scope.date_to is None or period[1] <= scope.date_to)))
+            chunks = shard.iter_search(query_encodings, max_distance, chunk_images, exact=exact)
+            # shard.copies is read after iter_search has rebuilt the shard, like its arrays
+            searches.append((chunks, shard.copies if partial else None))
+        return self._chain(searches, scope)
+
+    def _chain(self, searches, scope):
+        scanned_before = 0
+        for chunks, copies in searches:
+            scanned = 0
+            for matches, scanned in chunks:
+                if copies is not None:
+                    matches = [m for m in (self._scoped_match(m, scope, copies) for m in matches) if m]
+                yield matches, scanned_before + scanned
+            scanned_before += scanned
+
+    def _scoped_match(self, match, scope, copies):
+        """match under its first in-scope path (the representative or a copy), or None"""
+        face, image_path, original_name, distance = match
+        for path, name in copies.get(image_path, ((image_path, original_name),)):
+            if self._in_scope(path, scope):
+                return face, path, name, distance
+        return None
+
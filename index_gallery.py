@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Offline gallery indexer
+Encodes every photo under PHOTOS_ROOT into face_cache.db ahead of time so
+the web app only reads the index and never runs face detection itself.
+
+Usage:
+    python index_gallery.py                       # index PHOTOS_ROOT
+    python index_gallery.py --photos-root D:\\photos --workers 4
+
+The indexer is resumable: images already cached with an unchanged file
+hash are skipped, and results are committed in small batches as they
+arrive, so an interrupted run picks up where it left off.
+
+Images with no faces and images that fail to decode are cached too, so
+they are not scanned again until the file changes (--retry-failed
+re-tries the failures, e.g. after installing a missing codec).
+
+Pending images are hashed by content first, so byte-identical copies
+(e.g. "download.jpg" and "download (1).jpg") are encoded only once and
+copies of an already indexed photo reuse its cached encodings.
+"""
+
+import os
+import logging
+import argparse
+import multiprocessing
+import time
+import hashlib
+from io import BytesIO
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import face_recognition
+from PIL import Image
+from face_cache import (
+    setup_face_cache, get_file_hash, get_content_hash, cache_face_encodings_batch,
+    cache_failed_images, get_cached_file_hashes, get_cached_encodings_by_content
+)
+from gallery_manifest import GalleryManifest
+from indexing_pipeline import IndexingPipeline
+from thumbnails import get_thumbnail
+
+PHOTOS_ROOT = r"C:\Users\User1\Desktop\face recognition - v3\static\photos"  # Set your photos folder
+PROGRESS_EVERY = 50  # Print progress every N images
+WRITE_BATCH_SIZE = 100  # Results committed to the cache per transaction
+# Faces are detected on a copy whose longest side is at most this many pixels,
+# then encoded from the full-resolution image. None detects at full resolution.
+DETECTION_MAX_SIDE = 1600
+DETECTION_MODEL = 'hog'  # 'hog' (fast on CPU) or 'cnn' (more accurate, fast on GPU)
+DETECTION_UPSAMPLE = 1  # Extra detector upsampling passes, finds smaller faces
+CNN_BATCH_SIZE = 1  # >1 runs batched CNN detection over same-sized frames
+DECODE_THREADS = 4  # Threads reading and decoding photos ahead of the encoding workers
+
+# Per-image messages, also raised in the web app's background workers; run progress stays on print
+logger = logging.getLogger(__name__)
+
+def scale_face_location(location, factor, height, width):
+    """Map a (top, right, bottom, left) box from the detection copy back to the original"""
+    top, right, bottom, left = location
+    return (max(0, int(round(top * factor))), min(width, int(round(right * factor))),
+            min(height, int(round(bottom * factor))), max(0, int(round(left * factor))))
+
+def detect_faces(image, detection_max_side=DETECTION_MAX_SIDE, model=DETECTION_MODEL,
+                 upsample=DETECTION_UPSAMPLE):
+    """Face boxes in full-resolution coordinates, detected on a downscaled copy"""
+    height, width = image.shape[:2]
+    scale = 1.0
+    small = image
+    if detection_max_side and max(height, width) > detection_max_side:
+        scale = detection_max_side / max(height, width)
+        small = np.asarray(Image.fromarray(image).resize(
+            (max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR))
+    return [scale_face_location(loc, 1 / scale, height, width)
+            for loc in face_recognition.face_locations(small, upsample, model)]
+
+def detect_and_encode(image, detection_max_side=DETECTION_MAX_SIDE, model=DETECTION_MODEL,
+                      upsample=DETECTION_UPSAMPLE):
+    """Detect faces on a downscaled copy and encode them at full resolution
+
+    Detection cost grows with pixel count, while landmarks and encodings
+    only need the face boxes, so detection runs on the smaller copy.
+    """
+    locations = detect_faces(image, detection_max_side, model, upsample)
+    if not locations:
+        return []
+    return face_recognition.face_encodings(image, known_face_locations=locations)
+
+def letterbox(image, frame_width, frame_height):
+    """Fit an image into a fixed-size black frame (top-left aligned); returns (frame, scale)"""
+    height, width = image.shape[:2]
+    scale = min(frame_width / width, frame_height / height)
+    new_width, new_height = max(1, round(width * scale)), max(1, round(height * scale))
+    frame = np.zeros((frame_height, frame_width, 3), dtype=np.uint8)
+    frame[:new_height, :new_width] = np.asarray(
+        Image.fromarray(image).resize((new_width, new_height), Image.BILINEAR))
+    return frame, scale
+
+def get_original_name(img_path):
+    return os.path.splitext(os.path.basename(img_path))[0]
+
+def load_image(img_path):
+    """Read a photo once: returns (image array, file_hash, content_hash)"""
+    file_hash = get_file_hash(img_path)
+    with open(img_path, 'rb') as f:
+        data = f.read()
+    return face_recognition.load_image_file(BytesIO(data)), file_hash, hashlib.sha256(data).hexdigest()
+
+def image_result(img_path, file_hash, content_hash, encodings, make_thumbnail):
+    if make_thumbnail:
+        # Pre-build the result preview so the first search serves it from cache.
+        # Its own try: a thumbnail failure must not cache the encoded image as failed
+        try:
+            get_thumbnail(img_path)
+        except Exception as e:
+            logger.warning(f"⚠️  Could not build thumbnail for {img_path}: {e}")
+    return {
+        'path': img_path,
+        'encodings': encodings,
+        'original_name': get_original_name(img_path),
+        'file_hash': file_hash,
+        'content_hash': content_hash,
+        'error': None
+    }
+
+def error_result(img_path, error):
+    """Result for an image that could not be decoded or encoded, cached so it is not retried"""
+    logger.warning(f"Error processing {img_path}: {error}")
+    return {
+        'path': img_path,
+        'encodings': [],
+        'original_name': get_original_name(img_path),
+        'file_hash': get_file_hash(img_path),
+        'content_hash': None,
+        'error': str(error)
+    }
+
+def encode_image(img_path, make_thumbnail=False, detection_max_side=DETECTION_MAX_SIDE,
+                 model=DETECTION_MODEL, upsample=DETECTION_UPSAMPLE):
+    """Detect and encode every face in one gallery image (runs in a worker)"""
+    try:
+        gallery_img, file_hash, content_hash = load_image(img_path)
+        encodings = detect_and_encode(gallery_img, detection_max_side, model, upsample)
+        return image_result(img_path, file_hash, content_hash, encodings, make_thumbnail)
+    except Exception as e:
+        return error_result(img_path, e)
+
+def encode_image_timed(img_path, **options):
+    """encode_image for the web app's background workers: returns (result, seconds busy)"""
+    start = time.perf_counter()
+    result = encode_image(img_path, **options)
+    return result, time.perf_counter() - start
+
+def decode_images(img_paths):
+    """Read and decode a group of images
+
+    Returns ([(img_path, file_hash, content_hash, image)], [error results]).
+    """
+    loaded = []
+    failed = []
+    for img_path in img_paths:
+        try:
+            image, file_hash, content_hash = load_image(img_path)
+            loaded.append((img_path, file_hash, content_hash, image))
+        except Exception as e:
+            failed.append(error_result(img_path, e))
+    return loaded, failed
+
+def encode_loaded(decoded, make_thumbnail=False, detection_max_side=DETECTION_MAX_SIDE,
+                  model=DETECTION_MODEL, upsample=DETECTION_UPSAMPLE, batched=False):
+    """Pipeline encode stage for decode_images output (runs in a worker): returns (results, seconds)"""
+    start = time.perf_counter()
+    loaded, failed = decoded
+    if batched:
+        results = encode_loaded_batch(loaded, make_thumbnail, detection_max_side, upsample)
+    else:
+        results = encode_each(loaded, make_thumbnail, detection_max_side, model, upsample)
+    return failed + results, time.perf_counter() - start
+
+def encode_each(loaded, make_thumbnail=False, detection_max_side=DETECTION_MAX_SIDE,
+                model=DETECTION_MODEL, upsample=DETECTION_UPSAMPLE):
+    """Detect and encode decoded images one at a time: a result or an error row for each"""
+    results = []
+    for img_path, file_hash, content_hash, image in loaded:
+        try:
+            encodings = detect_and_encode(image, detection_max_side, model, upsample)
+            results.append(image_result(img_path, file_hash, content_hash, encodings, make_thumbnail))
+        except Exception as e:
+            results.append(error_result(img_path, e))
+    return results
+
+def encode_image_batch(img_paths, make_thumbnail=False, detection_max_side=DETECTION_MAX_SIDE,
+                       upsample=DETECTION_UPSAMPLE):
+    """Load and encode a group of images with batched CNN detection"""
+    loaded, failed = decode_images(img_paths)
+    return failed + encode_loaded_batch(loaded, make_thumbnail, detection_max_side, upsample)
+
+def encode_loaded_batch(loaded, make_thumbnail=False, detection_max_side=DETECTION_MAX_SIDE,
+                        upsample=DETECTION_UPSAMPLE):
+    """Encode decoded images with one batched CNN detection call per frame shape
+
+    batch_face_locations needs same-sized frames, so every image is
+    letterboxed into a landscape or portrait frame of detection_max_side
+    pixels and the boxes are scaled back to the original image. If a batch
+    fails, its images are detected one by one, so each gets a result or an
+    error row.
+    """
+    side = detection_max_side or 1600
+    frame_shapes = {'landscape': (side, side * 3 // 4), 'portrait': (side * 3 // 4, side)}
+
+    results = []
+    for orientation, (frame_width, frame_height) in frame_shapes.items():
+        group = [item for item in loaded
+                 if (item[3].shape[1] >= item[3].shape[0]) == (orientation == 'landscape')]
+        if not group:
+            continue
+        frames, scales = zip(*(letterbox(image, frame_width, frame_height) for *_, image in group))
+        try:
+            batch_locations = face_recognition.batch_face_locations(
+                list(frames), number_of_times_to_upsample=upsample, batch_size=len(frames))
+        except Exception as e:
+            # e.g. out of GPU memory: detect this group one image at a time instead
+            logger.warning(f"⚠️  Batched detection of {len(group)} images failed ({e}), detecting them one by one")
+            results.extend(encode_each(group, make_thumbnail, detection_max_side, 'cnn', upsample))
+            continue
+        for (img_path, file_hash, content_hash, image), scale, locations in zip(group, scales, batch_locations):
+            try:
+                height, width = image.shape[:2]
+                locations = [scale_face_location(loc, 1 / scale, height, width) for loc in locations]
+                encodings = face_recognition.face_encodings(image, known_face_locations=locations) if locations else []
+                results.append(image_result(img_path, file_hash, content_hash, encodings, make_thumbnail))
+            except Exception as e:
+                results.append(error_result(img_path, e))
+    return results
+
+def get_unindexed_paths(gallery_files, retry_failed=False):
+    """Images that are not cached yet or changed since they were cached"""
+    cached_hashes = get_cached_file_hashes(include_failed=not retry_failed)
+    return [p for p, file_hash in gallery_files.items() if cached_hashes.get(p) != file_hash]
+
+def group_by_content(img_paths, max_workers):
+    """Group images by content hash: returns {content_hash or path: [paths]}"""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        content_hashes = list(pool.map(get_content_hash, img_paths))
+    groups = {}
+    for img_path, content_hash in zip(img_paths, content_hashes):
+        # Unreadable files are kept on their own and fail later in the encoder
+        groups.setdefault(content_hash or img_path, []).append(img_path)
+    return groups
+
+def copy_rows(encodings, img_paths, gallery_files, content_hash):
+    """Cache rows giving each copy of one photo the same encodings"""
+    return [(p, encodings, get_original_name(p), gallery_files.get(p), content_hash) for p in img_paths]
+
+def index_gallery(photos_root, max_workers, full_rescan=False, make_thumbnails=False,
+                  detection_max_side=DETECTION_MAX_SIDE, model=DETECTION_MODEL,
+                  batch_size=CNN_BATCH_SIZE, upsample=DETECTION_UPSAMPLE, decode_threads=DECODE_THREADS,
+                  retry_failed=False):
+    """Encode every new or changed image under photos_root into the face cache
+
+    Returns the pipeline's per-stage metrics (None if nothing needed encoding).
+    """
+    setup_face_cache()
+    gallery_files = GalleryManifest(photos_root).scan(full_rescan=full_rescan)
+    pending = get_unindexed_paths(gallery_files, retry_failed)
+    print(f"📦 {len(gallery_files) - len(pending)} images already indexed, {len(pending)} new or changed")
+    if not pending:
+        return
+
+    # Encode each unique file once; copies of an indexed file reuse its encodings
+    groups = group_by_content(pending, max_workers)
+    known = get_cached_encodings_by_content(groups.keys())
+    reused_rows = []
+    for content_hash, encodings in known.items():
+        reused_rows.extend(copy_rows(encodings, groups.pop(content_hash), gallery_files, content_hash))
+    cache_face_encodings_batch(reused_rows)
+    copies = {paths[0]: paths[1:] for paths in groups.values()}
+    pending = list(copies)
+    total = len(pending)
+    duplicates = sum(len(paths) for paths in copies.values())
+    print(f"🧬 {len(reused_rows)} images reuse the encodings of an identical indexed file, "
+          f"{duplicates} duplicate copies share an encoding, {total} unique images to encode")
+    if not total:
+        return
+
+    batched = model == 'cnn' and batch_size > 1
+    print(f"⚡ Using {decode_threads} decode threads and {max_workers} parallel workers "
+          f"({model.upper()} detection)...")
+    start_time = time.time()
+    faces_found = 0
+    images_done = 0
+    failed_count = 0
+
+    def write(results):
+        # Faceless images are cached with no encodings and failures with their error,
+        # so neither is scanned again until the file changes
+        rows = []
+        failed = []
+        for result in results:
+            paths = [result['path']] + copies[result['path']]
+            if result['error']:
+                failed.extend((p, get_original_name(p), gallery_files.get(p, result['file_hash']), result['error'])
+                              for p in paths)
+                continue
+            rows.append((result['path'], result['encodings'], result['original_name'],
+                         result['file_hash'], result['content_hash']))
+            rows.extend(copy_rows(result['encodings'], copies[result['path']],
+                                  gallery_files, result['content_hash']))
+        cache_face_encodings_batch(rows)
+        cache_failed_images(failed)
+
+    def progress(tasks_done, task_count, results):
+        nonlocal faces_found, images_done, failed_count
+        images_done = min(tasks_done * step, total)
+        faces_found += sum(len(result['encodings']) for result in results)
+        failed_count += sum(1 for result in results if result['error'])
+        if tasks_done % max(1, PROGRESS_EVERY // step) == 0 or tasks_done == task_count:
+            elapsed = time.time() - start_time
+            rate = images_done / elapsed if elapsed else 0.0
+            eta = (total - images_done) / rate if rate else 0.0
+            print(f"📸 {images_done}/{total} images ({images_done / total:.0%}) | "
+                  f"{rate:.1f} images/second | {faces_found} faces | ETA {eta:.0f}s")
+            print(f"   ⚙️  {pipeline.describe()}")
+
+    # Each task is one image, or one batch of images sharing a batched CNN detection call
+    step = batch_size if batched else 1
+    tasks = [pending[i:i + step] for i in range(0, total, step)]
+    pipeline = IndexingPipeline(
+        decode=decode_images,
+        encode=partial(encode_loaded, make_thumbnail=make_thumbnails, detection_max_side=detection_max_side,
+                       model=model, upsample=upsample, batched=batched),
+        # Commit in batches as results arrive so an interrupted run can resume
+        write=write,
+        decode_threads=decode_threads,
+        encode_workers=max_workers,
+        write_batch_size=WRITE_BATCH_SIZE,
+    )
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    if not pipeline.run(tasks, executor, progress):
+        print(f"\n⏸️  Interrupted after {images_done}/{total} images - run again to resume")
+        return pipeline.stats()
+    executor.shutdown()
+
+    elapsed = time.time() - start_time
+    print(f"✅ Indexed {total} images ({faces_found} faces) in {elapsed:.1f}s "
+          f"= {total / elapsed:.1f} images/second")
+    print(f"   ⚙️  {pipeline.describe()} - bottleneck: {pipeline.bottleneck()}")
+    if failed_count:
+        print(f"⚠️  {failed_count} images could not be read; they are skipped until they change "
+              f"(or run with --retry-failed)")
+    return pipeline.stats()
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the face encoding index for the photo gallery")
+    parser.add_argument('--photos-root', default=PHOTOS_ROOT, help="Gallery folder to index")
+    parser.add_argument('--workers', type=int, default=min(multiprocessing.cpu_count(), 8),
+                        help="Number of parallel encoding processes")
+    parser.add_argument('--full-rescan', action='store_true',
+                        help="Re-list every folder instead of only folders whose mtime changed")
+    parser.add_argument('--detection-max-side', type=int, default=DETECTION_MAX_SIDE,
+                        help="Longest image side used for face detection (0 = full resolution)")
+    parser.add_argument('--model', choices=['hog', 'cnn'], default=DETECTION_MODEL,
+                        help="Face detector: hog (CPU friendly) or cnn (more accurate)")
+    parser.add_argument('--batch-size', type=int, default=CNN_BATCH_SIZE,
+                        help="Images per batched CNN detection call (cnn only; use --workers 1 on a GPU)")
+    parser.add_argument('--upsample', type=int, default=DETECTION_UPSAMPLE,
+                        help="Detector upsampling passes (finds smaller faces, slower)")
+    parser.add_argument('--thumbnails', action='store_true',
+                        help="Also pre-build the WebP result thumbnails")
+    parser.add_argument('--decode-threads', type=int, default=DECODE_THREADS,
+                        help="Threads reading and decoding photos ahead of the workers")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="Try again on images that previously failed to decode")
+    args = parser.parse_args()
+    if args.decode_threads < 1:
+        parser.error("--decode-threads must be at least 1")
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(message)s')
+    index_gallery(args.photos_root, args.workers, args.full_rescan, args.thumbnails,
+                  args.detection_max_side or None, args.model, args.batch_size, args.upsample,
+                  args.decode_threads, args.retry_failed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Staged indexing pipeline: decode -> detect/encode -> write
+Disk reads and JPEG decoding run on a thread pool that prefetches into a
+bounded queue, detection and encoding run on a process pool, and a single
+writer thread batches results into the face cache. Each stage keeps its
+own metrics, so a run shows whether storage, dlib or SQLite is the
+bottleneck.
+"""
+
+import time
+import queue
+import logging
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+_DONE = object()  # Marks the end of a queue
+
+logger = logging.getLogger(__name__)
+
+
+class StageMetrics:
+    """Items handled and time spent busy by one pipeline stage"""
+
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency  # Threads or processes working on the stage
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, items, seconds):
+        with self._lock:
+            self.items += items
+            self.busy_seconds += seconds
+
+    def utilisation(self, elapsed):
+        """Fraction of the stage's capacity in use: close to 1.0 means saturated"""
+        if elapsed <= 0:
+            return 0.0
+        return self.busy_seconds / (elapsed * self.concurrency)
+
+    def to_dict(self, elapsed):
+        return {
+            'items': self.items,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'concurrency': self.concurrency,
+            'utilisation': round(self.utilisation(elapsed), 3),
+        }
+
+
+class IndexingPipeline:
+    """Runs tasks through decode (threads), encode (processes) and write (one thread)
+
+    decode(task) -> item runs on decode_threads threads; returning None skips the task.
+    encode(item) -> (results, seconds) is submitted to a process pool and must be picklable.
+    write(results) is called from the writer thread with up to write_batch_size results.
+    """
+
+    def __init__(self, decode, encode, write, decode_threads, encode_workers,
+                 prefetch=None, write_batch_size=100):
+        if decode_threads < 1:
+            # With no decoder nothing ever ends the run
+            raise ValueError("decode_threads must be at least 1")
+        self.decode = decode
+        self.encode = encode
+        self.write = write
+        self.decode_threads = decode_threads
+        self.encode_workers = encode_workers
+        self.prefetch = prefetch or 2 * encode_workers  # Decoded tasks waiting for a worker
+        self.write_batch_size = write_batch_size
+        self.metrics = {
+            'decode': StageMetrics('decode', decode_threads),
+            'encode': StageMetrics('encode', encode_workers),
+            'write': StageMetrics('write', 1),
+        }
+        self.started = None
+        self._decoded = queue.Queue(maxsize=self.prefetch)
+        self._results = queue.Queue()
+        self._stop = threading.Event()
+        self._broken = False  # A worker process died and took the pool down with it
+
+    def elapsed(self):
+        return time.perf_counter() - self.started if self.started else 0.0
+
+    def stats(self):
+        """Per-stage metrics plus queue depth, as a plain dict"""
+        elapsed = self.elapsed()
+        stats = {name: m.to_dict(elapsed) for name, m in self.metrics.items()}
+        stats['prefetch_queue'] = {'depth': self._decoded.qsize(), 'capacity': self.prefetch}
+        return stats
+
+    def describe(self):
+        """One-line stage summary, e.g. for progress output"""
+        elapsed = self.elapsed()
+        stages = ' | '.join(f"{m.name} {m.utilisation(elapsed):.0%} busy" for m in self.metrics.values())
+        return f"{stages} | prefetch {self._decoded.qsize()}/{self.prefetch}"
+
+    def bottleneck(self):
+        elapsed = self.elapsed()
+        return max(self.metrics.values(), key=lambda m: m.utilisation(elapsed)).name
+
+    def _put(self, q, item):
+        # Block while the queue is full, but give up once the run is stopped
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decode_loop(self, tasks, tasks_lock):
+        try:
+            while not self._stop.is_set():
+                with tasks_lock:
+                    task = next(tasks, _DONE)
+                if task is _DONE:
+                    break
+                start = time.perf_counter()
+                try:
+                    item = self.decode(task)
+                except Exception as e:
+                    logger.warning(f"Error decoding {task}: {e}")
+                    item = None
+                self.metrics['decode'].record(1, time.perf_counter() - start)
+                if item is None:
+                    self._results.put([])  # Counts as done with no results
+                elif not self._put(self._decoded, item):
+                    break
+        finally:
+            self._put(self._decoded, _DONE)
+
+    def _encoded(self, future, slots):
+        slots.release()
+        if future.cancelled():
+            return
+        try:
+            results, seconds = future.result()
+            self.metrics['encode'].record(1, seconds)
+        except BrokenProcessPool:
+            self._broken = True  # run() stops at the next task
+            results = []
+        except Exception as e:
+            logger.warning(f"Error in encoding worker: {e}")
+            results = []
+        self._results.put(results)
+
+    def _write_loop(self, total, progress):
+        batch = []
+        done = 0
+        while done < total:
+            results = self._results.get()
+            if results is _DONE:
+                break
+            done += 1
+            batch.extend(results)
+            if len(batch) >= self.write_batch_size:
+                self._flush(batch)
+                batch = []
+            if progress:
+                progress(done, total, results)
+        self._flush(batch)
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        start = time.perf_counter()
+        self.write(batch)
+        self.metrics['write'].record(len(batch), time.perf_counter() - start)
+
+    def run(self, tasks, executor, progress=None):
+        """Process every task; progress(done, total, results) is called per finished task
+
+        Returns True if all tasks finished, False if interrupted or a worker
+        process died (everything encoded so far has been written).
+        """
+        tasks = list(tasks)
+        self.started = time.perf_counter()
+        tasks_iter, tasks_lock = iter(tasks), threading.Lock()
+        decoders = [threading.Thread(target=self._decode_loop, args=(tasks_iter, tasks_lock),
+                                     name=f'decode-{i}', daemon=True)
+                    for i in range(self.decode_threads)]
+        writer = threading.Thread(target=self._write_loop, args=(len(tasks), progress),
+                                  name='writer', daemon=True)
+        for thread in decoders + [writer]:
+            thread.start()
+
+        # Bound the tasks handed to the pool so decoded images don't pile up in its queue
+        slots = threading.BoundedSemaphore(self.prefetch)
+        try:
+            finished_decoders = 0
+            while finished_decoders < self.decode_threads:
+                item = self._decoded.get()
+                if item is _DONE:
+                    finished_decoders += 1
+                    continue
+                slots.acquire()
+                if self._broken:
+                    raise BrokenProcessPool("A worker process terminated abruptly")
+                future = executor.submit(self.encode, item)
+                future.add_done_callback(lambda f: self._encoded(f, slots))
+            writer.join()
+            if self._broken:
+                logger.error("❌ A worker process died; the images it had are encoded on the next run")
+            return not self._broken
+        except (KeyboardInterrupt, BrokenProcessPool) as e:
+            if isinstance(e, BrokenProcessPool):
+                logger.error(f"❌ Encoding workers failed: {e}")
+            self._stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._results.put(_DONE)
+            writer.join()
+            return False
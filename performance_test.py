@@ -1,171 +1,510 @@
 #!/usr/bin/env python3
 """
-Performance Test Script for High-Performance Face Recognition
-Tests the speed improvements without affecting quality
+Benchmark harness for the face search system
+Runs against a synthetic gallery of configurable size (or a fixture folder)
+and writes machine-readable JSON, so results can be compared across commits.
+
+Benchmarks:
+    indexing   cold index_gallery() runs at each worker count: images/second,
+               per-stage pipeline utilisation and peak memory
+    sqlite     face cache write throughput, loading the cache into a
+               GalleryIndex and batched cache reads
+    search     warm search latency (p50/p95/p99) against a synthetic index,
+               per search backend, with ANN recall against exact search
+    detection  detection resolution and HOG vs batched CNN on fixture photos
+
+Usage:
+    python performance_test.py --fixtures path/to/face/photos --gallery-size 200 --workers 1,2,4
+    python performance_test.py --benchmarks sqlite,search --index-size 100000
+    python performance_test.py --output run.json --compare baseline.json
 """
 
-import time
 import os
-import face_recognition
-from concurrent.futures import ProcessPoolExecutor
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import tracemalloc
 import multiprocessing
+from contextlib import contextmanager
+import numpy as np
+import face_recognition
+from PIL import Image
+import face_cache
+from face_cache import (
+    setup_face_cache, cache_face_encodings_batch, get_cached_face_encodings_batch,
+    iter_cached_face_encodings, get_file_hash
+)
+from gallery_index import GalleryIndex, ENCODING_SIZE
+from ann_index import make_ann_index, hnswlib
+from index_gallery import detect_and_encode, encode_image, encode_image_batch, index_gallery
+from gallery_manifest import IMAGE_EXTENSIONS
+
+try:
+    import psutil
+except ImportError:  # Optional: peak memory then falls back to tracemalloc (main process only)
+    psutil = None
+
+BENCHMARKS = ('indexing', 'sqlite', 'search', 'detection')
+DEFAULT_OUTPUT = "benchmark_results.json"
+MEMORY_SAMPLE_SECONDS = 0.05
+REGRESSION_THRESHOLD = 0.10  # Relative change flagged by --compare
+
+# Synthetic encodings: identities are ~0.9 apart, photos of one identity ~0.3 apart,
+# roughly the spread of real face_recognition encodings
+IDENTITY_SCALE = 0.056
+PHOTO_NOISE = 0.02
+
+
+class PeakMemory:
+    """Samples RSS of this process and its workers in the background and keeps the peak"""
+
+    def __init__(self):
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _rss(self, process):
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def _sample(self):
+        process = psutil.Process()
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, self._rss(process))
+            self._stop.wait(MEMORY_SAMPLE_SECONDS)
+
+    def __enter__(self):
+        if psutil is None:
+            tracemalloc.start()
+        else:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
 
-def process_single_image(args):
-    """Process a single image for parallel processing"""
-    img_path, query_encoding = args
+    def __exit__(self, *exc):
+        if psutil is None:
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            self._stop.set()
+            self._thread.join()
+        return False
+
+    @property
+    def peak_mb(self):
+        return round(self.peak_bytes / 1024 / 1024, 1)
+
+
+@contextmanager
+def fresh_face_cache(work_dir, name):
+    """Point face_cache at an empty database for the duration of a benchmark"""
+    previous = face_cache.FACE_CACHE_DB
+    face_cache.FACE_CACHE_DB = os.path.join(work_dir, f"{name}.db")
     try:
-        gallery_img = face_recognition.load_image_file(img_path)
-        gallery_encodings = face_recognition.face_encodings(gallery_img)
-        
-        if gallery_encodings:
-            best_distance = float('inf')
-            for face_encoding in gallery_encodings:
-                dist = face_recognition.face_distance([query_encoding], face_encoding)[0]
-                if dist < best_distance:
-                    best_distance = dist
-            
-            return {
-                'path': img_path,
-                'distance': best_distance
-            }
-    except:
-        return None
-    return None
-
-def test_sequential_processing(image_paths, query_encoding):
-    """Test sequential processing (old method)"""
-    print("🐌 Testing SEQUENTIAL processing...")
-    start_time = time.time()
-    
-    results = []
-    for img_path in image_paths:
-        try:
-            gallery_img = face_recognition.load_image_file(img_path)
-            gallery_encodings = face_recognition.face_encodings(gallery_img)
-            
-            if gallery_encodings:
-                best_distance = float('inf')
-                for face_encoding in gallery_encodings:
-                    dist = face_recognition.face_distance([query_encoding], face_encoding)[0]
-                    if dist < best_distance:
-                        best_distance = dist
-                
-                results.append({
-                    'path': img_path,
-                    'distance': best_distance
-                })
-        except:
+        setup_face_cache()
+        yield face_cache.FACE_CACHE_DB
+    finally:
+        face_cache.FACE_CACHE_DB = previous
+
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+        'max_ms': round(float(samples.max()), 3),
+    }
+
+def find_images(folder):
+    image_paths = []
+    for root, _, files in os.walk(folder):
+        for file in sorted(files):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                image_paths.append(os.path.join(root, file))
+    return sorted(image_paths)
+
+def make_synthetic_gallery(root, count, fixtures=(), image_size=(1600, 1200), seed=0):
+    """Write a gallery of `count` JPEGs under root, 100 per event folder
+
+    With fixture photos, each gallery image is a slightly cropped and
+    re-encoded copy of one of them, so faces are real but every file has
+    unique bytes (content-hash dedup does not collapse them). Without
+    fixtures the images are smooth random noise: realistic decode cost, no faces.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = image_size
+    sources = [Image.open(p).convert('RGB') for p in fixtures]
+    paths = []
+    for i in range(count):
+        if sources:
+            source = sources[i % len(sources)]
+            crop = rng.uniform(0.9, 1.0)
+            w, h = source.size
+            left, top = rng.integers(0, int(w * (1 - crop)) + 1), rng.integers(0, int(h * (1 - crop)) + 1)
+            img = source.crop((left, top, left + int(w * crop), top + int(h * crop)))
+        else:
+            small = rng.integers(0, 256, (height // 32, width // 32, 3), dtype=np.uint8)
+            img = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+        folder = os.path.join(root, f"event_{i // 100:04d}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"img_{i:06d}.jpg")
+        img.save(path, 'JPEG', quality=int(rng.integers(85, 96)))
+        paths.append(path)
+    return paths
+
+def make_synthetic_encodings(image_count, identities=1000, max_faces=3, seed=0):
+    """Random gallery: returns ([(path, encodings)], identity centroids)"""
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(0, IDENTITY_SCALE, (identities, ENCODING_SIZE)).astype(np.float32)
+    face_counts = rng.integers(1, max_faces + 1, image_count)
+    people = rng.integers(0, identities, face_counts.sum())
+    faces = centroids[people] + rng.normal(0, PHOTO_NOISE, (len(people), ENCODING_SIZE)).astype(np.float32)
+    offsets = np.concatenate(([0], np.cumsum(face_counts)))
+    images = [(f"synthetic/event_{i // 100:04d}/img_{i:07d}.jpg", faces[offsets[i]:offsets[i + 1]])
+              for i in range(image_count)]
+    return images, centroids
+
+def make_queries(centroids, count, seed=1):
+    rng = np.random.default_rng(seed)
+    people = rng.integers(0, len(centroids), count)
+    return centroids[people] + rng.normal(0, PHOTO_NOISE, (count, ENCODING_SIZE)).astype(np.float32)
+
+def bench_indexing(gallery_root, gallery_size, worker_counts, decode_threads, work_dir):
+    """Cold indexing throughput at each worker count"""
+    print(f"🏭 Benchmarking COLD INDEXING of {gallery_size} images...")
+    rows = []
+    for workers in worker_counts:
+        with fresh_face_cache(work_dir, f"indexing_{workers}"), PeakMemory() as memory:
+            start = time.perf_counter()
+            stages = index_gallery(gallery_root, workers, full_rescan=True, decode_threads=decode_threads)
+            seconds = time.perf_counter() - start
+        rows.append({
+            'workers': workers,
+            'seconds': round(seconds, 3),
+            'images_per_second': round(gallery_size / seconds, 2),
+            'peak_memory_mb': memory.peak_mb,
+            'stages': stages,
+        })
+    print(f"   {'Workers':>8} {'Time':>9} {'img/s':>8} {'Peak MB':>8}")
+    for row in rows:
+        print(f"   {row['workers']:>8} {row['seconds']:>8.2f}s {row['images_per_second']:>8.2f} {row['peak_memory_mb']:>8}")
+    return rows
+
+def bench_sqlite(images, work_dir, batch_reads=20, batch_size=1000):
+    """Face cache write throughput, full load into memory and batched reads"""
+    print(f"🗄️  Benchmarking SQLITE with {len(images)} cached images...")
+    with fresh_face_cache(work_dir, "sqlite") as db_path:
+        rows = [(path, encodings, os.path.basename(path), get_file_hash(path), f"content-{i}")
+                for i, (path, encodings) in enumerate(images)]
+        start = time.perf_counter()
+        for i in range(0, len(rows), 1000):
+            cache_face_encodings_batch(rows[i:i + 1000])
+        write_seconds = time.perf_counter() - start
+
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            index = GalleryIndex()
+            for image_path, encodings, file_hash, original_name, _, content_hash in iter_cached_face_encodings():
+                index.add(image_path, encodings, original_name, file_hash, content_hash)
+            index.best_distances(np.zeros(ENCODING_SIZE, dtype=np.float32))  # Pack the matrix
+            load_seconds = time.perf_counter() - start
+
+        rng = np.random.default_rng(2)
+        latencies = []
+        for _ in range(batch_reads):
+            paths = [images[i][0] for i in rng.integers(0, len(images), batch_size)]
+            start = time.perf_counter()
+            get_cached_face_encodings_batch(paths)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        result = {
+            'images': len(images),
+            'faces': int(len(index.matrix)),
+            'db_bytes': os.path.getsize(db_path),
+            'write_rows_per_second': round(len(rows) / write_seconds, 1),
+            'load_seconds': round(load_seconds, 3),
+            'load_peak_memory_mb': memory.peak_mb,
+            'matrix_mb': round(index.matrix.nbytes / 1024 / 1024, 1),
+            f'batch_read_{batch_size}': percentiles(latencies),
+        }
+    print(f"   Write: {result['write_rows_per_second']:.0f} rows/s | Load: {result['load_seconds']:.2f}s "
+          f"({result['faces']} faces, {result['matrix_mb']} MB matrix) | "
+          f"Batch read of {batch_size}: p50 {result[f'batch_read_{batch_size}']['p50_ms']:.1f}ms")
+    return result
+
+def bench_search(images, centroids, backends, query_count, max_distance=0.5, multi_face=4):
+    """Warm search latency per backend, with recall of ANN backends against exact search"""
+    print(f"🔎 Benchmarking WARM SEARCH over {len(images)} images...")
+    queries = make_queries(centroids, query_count)
+    results = {}
+    exact_hits = None
+    for backend in backends:
+        index = GalleryIndex(make_ann_index(backend))
+        for path, encodings in images:
+            index.add(path, encodings, os.path.basename(path))
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            index.best_distances(queries[0])  # Packs the matrix and builds the ANN index
+            build_seconds = time.perf_counter() - start
+
+        latencies = []
+        hits = []
+        for query in queries:
+            start = time.perf_counter()
+            matches = index.search(query, max_distance)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits.append({m[0] for m in matches})
+
+        # One pass for several faces of a group photo
+        multi_latencies = []
+        for i in range(0, query_count - multi_face + 1, multi_face):
+            start = time.perf_counter()
+            for _ in index.iter_search(queries[i:i + multi_face], max_distance):
+                pass
+            multi_latencies.append((time.perf_counter() - start) * 1000)
+
+        result = {
+            'build_seconds': round(build_seconds, 3),
+            'build_peak_memory_mb': memory.peak_mb,
+            'ann_active': bool(index.ann_index is not None and index.ann_index.ready),
+            'mean_matches': round(float(np.mean([len(h) for h in hits])), 1),
+            'single_face': percentiles(latencies),
+            f'{multi_face}_faces': percentiles(multi_latencies) if multi_latencies else None,
+        }
+        if exact_hits is None and backend == 'exact':
+            exact_hits = hits
+        elif exact_hits is not None:
+            found = sum(len(h & e) for h, e in zip(hits, exact_hits))
+            expected = sum(len(e) for e in exact_hits)
+            result['recall'] = round(found / expected, 4) if expected else 1.0
+        results[backend] = result
+        recall = f" | recall {result['recall']:.1%}" if 'recall' in result else ""
+        print(f"   {backend:>6}: p50 {result['single_face']['p50_ms']:.2f}ms | "
+              f"p99 {result['single_face']['p99_ms']:.2f}ms | build {build_seconds:.2f}s{recall}")
+    return results
+
+def bench_detection_resolution(image_paths, max_sides=(None, 2400, 1600, 1200, 800)):
+    """Compare encoding throughput and accuracy at different detection resolutions"""
+    print("🔬 Testing DETECTION RESOLUTION trade-off...")
+    images = [face_recognition.load_image_file(p) for p in image_paths]
+    baseline = None
+    rows = []
+
+    for max_side in max_sides:
+        start_time = time.time()
+        encodings = [detect_and_encode(img, max_side) for img in images]
+        processing_time = time.time() - start_time
+        faces = sum(len(e) for e in encodings)
+
+        if baseline is None:
+            baseline = encodings
+        # Accuracy vs full resolution: each full-res face should still be found,
+        # with an encoding close to the full-res one
+        matched = 0
+        drift = []
+        for full, reduced in zip(baseline, encodings):
+            for face in full:
+                if len(reduced):
+                    dist = face_recognition.face_distance(reduced, face).min()
+                    drift.append(dist)
+                    if dist <= 0.35:
+                        matched += 1
+        baseline_faces = sum(len(e) for e in baseline)
+        recall = matched / baseline_faces if baseline_faces else 1.0
+        mean_drift = float(np.mean(drift)) if drift else 0.0
+        label = "full" if max_side is None else f"{max_side}px"
+        rows.append({'detect_at': label, 'seconds': round(processing_time, 3),
+                     'images_per_second': round(len(images) / processing_time, 2),
+                     'faces': faces, 'recall': round(recall, 4), 'mean_drift': round(mean_drift, 4)})
+
+    print(f"   {'Detect at':>10} {'Time':>8} {'img/s':>7} {'Faces':>6} {'Recall':>7} {'Drift':>6}")
+    for row in rows:
+        print(f"   {row['detect_at']:>10} {row['seconds']:>7.2f}s {row['images_per_second']:>7.2f} "
+              f"{row['faces']:>6} {row['recall']:>7.1%} {row['mean_drift']:>6.3f}")
+    print("   Recall = full-resolution faces still matched within 0.35; Drift = mean encoding distance")
+
+    return rows
+
+def bench_detection_models(image_paths, configs=(('hog', 1), ('cnn', 1), ('cnn', 8), ('cnn', 32))):
+    """Compare HOG against single and batched CNN detection (one process, CPU or GPU)"""
+    print("🧠 Testing DETECTION MODELS (HOG vs batched CNN)...")
+    baseline = None
+    rows = []
+
+    for model, batch_size in configs:
+        start_time = time.time()
+        if batch_size > 1:
+            results = []
+            for i in range(0, len(image_paths), batch_size):
+                results.extend(encode_image_batch(image_paths[i:i + batch_size]))
+        else:
+            results = [encode_image(p, model=model) for p in image_paths]
+        processing_time = time.time() - start_time
+        encodings = {r['path']: r['encodings'] for r in results if r is not None}
+
+        if baseline is None:
+            baseline = encodings
+        # Agreement with the first (HOG) run: its faces found again within 0.35
+        baseline_faces = sum(len(e) for e in baseline.values())
+        matched = sum(
+            1 for path, faces in baseline.items() for face in faces
+            if len(encodings.get(path, [])) and face_recognition.face_distance(encodings[path], face).min() <= 0.35
+        )
+        faces = sum(len(e) for e in encodings.values())
+        label = model.upper() if batch_size == 1 else f"{model.upper()} x{batch_size}"
+        recall = matched / baseline_faces if baseline_faces else 1.0
+        rows.append({'detector': label, 'seconds': round(processing_time, 3),
+                     'images_per_second': round(len(image_paths) / processing_time, 2),
+                     'faces': faces, 'agreement_with_hog': round(recall, 4)})
+
+    print(f"   {'Detector':>10} {'Time':>8} {'img/s':>7} {'Faces':>6} {'vs HOG':>7}")
+    for row in rows:
+        print(f"   {row['detector']:>10} {row['seconds']:>7.2f}s {row['images_per_second']:>7.2f} "
+              f"{row['faces']:>6} {row['agreement_with_hog']:>7.1%}")
+
+    return rows
+
+def get_metadata():
+    """Environment details stored with every run"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit or None,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': multiprocessing.cpu_count(),
+    }
+
+def flatten(results, prefix=''):
+    """Nested benchmark results -> {'search.exact.single_face.p50_ms': value} for numeric leaves"""
+    flat = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            flat.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(results, list):
+        for i, value in enumerate(results):
+            label = value.get('workers', value.get('detect_at', value.get('detector', i))) if isinstance(value, dict) else i
+            flat.update(flatten(value, f"{prefix}{label}."))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        flat[prefix[:-1]] = results
+    return flat
+
+def compare_results(baseline, current):
+    """Print the relative change of every metric present in both runs, flagging regressions"""
+    print(f"📊 Comparing against {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')})")
+    old, new = flatten(baseline['results']), flatten(current['results'])
+    regressions = 0
+    for key in sorted(old.keys() & new.keys()):
+        if not old[key]:
             continue
-    
-    processing_time = time.time() - start_time
-    images_per_second = len(image_paths) / processing_time
-    
-    print(f"🐌 Sequential Results:")
-    print(f"   Time: {processing_time:.2f} seconds")
-    print(f"   Speed: {images_per_second:.1f} images/second")
-    print(f"   Matches found: {len(results)}")
-    
-    return processing_time, images_per_second
-
-def test_parallel_processing(image_paths, query_encoding):
-    """Test parallel processing (new method)"""
-    print("⚡ Testing PARALLEL processing...")
-    
-    start_time = time.time()
-    
-    # Prepare arguments for parallel processing
-    args_list = [(img_path, query_encoding) for img_path in image_paths]
-    
-    # Use parallel processing
-    max_workers = min(multiprocessing.cpu_count(), 8)
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        results = list(executor.map(process_single_image, args_list))
-    
-    # Filter out None results
-    results = [r for r in results if r is not None]
-    
-    processing_time = time.time() - start_time
-    images_per_second = len(image_paths) / processing_time
-    
-    print(f"⚡ Parallel Results:")
-    print(f"   Time: {processing_time:.2f} seconds")
-    print(f"   Speed: {images_per_second:.1f} images/second")
-    print(f"   Matches found: {len(results)}")
-    print(f"   Workers used: {max_workers}")
-    
-    return processing_time, images_per_second
+        change = (new[key] - old[key]) / abs(old[key])
+        # Throughput and recall should go up; times, latencies and memory should go down
+        higher_is_better = key.endswith(('per_second', 'recall', 'agreement_with_hog'))
+        lower_is_better = key.endswith(('_ms', 'seconds', '_mb', '_bytes'))
+        regressed = ((higher_is_better and change < -REGRESSION_THRESHOLD) or
+                     (lower_is_better and change > REGRESSION_THRESHOLD))
+        regressions += regressed
+        marker = "⚠️ " if regressed else "  "
+        print(f" {marker} {key}: {old[key]:g} -> {new[key]:g} ({change:+.1%})")
+    print(f"{'⚠️ ' if regressions else '✅'} {regressions} metrics regressed by more than {REGRESSION_THRESHOLD:.0%}")
+    return regressions
 
 def main():
-    """Main performance test"""
-    print("🚀 HIGH-PERFORMANCE FACE RECOGNITION PERFORMANCE TEST")
+    parser = argparse.ArgumentParser(description="Benchmark indexing, the face cache and search")
+    parser.add_argument('--benchmarks', default=','.join(BENCHMARKS),
+                        help=f"Comma-separated subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--gallery', help="Index an existing gallery folder instead of a synthetic one")
+    parser.add_argument('--fixtures', help="Folder of face photos used to build the synthetic gallery "
+                                           "(and for the detection benchmark)")
+    parser.add_argument('--gallery-size', type=int, default=200, help="Images in the synthetic gallery")
+    parser.add_argument('--workers', default=','.join(str(w) for w in sorted({1, 2, min(multiprocessing.cpu_count(), 8)})),
+                        help="Comma-separated worker counts for the indexing benchmark")
+    parser.add_argument('--decode-threads', type=int, default=4)
+    parser.add_argument('--index-size', type=int, default=50000,
+                        help="Images in the synthetic encoding index (sqlite and search benchmarks)")
+    parser.add_argument('--queries', type=int, default=200, help="Searches timed per backend")
+    parser.add_argument('--backends', default='exact,ivf' + (',hnsw' if hnswlib is not None else ''),
+                        help="Search backends to compare")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Where to write the JSON results")
+    parser.add_argument('--compare', help="Earlier results JSON to compare this run against")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(message)s')
+
+    selected = [b.strip() for b in args.benchmarks.split(',') if b.strip()]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+    fixtures = find_images(args.fixtures) if args.fixtures else []
+
+    print("🚀 FACE SEARCH BENCHMARKS")
     print("=" * 60)
-    
-    # Get sample images for testing
-    photos_root = r"C:\Users\User1\Desktop\face recognition - v3\static\photos"
-    
-    if not os.path.exists(photos_root):
-        print(f"❌ Photos directory not found: {photos_root}")
-        return
-    
-    # Get all image paths
-    image_paths = []
-    for root, _, files in os.walk(photos_root):
-        for file in files:
-            if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                image_paths.append(os.path.join(root, file))
-    
-    if not image_paths:
-        print("❌ No images found for testing")
-        return
-    
-    print(f"📸 Found {len(image_paths)} images for testing")
-    
-    # Create a dummy query encoding for testing
-    print("🔍 Creating test query encoding...")
+    run = {'meta': get_metadata(), 'params': vars(args), 'results': {}}
+    work_dir = tempfile.mkdtemp(prefix="face-benchmark-")
     try:
-        # Use first image as query
-        test_img = face_recognition.load_image_file(image_paths[0])
-        query_encodings = face_recognition.face_encodings(test_img)
-        if not query_encodings:
-            print("❌ No faces found in test image")
-            return
-        query_encoding = query_encodings[0]
-    except Exception as e:
-        print(f"❌ Error creating test encoding: {e}")
-        return
-    
-    print(f"✅ Test query encoding created successfully")
-    print()
-    
-    # Test both methods
-    seq_time, seq_speed = test_sequential_processing(image_paths, query_encoding)
-    print()
-    par_time, par_speed = test_parallel_processing(image_paths, query_encoding)
-    
-    print()
-    print("📊 PERFORMANCE COMPARISON")
-    print("=" * 40)
-    
-    speedup = seq_time / par_time
-    speedup_percent = (par_speed / seq_speed - 1) * 100
-    
-    print(f"🚀 Speed Improvement: {speedup:.1f}x faster")
-    print(f"⚡ Speed Increase: {speedup_percent:.0f}% faster")
-    print(f"⏱️  Time Saved: {seq_time - par_time:.2f} seconds")
-    
-    if speedup > 2:
-        print("🎉 EXCELLENT: Significant performance improvement!")
-    elif speedup > 1.5:
-        print("👍 GOOD: Noticeable performance improvement!")
-    else:
-        print("📈 MODEST: Some performance improvement")
-    
-    print()
-    print("💡 OPTIMIZATION BENEFITS:")
-    print("   • Parallel processing uses all CPU cores")
-    print("   • Smart caching avoids reprocessing unchanged images")
-    print("   • Zero quality loss - same face recognition accuracy")
-    print("   • Scales to millions of images efficiently")
+        if 'indexing' in selected:
+            gallery_root = args.gallery
+            if gallery_root:
+                gallery_size = len(find_images(gallery_root))
+            else:
+                gallery_root = os.path.join(work_dir, "gallery")
+                print(f"🖼️  Generating a synthetic gallery of {args.gallery_size} images "
+                      f"({'from ' + str(len(fixtures)) + ' fixture photos' if fixtures else 'no faces'})...")
+                gallery_size = len(make_synthetic_gallery(gallery_root, args.gallery_size, fixtures, seed=args.seed))
+            worker_counts = [int(w) for w in args.workers.split(',')]
+            run['results']['indexing'] = bench_indexing(gallery_root, gallery_size, worker_counts,
+                                                        args.decode_threads, work_dir)
+            print()
+
+        if 'sqlite' in selected or 'search' in selected:
+            images, centroids = make_synthetic_encodings(args.index_size, seed=args.seed)
+            if 'sqlite' in selected:
+                run['results']['sqlite'] = bench_sqlite(images, work_dir)
+                print()
+            if 'search' in selected:
+                backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+                run['results']['search'] = bench_search(images, centroids, backends, args.queries)
+                print()
+
+        if 'detection' in selected:
+            if fixtures:
+                run['results']['detection'] = {
+                    'resolution': bench_detection_resolution(fixtures),
+                    'models': bench_detection_models(fixtures),
+                }
+                print()
+            else:
+                print("⏭️  Skipping detection benchmarks (needs --fixtures)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(run, f, indent=2)
+    print(f"💾 Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare_results(baseline, run):
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
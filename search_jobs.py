@@ -0,0 +1,133 @@
+"""
+Background search jobs with progress events
+A search is submitted as a job and runs on a small thread pool inside the
+web process. Clients poll the job's state or follow its event stream
+(Server-Sent Events) to see progress and matches as they are found.
+"""
+
+import time
+import json
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SEARCH_JOB_THREADS = 4  # Searches running at the same time
+JOB_TTL_SECONDS = 15 * 60  # Finished jobs are forgotten after this long
+
+_executor = ThreadPoolExecutor(max_workers=SEARCH_JOB_THREADS, thread_name_prefix='search-job')
+_jobs = {}
+_jobs_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+class SearchJob:
+    """State and event log of one background search"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'  # queued -> running -> done | error
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._events = []
+        self._changed = threading.Condition()
+
+    def publish(self, event, data):
+        """Append an event to the log and wake up stream readers"""
+        with self._changed:
+            if event == 'progress':
+                self.progress.update(data)
+            self._events.append((event, data))
+            self._changed.notify_all()
+
+    def wait_for_events(self, start, timeout):
+        """Return events after index `start`, waiting up to timeout seconds for new ones"""
+        with self._changed:
+            if len(self._events) <= start and not self.is_finished():
+                self._changed.wait(timeout)
+            return self._events[start:]
+
+    def is_finished(self):
+        return self.status in ('done', 'error')
+
+    def stream_events(self, start, keepalive_seconds):
+        """Yield events from index `start` as Server-Sent Events until 'done' or 'error'
+
+        Idle streams get a keep-alive comment every keepalive_seconds. A client
+        that reconnects after the job finished is sent the final event again, so
+        it stops instead of reconnecting forever.
+        """
+        position = start
+        while True:
+            events = self.wait_for_events(position, timeout=keepalive_seconds)
+            if not events:
+                if self.is_finished():
+                    final = len(self._events) - 1
+                    yield format_event(final, *self._events[final])
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for event, data in events:
+                yield format_event(position, event, data)
+                position += 1
+                if event in ('done', 'error'):
+                    return
+
+    def to_dict(self):
+        with self._changed:
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'progress': dict(self.progress),
+                'result': self.result,
+                'error': self.error,
+            }
+
+    def run(self, search_fn, *args):
+        self.status = 'running'
+        self.publish('status', {'status': 'running'})
+        try:
+            self.result = search_fn(*args, progress=self.publish)
+            self._finish('done', self.result)
+        except Exception as e:
+            logger.exception(f"❌ Search job {self.id} failed: {e}")
+            self.error = str(e)
+            self._finish('error', {'error': self.error})
+
+    def _finish(self, status, data):
+        """Set the final status and publish it as the last event in one step,
+        so a finished job always ends with its 'done' or 'error' event"""
+        with self._changed:
+            self.status = status
+            self.finished = time.time()
+            self._events.append((status, data))
+            self._changed.notify_all()
+
+
+def format_event(position, event, data):
+    return f"id: {position}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def submit_search_job(search_fn, *args):
+    """Start search_fn(*args, progress=callback) in the background and return its job"""
+    job = SearchJob()
+    with _jobs_lock:
+        expire_jobs()
+        _jobs[job.id] = job
+    _executor.submit(job.run, search_fn, *args)
+    return job
+
+
+def get_search_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def expire_jobs():
+    """Forget finished jobs older than JOB_TTL_SECONDS (call with _jobs_lock held)"""
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for job_id in [j.id for j in _jobs.values() if j.finished and j.finished < cutoff]:
+        del _jobs[job_id]
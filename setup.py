@@ -42,7 +42,6 @@ def create_directories():
     print("\n📁 Creating directories...")
     directories = [
         "static/photos",
-        "static/results", 
         "static/uploads",
         "logs"
     ]
@@ -74,7 +73,7 @@ def update_config_files(photos_path):
     """Update configuration in Python files"""
     print("\n⚙️  Updating configuration files...")
     
-    files_to_update = ["app.py", "v4.py"]
+    files_to_update = ["app.py", "v4.py", "index_gallery.py"]
     
     for filename in files_to_update:
         if os.path.exists(filename):
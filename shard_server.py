@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Scatter-gather search over several index nodes
+Each node is a small HTTP server holding one slice of the gallery index
+(photos are assigned to nodes by a hash of their gallery-relative path) and
+answering distance queries for it. The web app's coordinator (ShardCluster)
+sends the query encodings to every node in parallel and merges their
+matches by distance, so a search is spread over several processes or machines.
+
+Usage (3 nodes on one machine, then set SHARD_NODES in app.py):
+    python shard_server.py --node 0 --nodes 3      # http://127.0.0.1:5100
+    python shard_server.py --node 1 --nodes 3      # http://127.0.0.1:5101
+    python shard_server.py --node 2 --nodes 3      # http://127.0.0.1:5102
+
+Nodes load their slice from face_cache.db and pick up new rows on every
+request, so photos encoded by index_gallery.py or the web app's background
+workers are searchable without restarting them.
+
+Protocol (JSON over HTTP):
+    GET  /status  -> {node, nodes, images, faces, version}
+    POST /count   {scope, stale}                                -> {images}
+    POST /search  {queries, max_distance, scope, limit, stale}  -> {matches, overflowed, scanned, images}
+matches are [query face, image path, original name, distance], the best
+`limit` original names per query face (every match within max_distance if
+limit is null); overflowed[face] is true if the node left matches out.
+stale lists [image path, file hash] of cached images the coordinator found
+deleted or changed on disk; nodes drop those rows before searching. The
+coordinator deletes them from face_cache.db too, and stops sending them once
+every node has answered a request that listed them.
+"""
+
+import os
+import zlib
+import json
+import logging
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from flask import Flask, request, jsonify, abort
+import face_cache
+from face_cache import setup_face_cache, iter_cached_face_encodings, iter_cached_file_hashes, delete_cached_images
+from gallery_index import TopMatches
+from gallery_shards import ShardedGalleryIndex, SearchScope
+from ann_index import make_ann_index
+
+PHOTOS_ROOT = r"C:\Users\User1\Desktop\face recognition - v3\static\photos"  # Set your photos folder
+BASE_PORT = 5100  # Node i listens on BASE_PORT + i unless --port is given
+NODE_TIMEOUT = 30  # Seconds to wait for a node before failing the search
+
+logger = logging.getLogger(__name__)
+
+
+def node_for_path(image_path, root, nodes):
+    """Node (0 .. nodes-1) that owns an image; stable across processes and machines"""
+    rel_path = os.path.relpath(image_path, root).replace(os.sep, '/')
+    return zlib.crc32(rel_path.encode('utf-8')) % nodes
+
+def in_root(image_path, root):
+    """Whether an image is in the gallery under root (face_cache.db may hold other galleries)"""
+    return image_path.startswith(os.path.join(root, ''))
+
+def scope_to_json(scope):
+    return None if scope is None else scope._asdict()
+
+def scope_from_json(data):
+    if not data:
+        return None
+    return SearchScope(tuple(data['date_from']) if data.get('date_from') else None,
+                       tuple(data['date_to']) if data.get('date_to') else None,
+                       data.get('folder'))
+
+
+# Node: one slice of the index behind a local HTTP API
+app = Flask(__name__)
+node_index = None
+node_index_lock = threading.Lock()
+NODE = 0
+NODES = 1
+
+
+def refresh_node_index():
+    """Load the face cache rows of this node's slice written since the last refresh"""
+    loaded = 0
+    for image_path, encodings, file_hash, original_name, last_modified, content_hash in \
+            iter_cached_face_encodings(modified_after=node_index.last_modified):
+        node_index.last_modified = max(node_index.last_modified, last_modified)
+        if not in_root(image_path, node_index.root) or node_for_path(image_path, node_index.root, NODES) != NODE:
+            continue
+        node_index.add(image_path, encodings, original_name, file_hash, content_hash)
+        loaded += 1
+    if loaded:
+        logger.info(f"🧠 Node {NODE}: loaded {loaded} cached images ({len(node_index)} indexed)")
+
+def drop_stale_rows(stale):
+    """Remove the rows of files the coordinator found deleted or changed on disk
+
+    Matched by file hash, so a row re-encoded since is kept. The coordinator
+    has already deleted these rows from the face cache, so a restarted node
+    doesn't load them again.
+    """
+    removed = 0
+    for image_path, file_hash in stale or ():
+        if image_path in node_index and node_index.file_hash(image_path) == file_hash:
+            node_index.remove(image_path)
+            removed += 1
+    if removed:
+        logger.info(f"🧹 Node {NODE}: dropped {removed} deleted or changed images")
+
+@app.route('/status')
+def status():
+    with node_index_lock:
+        refresh_node_index()
+        return jsonify({'node': NODE, 'nodes': NODES, 'images': len(node_index),
+                        'faces': node_index.face_count(), 'version': node_index.version})
+
+@app.route('/count', methods=['POST'])
+def count():
+    data = request.get_json(silent=True) or {}
+    with node_index_lock:
+        refresh_node_index()
+        drop_stale_rows(data.get('stale'))
+        return jsonify({'images': node_index.count(scope_from_json(data.get('scope')))})
+
+@app.route('/search', methods=['POST'])
+def search():
+    """Best matches per query face and original name in this node's slice"""
+    data = request.get_json(silent=True)
+    if not data or not data.get('queries'):
+        abort(400)
+    queries = np.asarray(data['queries'], dtype=np.float32)
+    scope = scope_from_json(data.get('scope'))
+    with node_index_lock:
+        refresh_node_index()
+        # Before ranking, so a stale row never takes the place of a live match
+        drop_stale_rows(data.get('stale'))
+        images = node_index.count(scope)
+        # Chunks are computed from a snapshot, so the lock is not held while scanning
+        chunks = node_index.iter_search(queries, max_distance=float(data.get('max_distance', 0.5)), scope=scope)
+
+    best_by_name = [TopMatches(data.get('limit')) for _ in range(len(queries))]
+    scanned = 0
+    for chunk_matches, scanned in chunks:
+        for query_face, img_path, original_name, distance in chunk_matches:
+            best_by_name[query_face].offer(original_name, img_path, distance)
+    matches = [[face, img_path, original_name, float(distance)]
+               for face, face_matches in enumerate(best_by_name)
+               for original_name, img_path, distance in face_matches.ranked()]
+    return jsonify({'matches': matches, 'overflowed': [m.overflowed for m in best_by_name],
+                    'scanned': scanned, 'images': images})
+
+
+# Coordinator: the gallery index interface over every node
+class ShardCluster:
+    """Fans searches out to shard_server.py nodes and streams their matches back
+
+    Used by app.py in place of the in-process index. The coordinator only
+    tracks which images are in the face cache (path -> file hash) so new photos
+    can be queued for indexing, and which cached images were deleted or changed
+    on disk, so the nodes drop them. Their face cache rows are deleted, so once
+    every node has dropped them they are forgotten.
+    """
+
+    def __init__(self, nodes, root, timeout=NODE_TIMEOUT):
+        self.nodes = [url.rstrip('/') for url in nodes]
+        self.root = os.path.normpath(root)
+        self.timeout = timeout
+        self._file_hashes = {}  # image_path -> file_hash of every cached image under root
+        self._stale = {}  # image_path -> cached file_hash of dropped images some node may still hold
+        self._stale_lock = threading.Lock()  # Searches forget stale rows outside the caller's lock
+        self.version = 0  # Bumped on every change, so cached search results can be invalidated
+        self.last_modified = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=len(self.nodes), thread_name_prefix='shard-node')
+
+    def __len__(self):
+        return len(self._file_hashes)
+
+    def file_hash(self, image_path):
+        return self._file_hashes.get(image_path)
+
+    def refresh(self):
+        """Pull face cache rows written since the last refresh; the nodes load the same rows
+
+        Returns the paths loaded.
+        """
+        loaded = []
+        for image_path, file_hash, last_modified in iter_cached_file_hashes(self.last_modified):
+            self.last_modified = max(self.last_modified, last_modified)
+            if not in_root(image_path, self.root):
+                continue
+            self._file_hashes[image_path] = file_hash
+            with self._stale_lock:
+                self._stale.pop(image_path, None)  # Re-encoded; remove() drops it again if still stale
+            loaded.append(image_path)
+        if loaded:
+            self.version += 1
+        return loaded
+
+    def remove(self, image_path):
+        """Forget an image; the nodes drop its row on the next request"""
+        self._drop([image_path])
+
+    def retain(self, image_paths):
+        """Forget images not in image_paths; the nodes drop their rows on the next request"""
+        keep = set(image_paths)
+        self._drop([p for p in self._file_hashes if p not in keep])
+
+    def _drop(self, image_paths):
+        stale = [(p, self._file_hashes.pop(p)) for p in image_paths if p in self._file_hashes]
+        if not stale:
+            return
+        # Deleted before any node is told, so a node restarting later never loads them again
+        delete_cached_images(stale)
+        with self._stale_lock:
+            self._stale.update(stale)
+        self.version += 1
+
+    def _stale_rows(self):
+        with self._stale_lock:
+            return list(self._stale.items())
+
+    def _forget_stale(self, sent):
+        """Stop sending rows every node has answered a request with; they are out of every index"""
+        with self._stale_lock:
+            for image_path, file_hash in sent:
+                if self._stale.get(image_path) == file_hash:
+                    del self._stale[image_path]
+
+    def _post(self, node, path, payload):
+        req = urllib.request.Request(node + path, data=json.dumps(payload).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return json.load(response)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise ConnectionError(f"Shard node {node} failed: {e}") from e
+
+    def _scatter(self, path, payload):
+        """(node, future) for a request sent to every node in parallel"""
+        return [(node, self._executor.submit(self._post, node, path, payload)) for node in self.nodes]
+
+    def count(self, scope=None):
+        """Indexed images in scope, summed over the nodes"""
+        stale = self._stale_rows()
+        payload = {'scope': scope_to_json(scope), 'stale': stale}
+        images = sum(future.result()['images'] for _, future in self._scatter('/count', payload))
+        self._forget_stale(stale)
+        return images
+
+    def iter_search(self, query_encodings, max_distance, scope=None, limit=None):
+        """ClusterSearch over every node's best `limit` original names per query face
+
+        Deleted or changed images are dropped by the nodes before they rank,
+        so each node's best `limit` live matches always include the best
+        `limit` overall, and ranking the merged matches gives the same top
+        results as one index would.
+        """
+        queries = np.asarray(query_encodings, dtype=np.float32)
+        stale = self._stale_rows()
+        payload = {'queries': queries.tolist(), 'max_distance': max_distance,
+                   'scope': scope_to_json(scope), 'limit': limit, 'stale': stale}
+        # Sent now, so the caller may release its lock while the nodes scan
+        futures = [future for _, future in self._scatter('/search', payload)]
+        return ClusterSearch(futures, len(queries), on_complete=lambda: self._forget_stale(stale))
+
+
+class ClusterSearch:
+    """Yields (matches, images scanned so far) as each node answers
+
+    matches are (query face, image path, original name, distance) like
+    GalleryIndex.iter_search. overflowed[face] is set once a node left matches
+    out to stay within the limit: more pages exist even if the merged matches
+    fit in one. images is the number of indexed images in scope, known once
+    every node has answered (None until then).
+    """
+
+    def __init__(self, futures, faces, on_complete=None):
+        self.overflowed = [False] * faces
+        self.images = None
+        self._on_complete = on_complete
+        self._results = self._gather(futures)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._results)
+
+    def _gather(self, futures):
+        scanned = images = 0
+        for answered, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            scanned += result['scanned']
+            images += result['images']
+            self.overflowed = [a or b for a, b in zip(self.overflowed, result['overflowed'])]
+            if answered == len(futures):
+                self.images = images
+                if self._on_complete is not None:
+                    self._on_complete()
+            yield [tuple(match) for match in result['matches']], scanned
+
+
+def main():
+    global node_index, NODE, NODES
+    parser = argparse.ArgumentParser(description="Serve one slice of the face index for scatter-gather search")
+    parser.add_argument('--node', type=int, default=0, help="This node's number, from 0")
+    parser.add_argument('--nodes', type=int, default=1, help="Total number of nodes")
+    parser.add_argument('--port', type=int, help=f"Port to listen on (default: {BASE_PORT} + node)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--photos-root', default=PHOTOS_ROOT, help="Gallery folder the cache was built for")
+    parser.add_argument('--backend', default='exact', choices=('exact', 'ivf', 'hnsw'), help="Search backend")
+    parser.add_argument('--cache-db', default=face_cache.FACE_CACHE_DB, help="Face cache database to load")
+    args = parser.parse_args()
+    if not 0 <= args.node < args.nodes:
+        parser.error("--node must be between 0 and --nodes - 1")
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(message)s')
+    NODE, NODES = args.node, args.nodes
+    face_cache.FACE_CACHE_DB = args.cache_db
+    setup_face_cache()
+    node_index = ShardedGalleryIndex(args.photos_root, lambda: make_ann_index(args.backend))
+    with node_index_lock:
+        refresh_node_index()
+    port = args.port or BASE_PORT + args.node
+    logger.info(f"🛰️  Node {NODE} of {NODES} serving {len(node_index)} images on http://{args.host}:{port}")
+    app.run(host=args.host, port=port, threaded=True)
+
+if __name__ == "__main__":
+    main()
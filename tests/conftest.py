@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import face_cache
+
+
+@pytest.fixture
+def face_cache_db(tmp_path, monkeypatch):
+    """A fresh face_cache.db for one test"""
+    db_path = str(tmp_path / 'face_cache.db')
+    monkeypatch.setattr(face_cache, 'FACE_CACHE_DB', db_path)
+    yield db_path
+    conn = getattr(face_cache._local, 'conn', None)
+    if conn is not None and face_cache._local.key[1] == db_path:
+        conn.close()
+        face_cache._local.conn = None
@@ -0,0 +1,57 @@
+import numpy as np
+from ann_index import IVFIndex
+from gallery_index import GalleryIndex
+import gallery_shards
+from gallery_shards import ShardedGalleryIndex, ANN_MIN_SHARD_ROWS
+
+
+def random_encodings(rng, faces):
+    return rng.normal(size=(faces, 128)).astype(np.float32) * 0.1
+
+
+def test_ivf_update_matches_full_assignment():
+    rng = np.random.default_rng(0)
+    index = GalleryIndex(IVFIndex(min_rows=100))
+    for i in range(600):
+        index.add(f'/p/{i}.jpg', random_encodings(rng, 1 + i % 3), f'n{i}', 'h', f'c{i}')
+    query = random_encodings(rng, 1)
+    list(index.iter_search(query, 0.5))
+    ivf = index.ann_index
+    assigned = []
+    nearest = ivf._nearest_centroids
+    ivf._nearest_centroids = lambda vectors, k: (assigned.append(len(vectors)), nearest(vectors, k))[1]
+
+    index.add('/p/new.jpg', random_encodings(rng, 2), 'new', 'h', 'cnew')
+    index.add('/p/7.jpg', random_encodings(rng, 1), 'n7', 'h2', 'c7-edited')
+    index.remove('/p/3.jpg')
+    list(index.iter_search(query, 0.5, exact=True))
+
+    # Only the three new rows are assigned, and the result equals a full assignment
+    assert assigned == [3]
+    np.testing.assert_array_equal(ivf._assignments, nearest(index.matrix, 1)[:, 0])
+
+
+def test_shards_use_ann_only_for_large_searches(monkeypatch):
+    rng = np.random.default_rng(1)
+    index = ShardedGalleryIndex('/photos', lambda: IVFIndex())
+    for month in range(1, 4):
+        for i in range(ANN_MIN_SHARD_ROWS):
+            index.add(f'/photos/2020/{month:02d}/{i}.jpg', random_encodings(rng, 1), f'{month}-{i}')
+    probed = []
+
+    def candidates(query):
+        probed.append(query)
+        return np.empty(0, dtype=np.int64)
+
+    for shard in index.shards.values():
+        shard.ann_index.candidates = candidates
+    list(index.iter_search(random_encodings(rng, 1), 0.5))
+
+    # Each shard has an ANN index, but together they are below ANN_MIN_ROWS, so every face is scanned
+    assert all(shard.ann_index.ready for shard in index.shards.values())
+    assert probed == []
+
+    # Past ANN_MIN_ROWS faces in total the shards' ANN indexes are used
+    monkeypatch.setattr(gallery_shards, 'ANN_MIN_ROWS', 2 * ANN_MIN_SHARD_ROWS)
+    list(index.iter_search(random_encodings(rng, 1), 0.5))
+    assert len(probed) == len(index.shards)
@@ -0,0 +1,74 @@
+import os
+import numpy as np
+from face_cache import setup_face_cache, cache_face_encodings_batch
+from gallery_shards import ShardedGalleryIndex
+from encoding_store import export_encoding_store, load_encoding_store, read_manifest
+
+ROOT = os.path.normpath('/gallery')
+
+
+def cache_rows(rng, count, start=0):
+    rows = []
+    for i in range(start, start + count):
+        folder = ('2015', f'{1 + i % 3:02d} month', f'0{1 + i % 3}-0{1 + i % 3}-2015 - event')
+        encodings = rng.normal(size=(1 + i % 3, 128)).astype(np.float32) * 0.05
+        # Every tenth photo is a byte-identical copy of the one before it
+        content_hash = f'c{i - 1}' if i % 10 == 9 else f'c{i}'
+        if i % 10 == 9:
+            encodings = rows[-1][1]
+        rows.append((os.path.join(ROOT, *folder, f'{i}.jpg'), encodings, f'{i}', f'h{i}', content_hash))
+    rows.append((os.path.join(ROOT, 'misc', f'faceless{start}.jpg'), [], 'faceless', 'h', None))
+    setup_face_cache()
+    cache_face_encodings_batch(rows)
+    return rows
+
+
+def search(index, queries):
+    return sorted(m for matches, _ in index.iter_search(queries, 0.9) for m in matches)
+
+
+def test_export_reload_and_search(face_cache_db, tmp_path):
+    rng = np.random.default_rng(0)
+    rows = cache_rows(rng, 60)
+    store_dir = str(tmp_path / 'encoding_store')
+    manifest = export_encoding_store(store_dir, ROOT)
+    assert manifest['images'] == len(rows) - 1  # The faceless photo is kept but not counted
+
+    expected = ShardedGalleryIndex(ROOT)
+    for image_path, encodings, original_name, file_hash, content_hash in rows:
+        expected.add(image_path, encodings, original_name, file_hash, content_hash)
+    index = load_encoding_store(store_dir, ROOT)
+    assert len(index) == len(expected)
+    assert index.file_hash(rows[-1][0]) == 'h'
+    queries = np.stack([rows[0][1][0], rows[25][1][0]])
+    matches = search(index, queries)
+    assert matches and matches == search(expected, queries)
+
+    # Changing a mapped shard copies it into private memory first
+    index.add(rows[0][0], rows[1][1], '0', 'h-new', 'c-new')
+    assert index.file_hash(rows[0][0]) == 'h-new'
+    assert (0, rows[0][0], '0') in [m[:3] for m in search(index, rows[1][1][:1])]
+
+    assert load_encoding_store(store_dir, '/another/gallery') is None
+    assert load_encoding_store(str(tmp_path / 'missing'), ROOT) is None
+
+
+def test_reexport_keeps_the_mapped_version(face_cache_db, tmp_path):
+    rng = np.random.default_rng(1)
+    rows = cache_rows(rng, 20)
+    store_dir = str(tmp_path / 'encoding_store')
+    first = export_encoding_store(store_dir, ROOT)['version']
+    index = load_encoding_store(store_dir, ROOT)
+    queries = rows[0][1][:1]
+    before = search(index, queries)
+
+    cache_rows(rng, 20, start=100)
+    second = export_encoding_store(store_dir, ROOT)['version']
+    assert read_manifest(store_dir)['version'] == second != first
+    # The process started before the export still searches its mapped version
+    assert os.path.isdir(os.path.join(store_dir, first))
+    assert search(index, queries) == before
+    assert len(load_encoding_store(store_dir, ROOT)) == len(index) + 20
+
+    third = export_encoding_store(store_dir, ROOT)['version']
+    assert sorted(name for name in os.listdir(store_dir) if name.startswith('v')) == sorted([second, third])
@@ -0,0 +1,60 @@
+import pickle
+import sqlite3
+import numpy as np
+import face_cache
+
+
+def create_pickle_schema(db_path, rows):
+    """A face_cache table as written before encodings were stored as float32 rows"""
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE face_cache (
+            image_path TEXT PRIMARY KEY,
+            face_encodings BLOB,
+            file_hash TEXT,
+            last_modified REAL,
+            original_name TEXT
+        )
+    ''')
+    conn.executemany('INSERT INTO face_cache VALUES (?, ?, ?, ?, ?)',
+                     [(path, pickle.dumps(encodings), f'hash-{path}', 1.0, name)
+                      for path, encodings, name in rows])
+    conn.commit()
+    conn.close()
+
+
+def test_migrates_pickled_encodings(face_cache_db):
+    rng = np.random.default_rng(0)
+    two_faces = [rng.normal(size=128), rng.normal(size=128)]
+    one_face = [rng.normal(size=128)]
+    create_pickle_schema(face_cache_db, [
+        ('/photos/a.jpg', two_faces, 'a'),
+        ('/photos/b.jpg', one_face, 'b'),
+        ('/photos/empty.jpg', [], 'empty'),
+    ])
+
+    face_cache.setup_face_cache()
+
+    conn = face_cache.get_connection()
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == face_cache.SCHEMA_VERSION
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(face_cache)')}
+    assert {'face_count', 'content_hash', 'error'} <= columns
+
+    rows = {path: (encodings, file_hash, name, content_hash)
+            for path, encodings, file_hash, name, _, content_hash in face_cache.iter_cached_face_encodings()}
+    assert set(rows) == {'/photos/a.jpg', '/photos/b.jpg', '/photos/empty.jpg'}
+    np.testing.assert_allclose(rows['/photos/a.jpg'][0], np.array(two_faces, dtype=np.float32))
+    np.testing.assert_allclose(rows['/photos/b.jpg'][0], np.array(one_face, dtype=np.float32))
+    assert rows['/photos/empty.jpg'][0].shape == (0, 128)
+    assert rows['/photos/a.jpg'][1:] == ('hash-/photos/a.jpg', 'a', None)
+    assert face_cache.get_cached_file_hashes()['/photos/b.jpg'] == 'hash-/photos/b.jpg'
+
+
+def test_migration_runs_once(face_cache_db):
+    create_pickle_schema(face_cache_db, [('/photos/a.jpg', [np.ones(128)], 'a')])
+    face_cache.setup_face_cache()
+    face_cache.cache_face_encodings('/photos/c.jpg', [np.zeros(128)], 'c')
+
+    # A second start must not try to unpickle the float32 blobs
+    face_cache.setup_face_cache()
+    assert sorted(path for path, *_ in face_cache.iter_cached_face_encodings()) == ['/photos/a.jpg', '/photos/c.jpg']
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from gallery_index import GalleryIndex, TopMatches
+
+
+def brute_force_best(offers, limit):
+    """[(key, value, distance)] closest first: each key's closest offer, then the best `limit` keys"""
+    best = {}
+    for key, value, distance in offers:
+        if key not in best or distance < best[key][1]:
+            best[key] = (value, distance)
+    ranked = sorted(((k, v, d) for k, (v, d) in best.items()), key=lambda item: item[2])
+    return ranked[:limit], len(best) > (limit if limit is not None else len(best))
+
+
+@pytest.mark.parametrize('limit', [None, 1, 3, 10, 50])
+def test_top_matches_equals_brute_force(limit):
+    rng = np.random.default_rng(limit or 0)
+    offers = [(f'k{rng.integers(40)}', f'v{i}', float(rng.random())) for i in range(500)]
+    top = TopMatches(limit)
+    for key, value, distance in offers:
+        top.offer(key, value, distance)
+
+    expected, overflowed = brute_force_best(offers, limit)
+    assert top.ranked() == expected
+    assert top.ranked(2, 5) == expected[2:5]
+    assert top.overflowed == overflowed
+    for key, value, distance in expected:
+        assert top.get(key) == (value, distance)
+    if limit is not None and len(expected) == limit:
+        assert top.worst_distance() == expected[-1][2]
+
+
+def test_search_with_top_matches_equals_brute_force():
+    rng = np.random.default_rng(1)
+    index = GalleryIndex()
+    rows = []  # (path, name, encodings)
+    for i in range(300):
+        encodings = rng.normal(size=(1 + i % 4, 128)).astype(np.float32) * 0.05
+        # Several photos share an original name, like "download.jpg" in many folders
+        path, name = f'/p/{i}/photo.jpg', f'n{i % 60}.jpg'
+        index.add(path, encodings, name, f'h{i}', f'c{i}')
+        rows.append((path, name, encodings))
+    queries = rng.normal(size=(2, 128)).astype(np.float32) * 0.05
+
+    for limit in (None, 5):
+        best_by_name = [TopMatches(limit) for _ in queries]
+        for matches, _ in index.iter_search(queries, 0.9, chunk_images=37):
+            for face, path, name, distance in matches:
+                best_by_name[face].offer(name, path, distance)
+        for face, query in enumerate(queries):
+            offers = [(name, path, float(np.linalg.norm(encodings - query, axis=1).min()))
+                      for path, name, encodings in rows]
+            expected, _ = brute_force_best([o for o in offers if o[2] <= 0.9], limit)
+            ranked = best_by_name[face].ranked()
+            assert ranked
+            assert [(k, v) for k, v, _ in ranked] == [(k, v) for k, v, _ in expected]
+            assert np.allclose([d for _, _, d in ranked], [d for _, _, d in expected], atol=1e-4)
@@ -0,0 +1,35 @@
+import os
+from gallery_manifest import GalleryManifest
+
+
+def touch(path, mtime):
+    with open(path, 'wb') as f:
+        f.write(b'jpeg')
+    os.utime(path, (mtime, mtime))
+
+
+def test_scan_changes_lists_paths_of_changed_folders(face_cache_db, tmp_path):
+    root = tmp_path / 'photos'
+    for folder in ('a', 'b', 'c'):
+        (root / folder).mkdir(parents=True)
+        touch(root / folder / '1.jpg', 1000)
+        os.utime(root / folder, (1000, 1000))
+    manifest = GalleryManifest(str(root))
+    files, changed = manifest.scan_changes()
+    assert len(files) == 3 and changed == set(files)
+
+    # Reloaded from face_cache.db: nothing changed on disk
+    manifest = GalleryManifest(str(root))
+    assert manifest.scan_changes() == (files, set())
+
+    touch(root / 'a' / '2.jpg', 2000)
+    os.utime(root / 'a', (2000, 2000))
+    os.remove(root / 'c' / '1.jpg')
+    os.rmdir(root / 'c')
+    os.utime(root, (2000, 2000))
+    files, changed = manifest.scan_changes()
+    a, c = str(root / 'a'), str(root / 'c')
+    assert set(files) == {os.path.join(a, '1.jpg'), os.path.join(a, '2.jpg'), str(root / 'b' / '1.jpg')}
+    # Folder a's old and new listing, and everything that was in the removed folder c
+    assert changed == {os.path.join(a, '1.jpg'), os.path.join(a, '2.jpg'), os.path.join(c, '1.jpg')}
+    assert manifest.scan_changes()[1] == set()
@@ -0,0 +1,95 @@
+import os
+import numpy as np
+import pytest
+from gallery_shards import ShardedGalleryIndex, SearchScope, folder_period
+
+ROOT = os.path.normpath('/gallery')
+# folder -> event date (None for undated folders)
+FOLDERS = {
+    '2015/01 jan/06-01-2015 - party': (2015, 1, 6),
+    '2015/01 jan/20-01-2015 - trip': (2015, 1, 20),
+    '2015/02 feb/03-02-2015 - ski': (2015, 2, 3),
+    '2016/07 jul/14-07-2016 - beach': (2016, 7, 14),
+    'misc': None,
+}
+SCOPES = [
+    None,
+    SearchScope(folder='2015/01 jan/06-01-2015 - party'),
+    SearchScope(folder='2015'),
+    SearchScope((2015, 1, 10), (2015, 2, 28)),
+    SearchScope((2016, 1, 1), None),
+    SearchScope(None, (2015, 1, 6), folder='2015/01 jan'),
+]
+
+
+def build_gallery(seed):
+    """ShardedGalleryIndex plus [(path, folder, content_hash, encodings)] of every image,
+    about a third of them byte-identical copies of an earlier image in any folder"""
+    rng = np.random.default_rng(seed)
+    index = ShardedGalleryIndex(ROOT)
+    images = []
+    folders = list(FOLDERS)
+    for i in range(200):
+        folder = folders[rng.integers(len(folders))]
+        if images and rng.random() < 0.35:
+            _, _, content_hash, encodings = images[rng.integers(len(images))]
+            name = f'download ({i})'
+        else:
+            content_hash, name = f'c{i}', f'photo{i}'
+            encodings = rng.normal(size=(1 + i % 3, 128)).astype(np.float32) * 0.05
+        path = os.path.join(ROOT, *folder.split('/'), f'{name}.jpg')
+        index.add(path, encodings, name, f'h{i}', content_hash)
+        images.append((path, folder, content_hash, encodings))
+    return index, images
+
+
+def in_scope(folder, scope):
+    if scope is None:
+        return True
+    if scope.folder is not None and not (folder + '/').startswith(scope.folder + '/'):
+        return False
+    if scope.date_from is None and scope.date_to is None:
+        return True
+    date = FOLDERS[folder]
+    return (date is not None and (scope.date_from is None or date >= scope.date_from)
+            and (scope.date_to is None or date <= scope.date_to))
+
+
+@pytest.mark.parametrize('scope', SCOPES)
+def test_scoped_search_equals_brute_force(scope):
+    index, images = build_gallery(0)
+    queries = np.stack([images[0][3][0], images[5][3][0] + 0.01]).astype(np.float32)
+    # Copies share one entry per period shard, so results are unique per shard and content
+    contents = {path: (folder_period(folder)[0], content_hash) for path, folder, content_hash, _ in images}
+    scoped_paths = {path for path, folder, _, _ in images if in_scope(folder, scope)}
+
+    found = {}
+    for matches, _ in index.iter_search(queries, 0.9, chunk_images=16, scope=scope):
+        for face, path, name, distance in matches:
+            # Every match is an in-scope path, listed once per content
+            assert path in scoped_paths
+            assert (face, contents[path]) not in found
+            found[face, contents[path]] = distance
+
+    expected = {}
+    for path, folder, content_hash, encodings in images:
+        if path in scoped_paths:
+            for face, query in enumerate(queries):
+                distance = float(np.linalg.norm(encodings - query, axis=1).min())
+                if distance <= 0.9:
+                    expected[face, contents[path]] = distance
+    assert found.keys() == expected.keys()
+    assert np.allclose([found[k] for k in expected], list(expected.values()), atol=1e-4)
+
+
+def test_copy_in_scope_is_found_when_representative_is_not():
+    index = ShardedGalleryIndex(ROOT)
+    encodings = np.full((1, 128), 0.05, dtype=np.float32)
+    trip = os.path.join(ROOT, '2015', '01 jan', '20-01-2015 - trip', 'download.jpg')
+    party = os.path.join(ROOT, '2015', '01 jan', '06-01-2015 - party', 'download (1).jpg')
+    index.add(trip, encodings, 'download', 'h1', 'same')
+    index.add(party, encodings, 'download (1)', 'h2', 'same')
+
+    scope = SearchScope(folder='2015/01 jan/06-01-2015 - party')
+    matches = [m for chunk, _ in index.iter_search(encodings, 0.5, scope=scope) for m in chunk]
+    assert [(path, name) for _, path, name, _ in matches] == [(party, 'download (1)')]
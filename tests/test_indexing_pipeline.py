@@ -0,0 +1,57 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+from indexing_pipeline import IndexingPipeline
+
+
+def encode(item):
+    if item == 3:
+        os._exit(1)  # A worker killed mid-task, e.g. out of memory
+    return [item], 0.0
+
+
+def make_pipeline(written, decode_threads=2):
+    return IndexingPipeline(decode=lambda task: task, encode=encode, write=written.extend,
+                            decode_threads=decode_threads, encode_workers=2, write_batch_size=1)
+
+
+def pipeline_threads():
+    return [t for t in threading.enumerate() if t.name == 'writer' or t.name.startswith('decode-')]
+
+
+def test_runs_every_task():
+    written = []
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        assert make_pipeline(written).run([0, 1, 2], executor)
+    assert sorted(written) == [0, 1, 2]
+
+
+def test_rejects_no_decode_threads():
+    with pytest.raises(ValueError):
+        make_pipeline([], decode_threads=0)
+
+
+def test_dead_worker_stops_the_run():
+    written = []
+    executor = ProcessPoolExecutor(max_workers=2)
+    assert not make_pipeline(written).run(range(50), executor)
+    assert 3 not in written
+    for thread in pipeline_threads():
+        thread.join(timeout=5)
+    assert not pipeline_threads()
+
+
+def test_broken_pool_on_submit_stops_the_run():
+    class BrokenExecutor:
+        def submit(self, fn, *args):
+            raise BrokenProcessPool("A worker process terminated abruptly")
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            pass
+
+    assert not make_pipeline([]).run(range(20), BrokenExecutor())
+    for thread in pipeline_threads():
+        thread.join(timeout=5)
+    assert not pipeline_threads()
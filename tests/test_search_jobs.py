@@ -0,0 +1,63 @@
+import time
+import itertools
+import threading
+from search_jobs import SearchJob, format_event
+
+
+def finished_job(search_fn):
+    job = SearchJob()
+    job.run(search_fn)
+    assert job.is_finished()
+    return job
+
+
+def search(progress):
+    progress('progress', {'scanned': 10})
+    progress('match', {'matches': [{'path': 'a.jpg'}]})
+    return {'faces': []}
+
+
+def test_stream_ends_with_done():
+    job = finished_job(search)
+    events = list(itertools.islice(job.stream_events(0, keepalive_seconds=5), 10))
+    assert [e.split('\n')[1] for e in events] == ['event: status', 'event: progress', 'event: match', 'event: done']
+
+
+def test_reconnect_after_done_gets_final_event_and_stops():
+    job = finished_job(search)
+    last = len(job._events) - 1
+    for cursor in (last + 1, last + 5):
+        start = time.monotonic()
+        events = list(itertools.islice(job.stream_events(cursor, keepalive_seconds=5), 10))
+        # No keep-alive loop and no wait: the final event is sent again and the stream ends
+        assert events == [format_event(last, 'done', {'faces': []})]
+        assert time.monotonic() - start < 1
+
+
+def test_reconnect_after_error_gets_error_event():
+    def failing(progress):
+        raise RuntimeError('boom')
+
+    job = finished_job(failing)
+    events = list(itertools.islice(job.stream_events(len(job._events), keepalive_seconds=5), 10))
+    assert len(events) == 1 and 'event: error' in events[0] and 'boom' in events[0]
+
+
+def test_keepalive_only_after_waiting():
+    job = SearchJob()
+    release = threading.Event()
+
+    def slow_search(progress):
+        release.wait(5)
+        return {'faces': []}
+
+    worker = threading.Thread(target=job.run, args=(slow_search,))
+    worker.start()
+    stream = job.stream_events(1, keepalive_seconds=0.2)
+    start = time.monotonic()
+    assert next(stream) == ": keep-alive\n\n"
+    assert time.monotonic() - start >= 0.15
+    release.set()
+    rest = list(itertools.islice(stream, 10))
+    worker.join()
+    assert 'event: done' in rest[-1]
@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+import urllib.request
+import numpy as np
+import pytest
+from face_cache import setup_face_cache, cache_face_encodings_batch, get_cached_file_hashes
+from gallery_index import TopMatches
+from shard_server import ShardCluster, node_for_path
+
+SHARD_SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'shard_server.py')
+NODES = 3
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def cluster_nodes(face_cache_db, tmp_path):
+    """(photos root, start) where start() runs NODES shard_server.py nodes over face_cache_db and returns their urls"""
+    root = str(tmp_path / 'photos')
+    processes = []
+
+    def start():
+        urls = []
+        for node in range(NODES):
+            port = free_port()
+            processes.append(subprocess.Popen(
+                [sys.executable, SHARD_SERVER, '--node', str(node), '--nodes', str(NODES), '--port', str(port),
+                 '--photos-root', root, '--cache-db', face_cache_db],
+                env=dict(os.environ, LOG_LEVEL='WARNING'),
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            urls.append(f'http://127.0.0.1:{port}')
+        deadline = time.time() + 30
+        for url in urls:
+            while True:
+                try:
+                    with urllib.request.urlopen(url + '/status', timeout=1) as response:
+                        json.load(response)
+                    break
+                except OSError:
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(0.1)
+        return urls
+
+    yield root, start
+    for process in processes:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def test_cluster_drops_stale_rows_before_ranking(cluster_nodes):
+    root, start = cluster_nodes
+    rng = np.random.default_rng(0)
+    query = rng.normal(size=(1, 128)).astype(np.float32) * 0.05
+    rows = []  # (image_path, encodings, original_name, file_hash, content_hash)
+    for i in range(90):
+        # Original names repeat across folders (and so across nodes)
+        encodings = query + rng.normal(size=(1 + i % 2, 128)).astype(np.float32) * 0.03
+        rows.append((os.path.join(root, f'folder{i}', f'n{i % 30}.jpg'), encodings, f'n{i % 30}', f'h{i}', f'c{i}'))
+
+    # Deleted and changed files whose cached rows are closer than any live match,
+    # on the same node as a live photo of the same name
+    live_paths = [row[0] for row in rows]
+    deleted = next(path for path in (os.path.join(root, f'deleted{i}', 'n0.jpg') for i in range(100))
+                   if node_for_path(path, root, NODES) == node_for_path(rows[0][0], root, NODES))
+    changed = rows[1][0]
+    rows.append((deleted, query.copy(), 'n0', 'h-deleted', 'c-deleted'))
+    rows[1] = (changed, query.copy(), 'n1', 'h-old', 'c-old')
+    # Another gallery sharing the face cache
+    elsewhere = os.path.join(os.path.dirname(root), 'other', 'n2.jpg')
+    rows.append((elsewhere, query.copy(), 'n2', 'h-other', 'c-other'))
+    setup_face_cache()
+    cache_face_encodings_batch(rows)
+
+    urls = start()
+    cluster = ShardCluster(urls, root)
+    assert elsewhere not in cluster.refresh()
+    cluster.retain([p for p in live_paths if p != changed])  # changed's hash no longer matches its file
+    live = [row for row in rows if row[0] in set(live_paths) - {changed}]
+    # Deleted from the face cache, so a node restarting later doesn't load them again
+    cached = get_cached_file_hashes()
+    assert deleted not in cached and changed not in cached and elsewhere in cached
+    assert cluster.count() == len(live)
+    # Every node has dropped them, so they are no longer sent
+    assert cluster._stale_rows() == []
+
+    for limit in (None, 1, 2, 5, 40):
+        merged = TopMatches(limit)
+        search = cluster.iter_search(query, max_distance=10.0, limit=limit)
+        for matches, scanned in search:
+            for face, img_path, original_name, distance in matches:
+                merged.offer(original_name, img_path, distance)
+        assert scanned == search.images == len(live)
+
+        expected = TopMatches(limit)
+        for image_path, encodings, original_name, _, _ in live:
+            expected.offer(original_name, image_path, float(np.linalg.norm(encodings - query, axis=1).min()))
+        assert [(k, v) for k, v, _ in merged.ranked()] == [(k, v) for k, v, _ in expected.ranked()]
+        assert np.allclose([d for *_, d in merged.ranked()], [d for *_, d in expected.ranked()], atol=1e-4)
+        # has_more in app.py: the merge overflowed or a node cut its matches
+        assert (merged.overflowed or search.overflowed[0]) == (limit is not None and limit < 30)
+
+    # A search every node answered stops sending the rows it listed too
+    cluster.remove(live[0][0])
+    assert cluster._stale_rows() == [(live[0][0], live[0][3])]
+    search = cluster.iter_search(query, max_distance=10.0)
+    assert all(img_path != live[0][0] for matches, _ in search for _, img_path, _, _ in matches)
+    assert search.images == len(live) - 1 and cluster._stale_rows() == []
@@ -0,0 +1,37 @@
+import os
+import pytest
+from PIL import Image
+import thumbnails
+
+
+@pytest.fixture
+def photo(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'THUMBNAIL_DIR', str(tmp_path / 'thumbnail_cache'))
+    monkeypatch.setattr(thumbnails, '_cache_bytes', None)
+    path = str(tmp_path / 'photo.jpg')
+    Image.new('RGB', (1200, 800), 'red').save(path)
+    return path
+
+
+def cache_files():
+    return [os.path.join(root, f) for root, _, files in os.walk(thumbnails.THUMBNAIL_DIR) for f in files]
+
+
+def test_thumbnail_is_cached(photo):
+    path = thumbnails.get_thumbnail(photo, fmt='JPEG')
+    with Image.open(path) as thumb:
+        assert max(thumb.size) == thumbnails.THUMBNAIL_SIZE
+    assert thumbnails.get_thumbnail(photo, fmt='JPEG') == path
+    assert cache_files() == [path]
+
+
+def test_failed_save_leaves_no_temporary_file(photo, monkeypatch):
+    def save_partially(img, fp, *args, **kwargs):
+        with open(fp, 'wb') as f:
+            f.write(b'partial')
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(Image.Image, 'save', save_partially)
+    with pytest.raises(OSError):
+        thumbnails.get_thumbnail(photo, fmt='JPEG')
+    assert cache_files() == []
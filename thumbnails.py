@@ -0,0 +1,107 @@
+"""
+Thumbnail cache for search results
+Builds downscaled JPEG/WebP previews of gallery photos with Pillow and
+keeps them in a size-bounded on-disk cache, so result pages transfer a
+few kilobytes per match instead of the full-resolution original.
+
+Cache files are addressed by a hash of the source path, its
+change-detection hash (mtime + size), the size and the format, so an
+edited photo automatically gets a fresh thumbnail. The least recently
+served files are evicted once the cache grows past THUMBNAIL_CACHE_MAX_BYTES.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from PIL import Image, ImageOps
+from face_cache import get_file_hash
+
+# Next to this file, so the cache does not depend on the directory the app is started from
+THUMBNAIL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "thumbnail_cache")
+THUMBNAIL_SIZE = 384  # Longest side in pixels (2x the h-48 result tiles)
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+THUMBNAIL_FORMATS = {'WEBP': '.webp', 'JPEG': '.jpg'}
+
+_cache_bytes = None  # Lazily measured size of THUMBNAIL_DIR
+_cache_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+def get_thumbnail_path(image_path, size=THUMBNAIL_SIZE, fmt='WEBP'):
+    """Cache location for one photo at one size and format"""
+    key = f"{image_path}|{get_file_hash(image_path)}|{size}|{fmt}"
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(THUMBNAIL_DIR, digest[:2], digest + THUMBNAIL_FORMATS[fmt])
+
+def render_thumbnail(image_path, out_path, size, fmt):
+    with Image.open(image_path) as img:
+        # Let the JPEG decoder downscale while decoding (much faster for large photos)
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size), Image.LANCZOS)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        # Write to a temporary name so concurrent requests never see a partial file
+        tmp_path = f"{out_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            img.save(tmp_path, fmt, quality=THUMBNAIL_QUALITY)
+        except BaseException:
+            # A failed save (disk full, encoder error) must not leave its partial file behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, out_path)
+    return os.path.getsize(out_path)
+
+def get_thumbnail(image_path, size=THUMBNAIL_SIZE, fmt='WEBP'):
+    """Return the cached thumbnail for a photo, generating it on first use"""
+    out_path = get_thumbnail_path(image_path, size, fmt)
+    try:
+        # Refresh the mtime so eviction keeps recently served thumbnails
+        os.utime(out_path)
+        return out_path
+    except FileNotFoundError:
+        pass
+    added = render_thumbnail(image_path, out_path, size, fmt)
+    record_cache_growth(added)
+    return out_path
+
+def record_cache_growth(added_bytes):
+    global _cache_bytes
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(size for _, size, _ in iter_cache_files())
+        else:
+            _cache_bytes += added_bytes
+        if _cache_bytes > THUMBNAIL_CACHE_MAX_BYTES:
+            _cache_bytes = evict_thumbnails(THUMBNAIL_CACHE_MAX_BYTES * 0.9)
+
+def iter_cache_files():
+    """Yield (path, size, mtime) for every cached thumbnail"""
+    for root, _, files in os.walk(THUMBNAIL_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            yield path, stat.st_size, stat.st_mtime
+
+def evict_thumbnails(target_bytes):
+    """Delete least recently used thumbnails until the cache fits target_bytes"""
+    files = sorted(iter_cache_files(), key=lambda f: f[2])
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for path, size, _ in files:
+        if total <= target_bytes:
+            break
+        try:
+            os.unlink(path)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+    logger.info(f"🧹 Evicted {removed} thumbnails, cache is now {total / 1024 / 1024:.0f} MB")
+    return total
@@ -1,150 +1,151 @@
 import os
+import logging
 import face_recognition
-from flask import Flask, render_template, request, redirect
-from werkzeug.utils import secure_filename
-from PIL import Image
-import uuid
-import shutil
+from flask import (Flask, render_template, request, redirect, send_from_directory, send_file, abort,
+                   jsonify, url_for, Response, stream_with_context)
+from werkzeug.security import safe_join
 from io import BytesIO
-import sqlite3
-import pickle
 import multiprocessing
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import time
-import hashlib
 import numpy as np
 import cv2
 import dlib
+import threading
+from thumbnails import get_thumbnail
+from search_jobs import submit_search_job, get_search_job
+import atexit
+from face_cache import (setup_face_cache, get_cached_face_encodings_batch, cache_face_encodings_batch,
+                        cache_failed_images, get_file_hash)
 
 app = Flask(__name__)
 
 # Paths
 PHOTOS_ROOT = r"C:\Users\User1\Desktop\face recognition - v3\static\photos"  # Set your photos folder
-RESULTS_FOLDER = os.path.join('static', 'results')
-os.makedirs(RESULTS_FOLDER, exist_ok=True)
+GALLERY_CACHE_SECONDS = 24 * 60 * 60  # Browser cache lifetime for served gallery photos
+SSE_KEEPALIVE_SECONDS = 15  # Comment line sent on idle event streams so proxies keep them open
 
 # Face alignment setup
 face_detector = dlib.get_frontal_face_detector()
 predictor_model = dlib.shape_predictor(face_recognition.api.pose_predictor_model_location())
 
-def align_face(image):
-    """Align the largest face in the image and return aligned crop."""
-    try:
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        rects = face_detector(gray, 1)
-
-        if len(rects) == 0:
-            return image  # fallback: no alignment
-
-        # Pick the largest detected face
-        rect = max(rects, key=lambda r: r.width() * r.height())
-
-        # Get landmarks
-        shape = predictor_model(gray, rect)
-        landmarks = [(shape.part(i).x, shape.part(i).y) for i in range(68)]
-
-        # Use eyes for alignment
-        left_eye = np.mean(landmarks[36:42], axis=0)
-        right_eye = np.mean(landmarks[42:48], axis=0)
-
-        dY = right_eye[1] - left_eye[1]
-        dX = right_eye[0] - left_eye[0]
-        angle = np.degrees(np.arctan2(dY, dX))
-        eyes_center = ((left_eye[0] + right_eye[0]) / 2, (left_eye[1] + right_eye[1]) / 2)
-
-        M = cv2.getRotationMatrix2D(eyes_center, angle, scale=1.0)
-        aligned = cv2.warpAffine(image, M, (image.shape[1], image.shape[0]), flags=cv2.INTER_CUBIC)
-
-        return aligned
-    except Exception as e:
-        print(f"⚠️ Face alignment failed: {e}")
-        return image  # fallback
-
-# Caching
-FACE_CACHE_DB = "face_cache.db"
-
-def setup_face_cache():
-    conn = sqlite3.connect(FACE_CACHE_DB)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS face_cache (
-            image_path TEXT PRIMARY KEY,
-            face_encodings BLOB,
-            file_hash TEXT,
-            last_modified REAL,
-            original_name TEXT
-        )
-    ''')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_hash ON face_cache(file_hash)')
-    conn.commit()
-    conn.close()
-
-def get_file_hash(file_path):
-    try:
-        stat = os.stat(file_path)
-        return f"{stat.st_mtime}_{stat.st_size}"
-    except:
-        return "unknown"
-
-def get_cached_face_encodings(image_path):
-    try:
-        conn = sqlite3.connect(FACE_CACHE_DB)
-        cursor = conn.cursor()
-        current_hash = get_file_hash(image_path)
-        cursor.execute('''
-            SELECT face_encodings, original_name FROM face_cache 
-            WHERE image_path = ? AND file_hash = ?
-        ''', (image_path, current_hash))
-        result = cursor.fetchone()
-        conn.close()
-        if result:
-            return pickle.loads(result[0]), result[1]
-        return None, None
-    except:
-        return None, None
-
-def cache_face_encodings(image_path, face_encodings, original_name):
+def rect_to_box(rect, height, width):
+    """dlib rectangle -> face_recognition (top, right, bottom, left), clipped to the image"""
+    return (max(rect.top(), 0), min(rect.right(), width - 1),
+            min(rect.bottom(), height - 1), max(rect.left(), 0))
+
+def align_face_crop(image, rect, landmarks):
+    """Rotate only the region around one face so its eyes are level.
+
+    Returns the rotated crop and the face box inside it.
+    """
+    height, width = image.shape[:2]
+    left_eye = np.mean(landmarks[36:42], axis=0)
+    right_eye = np.mean(landmarks[42:48], axis=0)
+
+    dY = right_eye[1] - left_eye[1]
+    dX = right_eye[0] - left_eye[0]
+    angle = np.degrees(np.arctan2(dY, dX))
+
+    # Crop twice the face size so the rotated face stays inside the crop
+    cx, cy = rect.center().x, rect.center().y
+    half = max(rect.width(), rect.height())
+    x0, y0 = max(cx - half, 0), max(cy - half, 0)
+    x1, y1 = min(cx + half, width), min(cy + half, height)
+    crop = image[y0:y1, x0:x1]
+
+    eyes_center = ((left_eye[0] + right_eye[0]) / 2 - x0, (left_eye[1] + right_eye[1]) / 2 - y0)
+    M = cv2.getRotationMatrix2D(eyes_center, angle, scale=1.0)
+    aligned = cv2.warpAffine(crop, M, (crop.shape[1], crop.shape[0]), flags=cv2.INTER_CUBIC)
+
+    # The face box keeps its size; only its centre moves with the rotation
+    new_cx, new_cy = M @ np.array([cx - x0, cy - y0, 1.0])
+    half_w, half_h = rect.width() / 2, rect.height() / 2
+    crop_h, crop_w = aligned.shape[:2]
+    box = (max(int(new_cy - half_h), 0), min(int(new_cx + half_w), crop_w - 1),
+           min(int(new_cy + half_h), crop_h - 1), max(int(new_cx - half_w), 0))
+    return aligned, box
+
+def encode_aligned_faces(image):
+    """Detect faces once, align each face crop by its eyes and encode it.
+
+    The 68-point landmarks from the single detection pass drive the
+    alignment, and the encoder reuses the known face box instead of
+    running its own detector over the whole (rotated) image again.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    rects = face_detector(gray, 1)
+    height, width = image.shape[:2]
+
+    encodings = []
+    for rect in rects:
+        try:
+            shape = predictor_model(gray, rect)
+            landmarks = [(shape.part(i).x, shape.part(i).y) for i in range(68)]
+            aligned, box = align_face_crop(image, rect, landmarks)
+            encodings.extend(face_recognition.face_encodings(aligned, known_face_locations=[box]))
+        except Exception as e:
+            print(f"⚠️ Face alignment failed: {e}")
+            # fallback: encode the detected face unaligned
+            encodings.extend(face_recognition.face_encodings(
+                image, known_face_locations=[rect_to_box(rect, height, width)]))
+    return encodings
+
+# Long-lived worker pool, created once and reused across searches
+WORKER_COUNT = min(multiprocessing.cpu_count(), 8)
+worker_pool = None
+worker_pool_lock = threading.Lock()
+
+def init_worker():
+    """Load the dlib detector, shape predictor and encoder once per worker"""
+    encode_aligned_faces(np.zeros((32, 32, 3), dtype=np.uint8))
+
+def get_worker_pool():
+    global worker_pool
+    with worker_pool_lock:
+        if worker_pool is None:
+            print(f"⚡ Starting {WORKER_COUNT} persistent workers...")
+            worker_pool = ProcessPoolExecutor(max_workers=WORKER_COUNT, initializer=init_worker)
+            atexit.register(worker_pool.shutdown, wait=False)
+        return worker_pool
+
+def reset_worker_pool(broken_pool):
+    """Drop a pool whose worker died (out of memory, a crash in dlib); the next call starts a fresh one"""
+    global worker_pool
+    with worker_pool_lock:
+        if worker_pool is broken_pool:
+            worker_pool = None
+    broken_pool.shutdown(wait=False)
+
+def encode_missing_images(image_paths):
+    """process_single_image for every path on the worker pool, retried once on a fresh pool if a worker dies"""
+    pool = get_worker_pool()
     try:
-        conn = sqlite3.connect(FACE_CACHE_DB)
-        cursor = conn.cursor()
-        file_hash = get_file_hash(image_path)
-        encodings_blob = pickle.dumps(face_encodings)
-        cursor.execute('''
-            INSERT OR REPLACE INTO face_cache 
-            (image_path, face_encodings, file_hash, last_modified, original_name)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (image_path, encodings_blob, file_hash, time.time(), original_name))
-        conn.commit()
-        conn.close()
-    except:
-        pass
-
-def process_single_image(args):
-    img_path, query_encoding = args
+        return list(pool.map(process_single_image, image_paths, chunksize=8))
+    except BrokenProcessPool:
+        print("❌ A worker died, restarting the worker pool")
+        reset_worker_pool(pool)
+        return list(get_worker_pool().map(process_single_image, image_paths, chunksize=8))
+
+def process_single_image(img_path):
+    original_name = os.path.splitext(os.path.basename(img_path))[0]
     try:
-        cached_encodings, original_name = get_cached_face_encodings(img_path)
-        if cached_encodings is None:
-            gallery_img = face_recognition.load_image_file(img_path)
-            gallery_img = align_face(gallery_img)
-            cached_encodings = face_recognition.face_encodings(gallery_img)
-            if cached_encodings:
-                original_name = os.path.splitext(os.path.basename(img_path))[0]
-                cache_face_encodings(img_path, cached_encodings, original_name)
-        if not cached_encodings:
-            return None
-        best_distance = float('inf')
-        for face_encoding in cached_encodings:
-            dist = face_recognition.face_distance([query_encoding], face_encoding)[0]
-            if dist < best_distance:
-                best_distance = dist
-        return {
-            'path': img_path,
-            'best_distance': best_distance,
-            'original_name': original_name
-        }
+        gallery_img = face_recognition.load_image_file(img_path)
+        encodings = encode_aligned_faces(gallery_img)
+        return {'path': img_path, 'encodings': encodings, 'original_name': original_name, 'error': None}
     except Exception as e:
         print(f"Error processing {img_path}: {e}")
+        return {'path': img_path, 'encodings': [], 'original_name': original_name, 'error': str(e)}
+
+def best_match(img_path, encodings, original_name, query_encoding):
+    if not len(encodings):
         return None
+    return {
+        'path': img_path,
+        'best_distance': float(face_recognition.face_distance(encodings, query_encoding).min()),
+        'original_name': original_name
+    }
 
 def get_all_image_paths(folder):
     exts = ['.jpg', '.jpeg', '.png']
@@ -161,20 +162,14 @@ def get_all_image_paths(folder):
     print(f"🔍 Found {len(img_files)} unique images (filtered duplicates)")
     return img_files
 
-def clear_results_folder():
-    for f in os.listdir(RESULTS_FOLDER):
-        file_path = os.path.join(RESULTS_FOLDER, f)
-        try:
-            if os.path.isfile(file_path):
-                os.unlink(file_path)
-        except Exception:
-            pass
+def get_gallery_path(img_path):
+    """Path of a gallery photo relative to PHOTOS_ROOT, as used in /gallery/ URLs"""
+    return os.path.relpath(img_path, PHOTOS_ROOT).replace(os.sep, '/')
 
 def process_search(search_file):
     image_bytes = search_file.read()
     query_img = face_recognition.load_image_file(BytesIO(image_bytes))
-    query_img = align_face(query_img)
-    query_encodings = face_recognition.face_encodings(query_img)
+    query_encodings = encode_aligned_faces(query_img)
     if not query_encodings:
         return [], []
     query_encoding = query_encodings[0]
@@ -188,15 +183,25 @@ def process_search(search_file):
     total_images = len(all_image_paths)
     print(f"📸 Processing {total_images} images with parallel optimization...")
 
-    args_list = [(img_path, query_encoding) for img_path in all_image_paths]
+    start_time = time.time()
 
-    max_workers = min(multiprocessing.cpu_count(), 8)
-    print(f"⚡ Using {max_workers} parallel workers...")
+    # One batched cache read for the whole gallery; only misses go to the workers
+    cached = get_cached_face_encodings_batch(all_image_paths)
+    missing_paths = [img_path for img_path in all_image_paths if img_path not in cached]
+    print(f"⚡ {len(cached)} cache hits, encoding {len(missing_paths)} images with {WORKER_COUNT} parallel workers...")
 
-    start_time = time.time()
+    encoded = encode_missing_images(missing_paths)
+    # Faceless and unreadable images are cached too, so they are skipped until they change
+    cache_face_encodings_batch(
+        (r['path'], r['encodings'], r['original_name'], None, None) for r in encoded if not r['error']
+    )
+    cache_failed_images((r['path'], r['original_name'], get_file_hash(r['path']), r['error'])
+                        for r in encoded if r['error'])
+    for r in encoded:
+        cached[r['path']] = (r['encodings'], r['original_name'])
 
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        results = list(executor.map(process_single_image, args_list))
+    results = [best_match(img_path, *cached[img_path], query_encoding)
+               for img_path in all_image_paths if img_path in cached]
 
     processing_time = time.time() - start_time
     print(f"⚡ Parallel processing completed in {processing_time:.2f} seconds!")
@@ -218,23 +223,20 @@ def process_search(search_file):
         processed_original_names.add(original_name)
         print(f"Processed: {img_path} (distance: {best_distance:.3f})")
 
-        unique_id = str(uuid.uuid4())[:8]
-        result_filename = f"{unique_id}_{os.path.basename(img_path)}"
-        result_path = os.path.join(RESULTS_FOLDER, result_filename)
-        shutil.copy2(img_path, result_path)
+        gallery_path = get_gallery_path(img_path)
 
         print(f"  📊 Categorizing {original_name}: distance={best_distance:.3f}")
 
         if best_distance <= 0.35:
             strong_matches.append({
-                "path": "results/" + result_filename,
+                "path": gallery_path,
                 "original_name": original_name,
                 "distance": best_distance
             })
             print(f"  ✅ Added to STRONG matches: {original_name} (distance: {best_distance:.3f})")
         elif 0.35 < best_distance <= 0.5:
             doubtful_matches.append({
-                "path": "results/" + result_filename,
+                "path": gallery_path,
                 "original_name": original_name,
                 "distance": best_distance
             })
@@ -269,21 +271,95 @@ def process_search(search_file):
 
     return strong_matches, doubtful_matches
 
+def face_groups(strong, doubtful):
+    """process_search's matches as the per-face groups templates/index.html shows
+
+    v4 searches the first face of the upload only, so there is at most one group.
+    """
+    if not strong and not doubtful:
+        return []
+    return [{'face': 0, 'strong': strong, 'doubtful': doubtful, 'page': 0, 'has_more': False}]
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    strong = []
-    doubtful = []
+    groups = []
     if request.method == 'POST':
-        clear_results_folder()
         if 'file' not in request.files:
             return redirect(request.url)
         file = request.files['file']
         if file and file.filename:
-            strong, doubtful = process_search(file)
-    return render_template('index.html', strong_images=strong, doubtful_images=doubtful)
+            groups = face_groups(*process_search(file))
+    return render_template('index.html', face_groups=groups)
+
+def run_search_job(image_bytes, progress):
+    """Job wrapper around process_search with the result the shared page expects"""
+    progress('progress', {'stage': 'encoding_query'})
+    strong, doubtful = process_search(BytesIO(image_bytes))
+    return {'faces': face_groups(strong, doubtful)}
+
+@app.route('/search', methods=['POST'])
+def start_search():
+    """Start a background search and return its job id (202 Accepted), as in app.py"""
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'error': 'No file uploaded'}), 400
+    job = submit_search_job(run_search_job, file.read())
+    return jsonify({
+        'job_id': job.id,
+        'status_url': url_for('search_status', job_id=job.id),
+        'events_url': url_for('search_events', job_id=job.id),
+    }), 202
+
+@app.route('/search/<job_id>')
+def search_status(job_id):
+    """Current state of a search job, including the result once it is done"""
+    job = get_search_job(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.to_dict())
+
+@app.route('/search/<job_id>/events')
+def search_events(job_id):
+    """Stream a job's progress and result as Server-Sent Events"""
+    job = get_search_job(job_id)
+    if job is None:
+        abort(404)
+    # A reconnecting EventSource resumes after the last event it received
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    start = int(last_event_id) + 1 if last_event_id.isdigit() else 0
+    response = Response(stream_with_context(job.stream_events(start, SSE_KEEPALIVE_SECONDS)),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
+@app.route('/gallery/<path:filename>')
+def gallery_image(filename):
+    """Serve a gallery photo in place instead of copying it for each search"""
+    return send_from_directory(PHOTOS_ROOT, filename, max_age=GALLERY_CACHE_SECONDS)
+
+@app.route('/thumbnails/<path:filename>')
+def thumbnail(filename):
+    """Serve a downscaled preview of a gallery photo from the thumbnail cache"""
+    image_path = safe_join(PHOTOS_ROOT, filename)
+    if image_path is None or not os.path.isfile(image_path):
+        abort(404)
+    fmt = 'WEBP' if 'image/webp' in request.headers.get('Accept', '') else 'JPEG'
+    try:
+        thumb_path = get_thumbnail(image_path, fmt=fmt)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Could not build thumbnail for {filename}: {e}")
+        return gallery_image(filename)
+    response = send_file(thumb_path, max_age=GALLERY_CACHE_SECONDS)
+    response.vary.add('Accept')
+    return response
 
 if __name__ == '__main__':
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(message)s')
     setup_face_cache()
+    # The debug reloader runs this block twice; only the serving process needs warm workers
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_worker_pool()
     print("🚀 High-Performance Face Recognition System Ready!")
     print("⚡ Features: Parallel Processing + Smart Caching + Face Alignment + Zero Quality Loss")
     app.run(debug=True)